@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Parsers of french addresses values (street names and house numbers)
+replacing the regular expressions previously used by the audit
+
+Both parsers give the same results as the regular expressions below (python 2
+semantics: IGNORECASE on ASCII letters only, \s and \d without re.UNICODE),
+HouseNumberParser.is_valid as a full match of HOUSENUMBER, checked by
+tests/test_address.py
+
+STREET = ^((?P<housenumber>(\d+)\s*(<MENTION>)?)\,?\s+)?((?P<type>(<WAY TYPE>))\s+)?(?P<name>(.*))$
+
+HOUSENUMBER = (?:\d+\s*)?(?:(?:<MENTION>)?\s*)?(?:(?:bat\s+[0-9a-z]+\s*)?(?:appt\s+[0-9a-z]+(?:,[0-9a-z]+)*)?|[0-9a-z]+)?
+            | b\.?p\.?\s+[0-9 a-z]+
+"""
+
+import random
+import string
+
+import reference
+
+WHITESPACE = frozenset(u" \t\n\r\f\v")
+DIGITS = frozenset(string.digits)
+ALNUM = frozenset(string.digits + string.ascii_letters)
+
+ASCII_LOWER = dict((ord(c), ord(c.lower())) for c in string.ascii_uppercase)
+BYTES_ASCII_LOWER = string.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def ascii_lower(value):
+    """Lower case of ASCII letters only (as re.IGNORECASE without re.UNICODE)"""
+    if isinstance(value, unicode):
+        return value.translate(ASCII_LOWER)
+    return value.translate(BYTES_ASCII_LOWER)
+
+def latin1(parse):
+    """Byte strings are expected ASCII (as read from PBF files), others are
+    parsed as latin-1 text so that each character still stands for one byte"""
+    def parse_bytes(self, value):
+        try:
+            return parse(self, value)
+        except UnicodeDecodeError:
+            result = parse(self, value.decode("latin-1"))
+            if isinstance(result, tuple):
+                return tuple(None if x is None else x.encode("latin-1") for x in result)
+            return result.encode("latin-1") if isinstance(result, unicode) else result
+    return parse_bytes
+
+def memoize_in(cache_name):
+    """Bounded memo cache of the results in the self.<cache_name> dict, as the
+    same values are repeated all over an OSM file, the cache is emptied once full"""
+    def decorator(parse):
+        def cached(self, value):
+            cache = getattr(self, cache_name)
+            try:
+                result = cache[value]
+                self.hits += 1
+                return result
+            except KeyError:
+                self.misses += 1
+                if len(cache) >= self.cache_size:
+                    cache.clear()
+                result = cache[value] = parse(self, value)
+                return result
+        return cached
+    return decorator
+
+memoize = memoize_in("cache")
+
+def skip(value, i, chars):
+    """Return the position of the first character of value at or after i not in chars"""
+    n = len(value)
+    while i < n and value[i] in chars:
+        i += 1
+    return i
+
+
+class StreetParser(object):
+    """Split a street name into house number, way type and name
+
+    Way types are looked up in a trie: at a given position all way types
+    followed by a white space are found in one walk, then tried in the order
+    of the alternatives (the first one wins, as in a regular expression
+    alternation). Other choices (optional parts, greedy repetitions) are
+    tried in the same order as the regular expression backtracking would,
+    the first one usually being the right one.
+    """
+
+    CACHE_SIZE = 100000
+
+    def __init__(self, alternatives, mentions=reference.MENTIONS, cache_size=CACHE_SIZE):
+        self.cache = {}
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self.mentions = [ascii_lower(m) for m in mentions]
+        self.trie = {}
+        for index, alternative in enumerate(alternatives):
+            node = self.trie
+            for c in ascii_lower(alternative):
+                node = node.setdefault(c, {})
+            if node.get(None) is None:
+                node[None] = index
+
+    def housenumbers(self, value, lower):
+        """Yield (end, housenumber) for each way to match the optional house number"""
+        digits_max = skip(value, 0, DIGITS)
+        for digits_end in range(digits_max, 0, -1):
+            for spaces_end in range(skip(value, digits_end, WHITESPACE), digits_end - 1, -1):
+                mention_ends = [spaces_end + len(m) for m in self.mentions if lower.startswith(m, spaces_end)]
+                for mention_end in mention_ends + [spaces_end]:
+                    comma_ends = [mention_end + 1] if value.startswith(u",", mention_end) else []
+                    for comma_end in comma_ends + [mention_end]:
+                        for end in range(skip(value, comma_end, WHITESPACE), comma_end, -1):
+                            yield end, value[:mention_end]
+        yield 0, None
+
+    def way_types(self, value, lower, start):
+        """Yield (end, way type) for each way to match the optional way type at start"""
+        n = len(value)
+        candidates = []
+        node = self.trie
+        i = start
+        while i < n:
+            node = node.get(lower[i])
+            if node is None:
+                break
+            i += 1
+            if node.get(None) is not None and i < n and value[i] in WHITESPACE:
+                candidates.append((node[None], i))
+
+        for _, type_end in sorted(candidates):
+            for end in range(skip(value, type_end, WHITESPACE), type_end, -1):
+                yield end, value[start:type_end]
+        yield start, None
+
+    @memoize
+    @latin1
+    def parse(self, value):
+        """Return (housenumber, type, name), None when value can not be parsed
+        (line break inside the name)"""
+        lower = ascii_lower(value)
+        for start, housenumber in self.housenumbers(value, lower):
+            for end, way_type in self.way_types(value, lower, start):
+                name = value[end:]
+                newline = name.find(u"\n")
+                if newline == -1:
+                    return housenumber, way_type, name
+                if newline == len(name) - 1:
+                    return housenumber, way_type, name[:-1]
+        return None
+
+
+class HouseNumberParser(object):
+    """State machine over the simplified house number grammar:
+
+    HOUSENUMBER = <PO BOX>
+                | <NUMBER>
+                | <NUMBER> (BIS|TER...)
+                | <NUMBER> (BIS|TER...) <NUMBER>
+                | <NUMBER> APPT {<NUMBER>, ...}
+                | <NUMBER> (BIS|TER...) APPT {<NUMBER>, ...}
+                | <NUMBER> (BIS|TER...) <NUMBER> APPT {<NUMBER>, ...}
+    the first <NUMBER> being optional (as seen in the data)
+    """
+
+    CACHE_SIZE = 100000
+
+    def __init__(self, mentions=reference.MENTIONS, cache_size=CACHE_SIZE):
+        self.cache = {}
+        self.valid_cache = {}
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self.mentions = {}
+        for m in mentions:
+            self.mentions.setdefault(ascii_lower(m)[:1], []).append(ascii_lower(m))
+
+    def keyword(self, value, lower, i, word):
+        """Return the end of '<word>\s+[0-9a-z]+' at i, None if not found"""
+        if not lower.startswith(word, i):
+            return None
+        spaces_end = skip(value, i + len(word), WHITESPACE)
+        if spaces_end == i + len(word):
+            return None
+        end = skip(value, spaces_end, ALNUM)
+        return end if end > spaces_end else None
+
+    def prefix(self, value, lower):
+        """Return the end of the number, mention and spaces prefix"""
+        i = skip(value, 0, DIGITS)
+        if i > 0:
+            i = skip(value, i, WHITESPACE)
+        for m in self.mentions.get(lower[i:i + 1], ()):
+            if lower.startswith(m, i):
+                i += len(m)
+                break
+        return skip(value, i, WHITESPACE)
+
+    def scan(self, value, lower):
+        """Return the end of the longest prefix of value matched by the grammar
+        (same as the regular expression match)"""
+        i = self.prefix(value, lower)
+        end = self.keyword(value, lower, i, u"bat")
+        if end is not None:
+            i = skip(value, end, WHITESPACE)
+        end = self.keyword(value, lower, i, u"appt")
+        if end is not None:
+            i = end
+            while value.startswith(u",", i) and skip(value, i + 1, ALNUM) > i + 1:
+                i = skip(value, i + 1, ALNUM)
+        return i
+
+    @memoize
+    @latin1
+    def match(self, value):
+        """Return the matched house number prefix of value as the regular expression
+        match would, never None as the grammar accepts an empty prefix"""
+        return value[:self.scan(value, ascii_lower(value))]
+
+    @memoize_in("valid_cache")
+    @latin1
+    def is_valid(self, value):
+        """Return True when the whole value (surrounding spaces excepted) follows
+        the grammar (audit check, match accepts any value)"""
+        value = value.strip()
+        lower = ascii_lower(value)
+        if self.scan(value, lower) == len(value):
+            return True
+        i = self.prefix(value, lower)
+        if i < len(value) and skip(value, i, ALNUM) == len(value):
+            return True
+        if lower.startswith(u"b"):
+            i = 2 if lower.startswith(u"b.") else 1
+            if lower.startswith(u"p", i):
+                i += 2 if lower.startswith(u"p.", i) else 1
+                spaces_end = skip(value, i, WHITESPACE)
+                return spaces_end > i and spaces_end < len(value) and skip(value, spaces_end, ALNUM | frozenset(u" ")) == len(value)
+        return False
+
+
+def housenumber_expression(mentions=reference.MENTIONS):
+    """Regular expression previously used by the audit for house numbers"""
+    mention_sub_exp = "%s" % '|'.join(mentions)
+    bat_sub_exp = "bat\s+[0-9a-z]+"
+    appt_sub_exp = "appt\s+[0-9a-z]+(?:,[0-9a-z]+)*"
+    pobox_sub_exp = "b\.?p\.?\s+[0-9 a-z]+"
+    housenumber_exp = "(?:(?:\d+\s*)?(?:(?:(?:%s)?\s*)?(?:(?:(?:(?:%s)\s*)?(?:%s)?)|(?:[0-9a-z]+)?))?)|(?:%s)" % (mention_sub_exp, bat_sub_exp, appt_sub_exp, pobox_sub_exp)
+    return r"(?P<housenumber>%s)" % (housenumber_exp)
+
+def corpus(alternatives, count=10000, seed=974):
+    """Return a deterministic corpus of street names and house numbers built from
+    way types, mentions, numbers and separators (including unusual ones)"""
+    rand = random.Random(seed)
+    tokens = (list(alternatives[:20]) + list(alternatives[-20:]) + reference.MENTIONS +
+              [u"12", u"3", u"Rue", u"rue", u"CHEMIN", u"Chemin Communal", u"Allée", u"des", u"Martins",
+               u"bat", u"BAT", u"appt", u"Appt", u"BP", u"B.P.", u"b.p", u"A", u"1,2,3", u"12bis", u"ter",
+               u"Terrasse", u"place", u"Place", u"ÎLE", u"K", u"#", u"-"])
+    separators = [u" ", u" ", u" ", u"  ", u",", u", ", u"\t", u"\n", u""]
+    values = [u"", u" ", u"\n", u"12", u"12\n", u"Rue\nX", u"12\nRue des Lilas", u"Rue des\nLilas",
+              u"12 Rue des Lilas\n", u"Appt 1,2", u"BP 12", u"bat A appt 1,2,3", u"12 ter 3"]
+    for _ in range(count):
+        values.append(u"".join(rand.choice(tokens) + rand.choice(separators) for _ in range(rand.randint(1, 5))))
+    return values
@@ -11,18 +11,22 @@ http://overpass-api.de/api/map?bbox=55.4871,-21.4039,55.8009,-21.1796
 Reference: The cleansing is driven by the JSOM file format as described at http://wiki.openstreetmap.org/wiki/API_v0.6/DTD
 """
 
-import pandas as pd
-import numpy as np
 import csv
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
 import pprint
 import unicodedata
+import multiprocessing
 
 import sys, getopt
 
-from data_gouv_fr import fantoir, postalcode
+from reader import OSMReader, RangeFile
+from address import StreetParser, HouseNumberParser, ascii_lower
+import reference
+from rules import RuleRegistry
+from suggest import Suggester
+from cache import ResultCache
+from metrics import Metrics, MeteredReader, stage, workers
 
 class MyPrettyPrinter(pprint.PrettyPrinter):
     def format(self, object, context, maxlevels, level):
@@ -31,83 +35,41 @@ class MyPrettyPrinter(pprint.PrettyPrinter):
         return pprint.PrettyPrinter.format(self, object, context, maxlevels, level)
 
 class Audit(object):
-    CITY_RE = re.compile(r'(.*)')
-    POPULATION_RE = re.compile(r'^([1-9][0-9]*)$')
-    POSTCODE_RE = re.compile(r'^(974[0-9]{2})$')
-    DIRECTION_RE = re.compile(r'^([1-9][0-9]{0,2})$')
-    CAPACITY_RE = re.compile(r'^([1-9][0-9]*)$')
-    PHONE_RE = re.compile(r'^(?P<phone>(0([-.]|\s+)?|\+)(?:[0-9]([-.]|\s+)?){6,14}[0-9])\s*$')
-    ELEVATION_RE = re.compile(r'^(?P<elevation>[-+]?[0-9]*\.?[0-9]+)$')
-    
-    def __init__(self):
-        mentions = ["bis", "ter", "quater", "ante"]
-        """Handle optional House Number before Street Type (french format)"""
-        r_exp = r"^((?P<housenumber>(\d+)\s*(%s)?)\,?\s+)?((?P<type>(%s))\s+)?(?P<name>(.*))$" % (
-            '|'.join(mentions),
-            '|'.join(np.concatenate((fantoir.FANTOIR().way_types().TYPE.values,
-                                     fantoir.FANTOIR().way_types().TYPE_NAME.values,
-                                     ["place"]
-                                    )
-                                   )
-                    )
-        )
-        
-        self.way_re = re.compile(r_exp, re.IGNORECASE)
-        
-        # House number can be expressed with the below simplified expression:
-        # HOUSENUMBER = <PO BOX>
-        #             | <NUMBER>
-        #             | <NUMBER> (BIS|TER...) 
-        #             | <NUMBER> (BIS|TER...) (<NUMBER> 
-        #             | <NUMBER> APPT {<NUMBER>, ...}
-        #             | <NUMBER> (BIS|TER...) APPT {<NUMBER>, ...}
-        #             | <NUMBER> (BIS|TER...) (<NUMBER>  APPT {<NUMBER>, ...}
-        # the first <NUMBER> could also be considered optional (as seen in the data) 
-        # adding a question mark for the first group (?:\d+\s*) of the regular expression
-        
-        # Note: a parser is probably more adapted for this kind of value compared to regular expression
-        # but i will keep using a regular expression at this stage
-        
-        mention_sub_exp = "%s" % '|'.join(mentions)
-        bat_sub_exp = "bat\s+[0-9a-z]+"
-        appt_sub_exp = "appt\s+[0-9a-z]+(?:,[0-9a-z]+)*"
-        pobox_sub_exp = "b\.?p\.?\s+[0-9 a-z]+"
-        housenumber_exp = "(?:(?:\d+\s*)?(?:(?:(?:%s)?\s*)?(?:(?:(?:(?:%s)\s*)?(?:%s)?)|(?:[0-9a-z]+)?))?)|(?:%s)" % (mention_sub_exp, bat_sub_exp, appt_sub_exp, pobox_sub_exp)
-
-        self.housenumber_re = re.compile(r"(?P<housenumber>%s)" % (housenumber_exp), re.IGNORECASE)
-    
-        
-    def is_city_name(self, elem):
-        return (elem.attrib['k'] == "addr:city")
-
-    def is_street_name(self, elem):
-        return (elem.attrib['k'] == "addr:street")
-
-    def is_house_number(self, elem):
-        return (elem.attrib['k'] == "addr:housenumber")
-    
-    def is_house_postcode(self, elem):
-        return (elem.attrib['k'] == "addr:postcode")
+    """Number of byte ranges audited by each process of a parallel audit (load balancing)"""
+    RANGES_PER_JOB = 4
 
-    def is_postal_code(self, elem):
-        return (elem.attrib['k'] == "postal_code")
-
-    def is_population(self, elem):
-        return (elem.attrib['k'] == "population")
-
-    def is_direction(self, elem):
-        return (elem.attrib['k'] == "direction")
-
-    def is_elevation(self, elem):
-        return (elem.attrib['k'] == "ele")
-
-    def is_capacity(self, elem):
-        return (elem.attrib['k'] == "capacity")
+    """Nodes whose addr:postcode is not the postcode of the nearest locality
+    (reported by postcode, no mapping file as the fix depends on the node)"""
+    POSITION_CATEGORY = "postcode_positions"
     
-    def is_phone(self, elem):
-        return (elem.attrib['k'] == "phone")
+    def __init__(self, street_alternatives=None, rules=None, reader=None, metrics=None):
+        self.rules = RuleRegistry() if rules is None else rules
+        self.reader = OSMReader() if reader is None else reader
+        self.validators = dict((rule.key, self.validator(rule)) for rule in self.rules.validated())
 
+        if street_alternatives is None:
+            from data_gouv_fr import fantoir
+            way_types = fantoir.FANTOIR().way_types()
+            street_alternatives = reference.street_alternatives(way_types.TYPE.values, way_types.TYPE_NAME.values)
+        
+        # Street names and house numbers are split by hand written parsers
+        # (see address.py for the grammars) instead of regular expressions,
+        # built on first use when the way types are still being loaded
+        self.street_alternatives = street_alternatives
+        if isinstance(street_alternatives, (reference.Background, reference.Pending)):
+            self.street_parser = reference.Pending(lambda: StreetParser(reference.resolve(street_alternatives)))
+        else:
+            self.street_parser = StreetParser(street_alternatives)
+        self.housenumber_parser = HouseNumberParser()
 
+        self.metrics = metrics
+        if metrics is not None:
+            self.validators = dict((key, metrics.timed("validator:%s" % key, validate))
+                                   for key, validate in self.validators.items())
+            self.audit_postcode_position = metrics.timed("postcode_position", self.audit_postcode_position)
+            metrics.watch("street_parser", self.street_parser)
+            metrics.watch("housenumber_parser", self.housenumber_parser)
+        
     def toASCII(self, x):
         """Downgrade to ascii 
         Input data are a mix of ascii or unicode string but
@@ -115,143 +77,340 @@ class Audit(object):
         """
         return unicodedata.normalize('NFKD', u'%s' % x).encode('ascii', 'ignore')
 
-    def audit_street(self, street_types, street_names, street_name, expected_way_type, expected_way_name):
-        m = self.way_re.search(street_name)
-        if m:
-            street_type = m.group('type')
+    def audit_street(self, street_types, street_names, street_name, references):
+        parsed = self.street_parser.parse(street_name)
+        if parsed:
+            _, street_type, name = parsed
             if street_type is None:
                 street_types[street_type].add(street_name)
                 street_names[street_name].add(street_name) # Manage one single for manual update
                 
-            name = m.group('name')
-            if name is None or self.toASCII(name).upper() not in expected_way_name:
+            if name is None or not references.is_way_name(name):
                 street_names[street_name].add(street_name)
         else:
             street_names[street_name].add(street_name)
           
-    def audit_city_name(self, cities, city, expected_cities):
-        if not(self.CITY_RE.match(city) is None or self.toASCII(city).upper() in expected_cities):
+    def audit_city_name(self, cities, city, references):
+        if not references.is_city(city):
             cities[city].add(city)
      
     def audit_house_number(self, house_numbers, house_number):
         # multiple housenumber are separated by coma... need to check each individuals one against 
-        # the housenumber regular expression. As Appt keyword could be followed by a list numbers separated by a coma
+        # the housenumber grammar. As Appt keyword could be followed by a list numbers separated by a coma
         # a first check for any housenumber starting with Appt will done before the other split and check
-        if bool(re.match('^Appt', house_number.strip(), re.I)):
-            if self.housenumber_re.match(house_number) is None:
+        if ascii_lower(house_number.strip()).startswith("appt"):
+            if not self.housenumber_parser.is_valid(house_number):
                 house_numbers[house_number].add(house_number)
         else:
             for n in house_number.split(","):
                 n = n.strip()
                 if not (n.isdigit()):
-                    if self.housenumber_re.match(n) is None:
+                    if not self.housenumber_parser.is_valid(n):
                         house_numbers[house_number].add(house_number)
     
-    def audit_house_postcode(self, house_postcodes, house_postcode, expected_postal_code):
-        if self.POSTCODE_RE.match(house_postcode) is None or not int(house_postcode) in expected_postal_code:
-            house_postcodes[house_postcode].add(house_postcode)
-    
-    def audit_postal_code(self, postal_codes, postal_code, expected_postal_code):
-        if self.POSTCODE_RE.match(postal_code) is None or not int(postal_code) in expected_postal_code:
-            postal_codes[postal_code].add(postal_code)
-    
-    def audit_population(self, populations, population):
-        if self.POPULATION_RE.match(population) is None:
-            populations[code].add(population)
-    
-    def audit_direction(self, directions, direction):
-        if self.DIRECTION_RE.match(direction) is None:
-            directions[code].add(direction)
-    
-    def audit_elevation(self, elevations, elevation):
-        if self.ELEVATION_RE.match(elevation) is None:
-            elevations[elevation].add(elevation)
+    def audit_postcode(self, postcodes, postcode, references, pattern):
+        if pattern.match(postcode) is None or not references.is_postcode(postcode):
+            postcodes[postcode].add(postcode)
     
-    def audit_capacity(self, capacities, capacity):
-        if self.CAPACITY_RE.match(capacity) is None:
-            capacities[capacity].add(capacity)
-    
-    def audit_phone(self, phones, phone):
-        if self.PHONE_RE.match(phone) is None:
-            phones[phone].add(phone)
+    def audit_postcode_position(self, positions, elem, postcode, references):
+        postcode = postcode.replace(' ', '')
+        if postcode.isdigit() and "lat" in elem.attrib and "lon" in elem.attrib:
+            nearest = references.nearest_postcode(float(elem.attrib["lat"]), float(elem.attrib["lon"]))
+            if nearest is not None and nearest != int(postcode):
+                positions[postcode].add(elem.attrib["id"])
+
+    def audit_value(self, values, value, pattern):
+        if pattern.match(value) is None:
+            values[value].add(value)
+
+    def validator(self, rule):
+        """Return the function auditing the values of rule.key into the results"""
+        if rule.validator == "city":
+            return lambda results, value, references: self.audit_city_name(results[rule.category], value, references)
+        elif rule.validator == "street":
+            return lambda results, value, references: self.audit_street(results["street_types"], results[rule.category], value, references)
+        elif rule.validator == "housenumber":
+            return lambda results, value, references: self.audit_house_number(results[rule.category], value)
+        elif rule.validator == "postcode":
+            return lambda results, value, references: self.audit_postcode(results[rule.category], value, references, rule.pattern)
+        else:
+            return lambda results, value, references: self.audit_value(results[rule.category], value, rule.pattern)
     
-    def audit_way_node(self, osm_file, expected_way_type, expected_way_name, expected_postal_code, expected_city):
-        cities = defaultdict(set)
-        street_types = defaultdict(set)
-        street_names = defaultdict(set)
-        house_numbers = defaultdict(set)
-        house_postcodes = defaultdict(set)
-        postal_codes = defaultdict(set)
-        populations = defaultdict(set)
-        directions = defaultdict(set)
-        elevations = defaultdict(set)
-        capacities = defaultdict(set)
-        phones = defaultdict(set)
-        
-        for event, elem in ET.iterparse(osm_file, events=("start",)):
-            if elem.tag in ["node", "way"]:
-                for tag in elem.iter("tag"):
-                    if self.is_city_name(tag):
-                        self.audit_city_name(cities, tag.attrib['v'], expected_city)
-                    elif self.is_street_name(tag):
-                        self.audit_street(street_types, street_names, tag.attrib['v'], expected_way_type, expected_way_name)
-                    elif self.is_house_number(tag):
-                        self.audit_house_number(house_numbers, tag.attrib['v'])
-                    elif self.is_house_postcode(tag):
-                        self.audit_house_postcode(house_postcodes, tag.attrib['v'], expected_postal_code)
-                    elif self.is_postal_code(tag):
-                        self.audit_postal_code(postal_codes, tag.attrib['v'], expected_postal_code)
-                    elif self.is_population(tag):
-                        self.audit_population(populations, tag.attrib['v'])
-                    elif self.is_direction(tag):
-                        self.audit_direction(directions, tag.attrib['v'])
-                    elif self.is_elevation(tag):
-                        self.audit_elevation(elevations, tag.attrib['v'])
-                    elif self.is_direction(tag):
-                        self.audit_capacity(capacities, tag.attrib['v'])
-                    elif self.is_phone(tag):
-                        self.audit_phone(phones, tag.attrib['v'])
+    def init_results(self):
+        """Return the empty per category results filled by audit_element"""
+        results = {}
+        for rule in self.rules.validated():
+            results[rule.category] = defaultdict(set)
+            if rule.validator == "street":
+                results["street_types"] = defaultdict(set)
+        results[self.POSITION_CATEGORY] = defaultdict(set)
+        return results
+
+    def audited_keys(self):
+        """Tag keys read by audit_element, the other tags (and the elements
+        having none of these keys) are skipped by the reader"""
+        return set(self.validators) | set(["addr:postcode"])
+
+    def audit_element(self, elem, results, references):
+        """Audit all tags of one top level element, relations are ignored"""
+        if elem.tag in ["node", "way"]:
+            for key, value in elem.tags:
+                validate = self.validators.get(key)
+                if validate is not None:
+                    validate(results, value, references)
+                if key == "addr:postcode" and elem.tag == "node":
+                    self.audit_postcode_position(results[self.POSITION_CATEGORY], elem, value, references)
+
+        return results
+
+    def audit_range(self, osm_file, start, end, references):
+        """Audit the top level elements of the [start, end[ byte range of osm_file"""
+        results = self.init_results()
+        for elem in self.reader.elements(RangeFile(osm_file, start, end), tags=["node", "way"], keys=self.audited_keys()):
+            self.audit_element(elem, results, references)
+
+        return results
+
+    def merge_results(self, results, other):
+        for k, v in other.items():
+            for value, values in v.items():
+                results[k][value].update(values)
+
+        return results
+
+    def audit_way_node(self, osm_file, references, jobs=1):
+        """Audit osm_file, with jobs > 1 the file is split into byte ranges
+        audited in a pool of jobs processes (compressed and PBF files are
+        audited in one single process)"""
+        if jobs > 1 and self.reader.is_splittable(osm_file):
+            return self.audit_way_node_parallel(osm_file, references, jobs)
+
+        results = self.init_results()
+        for elem in self.reader.elements(osm_file, tags=["node", "way"], keys=self.audited_keys()):
+            self.audit_element(elem, results, references)
                         
+        return results
+
+    def audit_way_node_parallel(self, osm_file, references, jobs):
+        ranges = OSMReader().ranges(osm_file, jobs * self.RANGES_PER_JOB)
+        pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                    initargs=(reference.resolve(self.street_alternatives),
+                                              reference.resolve(references), self.rules, self.metrics is not None))
+        try:
+            results = self.init_results()
+            with workers(self.metrics):
+                for other, counters in pool.imap_unordered(audit_worker, [(osm_file, start, end) for start, end in ranges]):
+                    self.merge_results(results, other)
+                    if counters is not None:
+                        self.metrics.merge(counters)
+        finally:
+            pool.close()
+            pool.join()
+
+        return results
+
+    def count_element(self, elem, counts, positions, references):
+        """Count the audited (key, value) pairs of one top level element,
+        the position of the postcode of a node is still checked per node"""
+        if elem.tag in ["node", "way"]:
+            for key, value in elem.tags:
+                if key in self.validators:
+                    counts[(key, value)] += 1
+                if key == "addr:postcode" and elem.tag == "node":
+                    self.audit_postcode_position(positions, elem, value, references)
+
+        return counts
+
+    def count_range(self, osm_file, start, end, references):
+        counts, positions = defaultdict(int), defaultdict(set)
+        for elem in self.reader.elements(RangeFile(osm_file, start, end), tags=["node", "way"], keys=self.audited_keys()):
+            self.count_element(elem, counts, positions, references)
+
+        return counts, positions
+
+    def count_values(self, osm_file, references, jobs=1):
+        """Return the number of occurrences of each distinct audited (key, value)
+        pair of osm_file and the postcode position findings"""
+        if jobs > 1 and self.reader.is_splittable(osm_file):
+            ranges = OSMReader().ranges(osm_file, jobs * self.RANGES_PER_JOB)
+            pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                        initargs=(reference.resolve(self.street_alternatives),
+                                                  reference.resolve(references), self.rules, self.metrics is not None))
+            try:
+                counts, positions = defaultdict(int), defaultdict(set)
+                with workers(self.metrics):
+                    for (other_counts, other_positions), counters in pool.imap_unordered(count_worker, [(osm_file, start, end) for start, end in ranges]):
+                        for pair, count in other_counts.items():
+                            counts[pair] += count
+                        for postcode, ids in other_positions.items():
+                            positions[postcode].update(ids)
+                        if counters is not None:
+                            self.metrics.merge(counters)
+            finally:
+                pool.close()
+                pool.join()
+            return counts, positions
+
+        counts, positions = defaultdict(int), defaultdict(set)
+        for elem in self.reader.elements(osm_file, tags=["node", "way"], keys=self.audited_keys()):
+            self.count_element(elem, counts, positions, references)
+
+        return counts, positions
+
+    def validate_streets(self, values, street_types, street_names, references):
+        """audit_street over distinct values, the parsed names being looked up at once"""
+        import pandas as pd
+        import numpy as np
+        parsed = [self.street_parser.parse(value) for value in values]
+        names = pd.Series([None if p is None else p[2] for p in parsed], dtype=object)
+        known = np.zeros(len(names), dtype=bool)
+        present = names.notnull().values
+        known[present] = references.normalize_all(names[present]).isin(references.way_names).values
+        for value, p, is_known in zip(values, parsed, known):
+            if p is not None and p[1] is None:
+                street_types[None].add(value)
+            if p is None or p[1] is None or not is_known:
+                street_names[value].add(value)
+
+    def validate_values(self, rule, values, results, references):
+        """Audit the distinct values of rule.key into results, city, postcode
+        and regular expression validators being run on all values at once"""
+        if rule.validator == "street":
+            return self.validate_streets(values, results["street_types"], results[rule.category], references)
+        elif rule.validator == "housenumber":
+            for value in values:
+                self.audit_house_number(results[rule.category], value)
+            return
+
+        import pandas as pd
+        series = pd.Series(values, dtype=object)
+        if rule.validator == "city":
+            valid = references.normalize_all(series).isin(references.cities).values
+        else:
+            valid = series.str.match(rule.pattern.pattern, flags=rule.pattern.flags).values.astype(bool)
+            if rule.validator == "postcode":
+                matched = series[valid].str.strip()
+                valid[valid] = pd.to_numeric(matched, errors="coerce").isin(list(references.postcodes)).values
+        for value in series[~valid]:
+            results[rule.category][value].add(value)
+
+    def occurrences(self, results, counts):
+        """Return the number of occurrences of each value to be fixed per
+        category (number of nodes for postcode positions)"""
+        keys = defaultdict(list)
+        for rule in self.rules.validated():
+            keys[rule.category].append(rule.key)
+            if rule.validator == "street":
+                keys["street_types"].append(rule.key)
+
+        occurrences = {}
+        for category, values in results.items():
+            if category == self.POSITION_CATEGORY:
+                occurrences[category] = dict((postcode, len(ids)) for postcode, ids in values.items())
+            else:
+                occurrences[category] = dict((value, sum(counts.get((key, value), 0) for key in keys[category]))
+                                             for nested in values.values() for value in nested)
+        return occurrences
+
+    def audit_distinct(self, osm_file, references, jobs=1):
+        """Two phase audit: the distinct values are counted in one streaming
+        pass, then each one is validated once. Return the same results as
+        audit_way_node and the number of occurrences of each finding"""
+        counts, positions = self.count_values(osm_file, references, jobs)
+        with stage(self.metrics, "validate"):
+            values = defaultdict(list)
+            for key, value in counts:
+                values[key].append(value)
+            results = self.init_results()
+            for rule in self.rules.validated():
+                if values[rule.key]:
+                    self.validate_values(rule, values[rule.key], results, references)
+            results[self.POSITION_CATEGORY] = positions
+
+        return results, self.occurrences(results, counts)
+
+    def signature(self, bundle):
+        """Return what the results depend on besides the OSM file: reference
+        data and rules (result cache key)"""
+        bundle = reference.resolve(bundle)
+        return (bundle["version"], bundle["area_code"],
+                tuple(sorted((name, source["sha1"]) for name, source in bundle["sources"].items())),
+                reference.resolve(self.street_alternatives), self.rules.signature())
+
+    def cached_audit_way_node(self, osm_file, bundle, jobs=1, cache=None):
+        """audit_way_node results, looked up in cache (a cache.ResultCache) first"""
+        if cache is None:
+            return self.audit_way_node(osm_file, self.references(bundle=bundle), jobs)
+
+        key = cache.key("audit_way_node", cache.fingerprint(osm_file), self.signature(bundle))
+        return cache.get_or_compute(key, lambda: self.audit_way_node(osm_file, self.references(bundle=bundle), jobs))
+
+    def cached_audit_distinct(self, osm_file, bundle, jobs=1, cache=None):
+        """audit_distinct results and occurrences, looked up in cache (a cache.ResultCache) first"""
+        compute = lambda: self.audit_distinct(osm_file, self.references(bundle=bundle), jobs)
+        if cache is None:
+            return compute()
+
+        key = cache.key("audit_distinct", cache.fingerprint(osm_file), self.signature(bundle))
+        return cache.get_or_compute(key, compute)
+
+    def references(self, fantoir_file="data/FANTOIR1016", area_code="974", bundle=None):
+        """Return the index of expected values (way types, way names, postal codes and cities)
+        used by audit_way_node and audit_element. When the bundle is still being
+        loaded (a reference.Background), the index is built in the background
+        too and the first lookup waits for it"""
+        if bundle is None:
+            bundle = reference.ReferenceBundle(fantoir_file, area_code).load()
+
+        if isinstance(bundle, (reference.Background, reference.Pending)):
+            index = reference.Pending(reference.Background(lambda: reference.ReferenceIndex.from_bundle(bundle.result())).result)
+        else:
+            index = reference.ReferenceIndex.from_bundle(bundle)
+        if self.metrics is not None:
+            self.metrics.watch("reference_index", index)
+        return index
+
+    def suggesters(self, bundle):
+        """Return the suggesters of fixes per category (closest reference names)"""
+        bundle = reference.resolve(bundle)
         return {
-            "cities": cities, 
-            "street_names": street_names, 
-            "street_types": street_types, 
-            "house_numbers": house_numbers, 
-            "house_postcodes": house_postcodes, 
-            "postal_codes": postal_codes, 
-            "populations": populations, 
-            "directions": directions, 
-            "elevations": elevations, 
-            "capacities": capacities, 
-            "phones": phones  
-        }   
-    
-    def audit(self, osm_file,
-              fantoir_file="data/FANTOIR1016", 
-              area_code="974",
-              update_folder="data",
-              verbose= False, 
-              init_mapping= False
-             ):
-        db = fantoir.FANTOIR()
-        postcodes = postalcode.PostalCode("data/laposte_hexasmal.csv")
-        
-        results = self.audit_way_node(
-            osm_file, 
-            db.way_types().TYPE_NAME.values,
-            db.ways(fantoir_file, area_code).NAME.values,
-            postcodes.localityByPostcode().keys(),
-            postcodes.postcodeByLocality().keys()
-        )
+            "street_names": Suggester(bundle["way_full_names"]),
+            "cities": Suggester(bundle["postcode_by_locality"].keys())
+        }
 
+    def mapping(self, values, suggester=None, counts=None):
+        """Return the mapping of values to be updated for manual data cleansing
+        NEW is the value found in the OSM file, OLD the value it is replaced with:
+        the closest reference name when a suggester is given and the suggestion
+        is confident, the value itself otherwise (CHECK flagging the rows to be
+        checked by hand). With counts, COUNT is the number of occurrences of
+        each value, the most frequent values first"""
+        import pandas as pd
+        df = pd.DataFrame.from_dict({ "OLD": values, "NEW": values })
+        if suggester is not None:
+            suggestions = [suggester.suggest(value) for value in values]
+            confident = [suggester.is_confident(score) for _, score in suggestions]
+            df["OLD"] = [name if sure else value for value, (name, _), sure in zip(values, suggestions, confident)]
+            df["SUGGESTION"] = [name for name, _ in suggestions]
+            df["SCORE"] = [round(score, 2) for _, score in suggestions]
+            df["CHECK"] = [not sure for sure in confident]
+        if counts is not None:
+            df["COUNT"] = [counts.get(value, 0) for value in values]
+            df = df.sort_values("COUNT", ascending=False, kind="mergesort")
+        return df
+
+    def summary(self, results, update_folder="data", verbose=False, init_mapping=False, suggesters=None, occurrences=None):
+        """Return the number of values to be fixed per category, the mapping
+        files are ordered by number of occurrences when given"""
         summary = {}
+        suggesters = {} if suggesters is None else suggesters
         for k, v in results.items():
-            if init_mapping:
+            if init_mapping and k != self.POSITION_CATEGORY:
                 """Generate mapping file to be updated for manual data cleansing
                 Once updated, the files shall be manually transferred to update folder"""
                 if len(v):
                     mapping = [value for nested in v.values() for value in nested]
-                    df = pd.DataFrame.from_dict({ "OLD": mapping, "NEW": mapping })
+                    df = self.mapping(mapping, suggesters.get(k), None if occurrences is None else occurrences.get(k))
                     df.to_csv("%s/%s-update.csv" % (update_folder, k), 
                               encoding='utf-8', 
                               index=False, 
@@ -262,11 +421,65 @@ class Audit(object):
                 print("")
             
             summary[k] = len(v)
+
+        return summary
+    
+    def audit(self, osm_file,
+              fantoir_file="data/FANTOIR1016", 
+              area_code="974",
+              update_folder="data",
+              verbose= False, 
+              init_mapping= False,
+              bundle= None,
+              jobs= 1,
+              cache= None,
+              distinct= False
+             ):
+        with stage(self.metrics, "bundle"):
+            if bundle is None:
+                bundle = reference.ReferenceBundle(fantoir_file, area_code).load()
+        with stage(self.metrics, "audit"):
+            if distinct:
+                results, occurrences = self.cached_audit_distinct(osm_file, bundle, jobs, cache)
+            else:
+                results, occurrences = self.cached_audit_way_node(osm_file, bundle, jobs, cache), None
+        with stage(self.metrics, "summary"):
+            summary = self.summary(results, 
+                                   update_folder=update_folder, 
+                                   verbose=verbose, 
+                                   init_mapping=init_mapping,
+                                   suggesters=self.suggesters(bundle) if init_mapping else None,
+                                   occurrences=occurrences)
                 
         return pprint.pprint(summary) # use daframe formatting
 
+"""Parallel audit: each worker process builds its own Audit once, metered
+(--profile) its counters are returned with the results of each byte range"""
+worker = {}
+
+def init_worker(street_alternatives, references, rules, metered=False):
+    metrics = Metrics() if metered else None
+    reader = OSMReader() if metrics is None else MeteredReader(OSMReader(), metrics)
+    worker["audit"] = Audit(street_alternatives, rules, reader=reader, metrics=metrics)
+    worker["references"] = references
+    if metrics is not None:
+        metrics.watch("reference_index", references)
+
+def worker_counters():
+    metrics = worker["audit"].metrics
+    return None if metrics is None else metrics.counters()
+
+def audit_worker(args):
+    osm_file, start, end = args
+    return worker["audit"].audit_range(osm_file, start, end, worker["references"]), worker_counters()
+
+def count_worker(args):
+    osm_file, start, end = args
+    return worker["audit"].count_range(osm_file, start, end, worker["references"]), worker_counters()
+
 def usage():
-    print('audit.py -i -v -o <OSM FILE> -f <FANTOIR FILE> -a <AREA> -u <AUDIT FOLDER>')
+    print('audit.py -i -v -d -j <JOBS> -o <OSM FILE> -f <FANTOIR FILE> -a <AREA> -u <AUDIT FOLDER> [-c <CACHE FOLDER> -s <CACHE SIZE (MB)>] [-z <thread|process>]')
+    print('         [--profile] [--metrics-out <METRICS FILE>]')
 
 def main(argv):
     verbose = False
@@ -275,11 +488,20 @@ def main(argv):
     fantoir_file = None
     area_code = None
     update_folder = None
+    jobs = 1
+    cache_folder = None
+    cache_size = ResultCache.MAX_SIZE
+    decompress = None
+    profile = False
+    metrics_file = None
+    distinct = False
     
     try:
-        opts, args = getopt.getopt(argv,"hivo:f:a:u:",["init", "verbose", 
-                                                     "osm=", "fantoir=", 
-                                                     "area=", "ufolder="])
+        opts, args = getopt.getopt(argv,"hivdj:o:f:a:u:c:s:z:",["init", "verbose", "distinct", "jobs=",
+                                                             "osm=", "fantoir=", 
+                                                             "area=", "ufolder=",
+                                                             "cache=", "cachesize=", "decompress=",
+                                                             "profile", "metrics-out="])
     except getopt.GetoptError as err:
         print str(err)
         usage()
@@ -292,6 +514,10 @@ def main(argv):
             init_mapping = True
         elif opt in ("-v", "--verbose"):
             verbose = True
+        elif opt in ("-d", "--distinct"):
+            distinct = True
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
         elif opt in ("-o", "--osm"):
              osm_file = arg
         elif opt in ("-f", "--fantoir"):
@@ -300,6 +526,16 @@ def main(argv):
              area_code = arg
         elif opt in ("-u", "--ufolder"):
              update_folder = arg
+        elif opt in ("-c", "--cache"):
+             cache_folder = arg
+        elif opt in ("-s", "--cachesize"):
+             cache_size = int(arg) << 20
+        elif opt in ("-z", "--decompress"):
+             decompress = arg
+        elif opt == "--profile":
+             profile = True
+        elif opt == "--metrics-out":
+             metrics_file = arg
         else:
             print("unhandled option")
             sys.exit(2)
@@ -308,13 +544,35 @@ def main(argv):
         print("You need to supply -o, -f, -a and -u")        
         sys.exit(2)
 
-    Audit().audit(osm_file= osm_file, 
-                  fantoir_file= fantoir_file, 
-                  area_code= area_code,
-                  update_folder= update_folder,
-                  init_mapping= init_mapping, 
-                  verbose= verbose, 
-                  )
+    metrics = Metrics() if profile or metrics_file is not None else None
+    reader = OSMReader(decompress)
+    references = reference.ReferenceBundle(fantoir_file, area_code)
+    cache = None if cache_folder is None else ResultCache(cache_folder, cache_size)
+    if metrics is not None:
+        reader = MeteredReader(reader, metrics)
+        metrics.watch("bundle", references)
+        if cache is not None:
+            metrics.watch("results", cache)
+
+    # the reference data are loaded while the OSM file starts being read
+    def load():
+        with stage(metrics, "bundle"):
+            return references.load()
+    bundle = reference.Background(load)
+    street_alternatives = reference.Pending(lambda: bundle.result()["street_alternatives"])
+    Audit(street_alternatives, reader=reader, metrics=metrics).audit(osm_file= osm_file, 
+                                             fantoir_file= fantoir_file, 
+                                             area_code= area_code,
+                                             update_folder= update_folder,
+                                             init_mapping= init_mapping, 
+                                             verbose= verbose, 
+                                             bundle= bundle,
+                                             jobs= jobs,
+                                             cache= cache,
+                                             distinct= distinct
+                                             )
+    if metrics is not None:
+        metrics.write(metrics_file)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,774 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks comparing the current implementations with the previous ones
+and checking both give the same results
+
+Each benchmark reports the best wall time out of N runs (in seconds unless
+stated otherwise)
+
+The scaling benchmark (-b scaling, not run by default) tracks throughput and
+peak memory of the main passes over synthetic files (see synthetic.py) of
+growing sizes (-s)
+
+The startup benchmark (-b startup) runs the command line tools on a small
+synthetic extract, where imports and reference loading weigh the most
+"""
+
+import pandas as pd
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import io
+import os
+import re
+import resource
+import subprocess
+import tempfile
+import timeit
+import pprint
+import random
+import sys, getopt
+
+from data_gouv_fr import fantoir
+import address
+import reference
+from reader import OSMReader
+from shape import Shape, MongoWriter
+from compact import CompactDocument, StringTable, to_dict
+from columnar import ColumnarReader
+import json
+import shutil
+from suggest import Suggester
+from synthetic import Synthetic
+from tags import TagChecker
+from audit import Audit
+
+
+def fantoir_ways_apply(csv_file, code):
+    """Previous FANTOIR.ways implementation: full file read and per row apply"""
+    data = pd.read_table(csv_file, header=None)
+    df = data[data[0].str.startswith(code) == True][0]
+    df = df.apply(lambda x : pd.Series(x[:41]))
+    df["KEEP"] =df[0].apply(lambda x: len(x.split(' ')[0]) >= 11)
+    df = df[df.KEEP == True][0].apply(lambda x: pd.Series([x[:11].strip(),
+                                                           x[11:15].strip(),
+                                                           x[15:41].strip()]))
+    df.columns = ["REFERENCE", "TYPE", "NAME"]
+    df = pd.merge(left=df, right=fantoir.FANTOIR().way_types(), on="TYPE")[["REFERENCE",
+                                                                             "TYPE",
+                                                                             "TYPE_NAME",
+                                                                             "NAME"]]
+    df["FULL_NAME"] = df[["TYPE_NAME", "NAME"]].apply(lambda x: ' '.join(x), axis=1)
+    return df
+
+
+class NestedShape(Shape):
+    """Previous Shape.shape_element implementation: all tags are shaped
+    again for each attribute of the element"""
+
+    def update_key(self, val, mapping):
+        if val in mapping.keys():
+            val = mapping[val]
+        return val
+
+    def shape_tag(self, tag, node, mappings):
+        key = tag.attrib['k']
+        val = tag.attrib['v']
+        if not self.PROBLEM_CHARS_RE.match(key):
+            if key.startswith("addr:"):
+                address = node.setdefault("address", {})
+                addr_key = tag.attrib['k'][len("addr:") : ]
+                if not self.LOWER_COLON_RE.match(addr_key):
+                    if addr_key == "street":
+                        address.update({ addr_key: self.update_key(u'%s' % val, mappings["street_names"]) })
+                    elif addr_key == "city":
+                        address.update({ addr_key: self.update_key(u'%s' % val, mappings["cities"]) })
+                    elif addr_key == "housenumber":
+                        address.update({ addr_key: self.update_key(u'%s' % val, mappings["house_numbers"]) })
+                    elif addr_key == "postcode":
+                        address.update({ addr_key: self.update_key(val.replace(' ', ''), mappings["house_postcodes"]) })
+                    else:
+                        address.update({ addr_key: u'%s' % val })
+            elif key == "phone":
+                node[key] = self.update_key(val, mappings["phones"])
+            elif key == "capacity":
+                node[key] = self.update_key(val, mappings["capacities"])
+            elif key == "direction":
+                node[key] = self.update_key(val, mappings["directions"])
+            elif key == "ele":
+                node[key] = self.update_key(val, mappings["elevations"])
+            elif key == "postal_code":
+                node[key] = self.update_key(val, mappings["postal_codes"])
+            elif key == "population":
+                node[key] = self.update_key(val, mappings["populations"])
+            if key == "name":
+                node[key] = self.update_key(u'%s' % val, mappings["street_names"])
+            elif self.LOWER_RE.match(key):
+                node[key] = u'%s' % val
+
+    def shape_element(self, element, mappings):
+        node = {}
+        if element.tag == "node" or element.tag == "way" :
+            created = node.setdefault("created", {})
+            for key in element.attrib.keys():
+                val = element.attrib[key]
+                node["type"] = element.tag
+                if key in self.JSON_CREATED:
+                    created.update({ key: val })
+                elif key == "lat" or key == "lon":
+                    self.shape_lat_lon(node, key, val)
+                else:
+                    node[key] = val
+                for tag in element.iter("tag"):
+                    self.shape_tag(tag, node, mappings)
+            node_refs = node.setdefault("node_refs", [])
+            for tag in element.iter("nd"):
+                node_refs.append(tag.attrib["ref"])
+            return node
+        else:
+            return None
+
+
+def tag_heavy_osm(osm_file, elements, tags):
+    """Write a synthetic OSM file of elements nodes having tags tags each
+    (address, mapped and free tags)"""
+    keys = ["addr:street", "addr:city", "addr:housenumber", "addr:postcode", "name",
+            "phone", "ele", "amenity", "building", "source", "name:fr", "note"]
+    with io.open(osm_file, "w", encoding="utf-8") as f:
+        f.write(u'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        for i in range(elements):
+            f.write(u' <node id="%d" lat="-21.2" lon="55.6" version="1" changeset="1" timestamp="2016-01-01T00:00:00Z" user="u" uid="1" visible="true">\n' % (i + 1))
+            for t in range(tags):
+                f.write(u'  <tag k="%s" v="value %d"/>\n' % (keys[t % len(keys)] + ("" if t < len(keys) else ":%d" % t), i % 100))
+            f.write(u' </node>\n')
+        f.write(u'</osm>\n')
+
+
+def suggest_scan(suggester, value):
+    """Closest reference name compared with every reference name (no index)"""
+    key = suggester.normalize(value)
+    grams = suggester.ngrams(key)
+    suggestion, best = None, 0.0
+    exact = suggester.exact.get(key)
+    for index, other in enumerate(suggester.grams):
+        score = 1.0 if index == exact else suggester.score(grams, other)
+        if score > best:
+            suggestion, best = suggester.names[index], score
+    return (suggestion, best) if best >= suggester.min_score else (None, 0.0)
+
+def street_names(count, seed=974):
+    """Return count synthetic way full names and a misspelled copy of each one
+    (title case, one missing or doubled character)"""
+    rand = random.Random(seed)
+    types = ["RUE", "CHEMIN", "ALLEE", "IMPASSE", "AVENUE", "ROUTE", "SENTIER", "RAVINE"]
+    words = ["%s%s" % (rand.choice(["PITON", "BRAS", "GRAND", "PETIT", "BASSIN", "COTEAU", "MARE"]), rand.choice("ABCDEFGHIJKLMNOPRSTUVZ") * rand.randint(0, 1) + rand.choice(["ET", "IN", "OU", "AN", "IER"]))
+             for _ in range(2000)]
+    names = sorted(set("%s %s %s" % (rand.choice(types), rand.choice(["DE", "DU", "DES"]), " ".join(rand.sample(words, rand.randint(1, 3))))
+                       for _ in range(count)))
+    misspelled = []
+    for name in names:
+        value = list(name.title())
+        i = rand.randrange(len(value))
+        if rand.random() < 0.5:
+            del value[i]
+        else:
+            value.insert(i, value[i])
+        misspelled.append(u"".join(value))
+    return names, misspelled
+
+class UpdateResult(object):
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+class MemoryCollection(object):
+    """In-memory stand-in of a MongoDB collection, supporting the calls made by
+    MongoWriter and the per document updates previously made by the notebook
+    (equality, $ne and $exists filters on dotted keys, $set updates), each call
+    being counted as one round trip"""
+    MISSING = object()
+
+    def __init__(self):
+        self.documents = []
+        self.ids = {}
+        self.indexes = []
+        self.calls = 0
+
+    def get(self, document, key):
+        for k in key.split("."):
+            if not isinstance(document, dict) or k not in document:
+                return self.MISSING
+            document = document[k]
+        return document
+
+    def matches(self, document, filter):
+        for key, condition in filter.items():
+            value = self.get(document, key)
+            if isinstance(condition, dict) and "$ne" in condition:
+                if value == condition["$ne"]:
+                    return False
+            elif isinstance(condition, dict) and "$exists" in condition:
+                if (value is not self.MISSING) != condition["$exists"]:
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    def set(self, document, update):
+        for key, value in update["$set"].items():
+            keys = key.split(".")
+            for k in keys[:-1]:
+                document = document.setdefault(k, {})
+            document[keys[-1]] = value
+
+    def insert(self, document):
+        document.setdefault("_id", len(self.documents))
+        self.ids[document["_id"]] = document
+        self.documents.append(document)
+
+    def insert_one(self, document):
+        self.calls += 1
+        self.insert(document)
+
+    def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        for document in documents:
+            self.insert(document)
+
+    def create_index(self, key):
+        self.calls += 1
+        self.indexes.append(key)
+
+    def find(self, filter):
+        self.calls += 1
+        return [document for document in self.documents if self.matches(document, filter)]
+
+    def distinct(self, key, filter):
+        self.calls += 1
+        values = set(self.get(document, key) for document in self.documents if self.matches(document, filter))
+        return sorted(values - set([self.MISSING]))
+
+    def update_one(self, filter, update):
+        self.calls += 1
+        documents = [self.ids[filter["_id"]]] if filter.keys() == ["_id"] and filter["_id"] in self.ids else self.documents
+        for document in documents:
+            if self.matches(document, filter):
+                self.set(document, update)
+                return UpdateResult(1)
+        return UpdateResult(0)
+
+    def update_many(self, filter, update):
+        self.calls += 1
+        documents = [document for document in self.documents if self.matches(document, filter)]
+        for document in documents:
+            self.set(document, update)
+        return UpdateResult(len(documents))
+
+def notebook_load(documents, collection, city_by_postcode):
+    """Previous load: one document per insert (mongoimport), postcodes and
+    cities corrected with one update per document"""
+    for document in documents:
+        collection.insert_one(document)
+    address = { "type": "node", "address": { "$exists": True }, "address.postcode": { "$exists": True } }
+    for n in collection.find(address):
+        postcode = n["address"]["postcode"].replace(' ', '')
+        collection.update_one({ "_id": n["_id"] }, { "$set": { "address.postcode": postcode } })
+    for n in collection.find(address):
+        postcode = n["address"]["postcode"]
+        if postcode.isdigit() and int(postcode) in city_by_postcode:
+            collection.update_one({ "_id": n["_id"] }, { "$set": { "address.city": city_by_postcode[int(postcode)] } })
+    return collection
+
+"""Measured tasks: each one sets up and returns the function whose wall time
+and peak memory are measured in a new interpreter (see in_interpreter)"""
+def tags_task(osm_file):
+    return lambda: TagChecker().summary(osm_file)
+
+def audit_task(osm_file, street_alternatives, references):
+    auditor = Audit(street_alternatives)
+    return lambda: auditor.audit_way_node(osm_file, references)
+
+def shape_task(osm_file, mappings):
+    return lambda: Shape().shape(osm_file, mappings)
+
+def fantoir_task(ways_file, area_code):
+    return lambda: fantoir.FANTOIR().ways(ways_file, area_code)
+
+def shape_dicts_task(osm_file, mappings):
+    """Shaped documents kept as nested dicts (previously)"""
+    return lambda: list(Shape().iter_shape(osm_file, mappings))
+
+def shape_compact_task(osm_file, mappings):
+    """Shaped documents kept as CompactDocument (Shape.shape)"""
+    def shape_compact():
+        strings = StringTable()
+        return [CompactDocument.pack(el, strings) for el in Shape().iter_shape(osm_file, mappings)]
+    return shape_compact
+
+def in_interpreter(task, *args):
+    """Run the function set up by task(*args) in a new interpreter, return its
+    wall time and the increase of the peak RSS (kB) of the interpreter while
+    it ran (a forked process could reuse the memory freed by this one)"""
+    fd, result_file = tempfile.mkstemp(suffix=".pickle")
+    os.close(fd)
+    try:
+        code = "import sys; sys.path.insert(0, %r); import benchmark; benchmark.run_task(sys.argv[1])" % \
+               os.path.dirname(os.path.abspath(__file__))
+        with io.open(os.devnull, "wb") as devnull:
+            process = subprocess.Popen([sys.executable, "-c", code, result_file], stdin=subprocess.PIPE, stdout=devnull)
+            process.communicate(pickle.dumps((task.__name__, args), pickle.HIGHEST_PROTOCOL))
+        if process.returncode:
+            raise RuntimeError("benchmark process failed (exit code %s)" % process.returncode)
+        with io.open(result_file, "rb") as f:
+            return pickle.load(f)
+    finally:
+        os.remove(result_file)
+
+def peak_rss():
+    """Peak RSS (kB) of this interpreter: VmHWM on Linux, ru_maxrss also keeps
+    the peak of the process it was started from (before exec)"""
+    try:
+        with io.open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_task(result_file):
+    """Entry point of the interpreter started by in_interpreter, the task name
+    and its arguments being read from the standard input"""
+    name, args = pickle.load(sys.stdin)
+    func = globals()[name](*args)
+    rss = peak_rss()
+    start = timeit.default_timer()
+    func()
+    result = (timeit.default_timer() - start, peak_rss() - rss)
+    with io.open(result_file, "wb") as f:
+        pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+
+class Benchmark(object):
+    """Number of elements of the synthetic files of the scaling benchmark (up to
+    10000000 with -s, Shape.shape keeps about 0.55 GB of compact documents per
+    million, see -b compact)"""
+    SCALES = [10000, 100000, 1000000]
+
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+
+    def best(self, func, *args, **kwargs):
+        """Return the best wall time out of self.repeat runs and the last result"""
+        timings = []
+        for _ in range(self.repeat):
+            start = timeit.default_timer()
+            result = func(*args, **kwargs)
+            timings.append(timeit.default_timer() - start)
+        return min(timings), result
+
+    def fantoir(self, fantoir_file, area_code):
+        previous, expected = self.best(fantoir_ways_apply, fantoir_file, area_code)
+        current, df = self.best(fantoir.FANTOIR().ways, fantoir_file, area_code)
+        pd.util.testing.assert_frame_equal(expected, df)
+        return {
+            "ways": len(df),
+            "previous": previous,
+            "current": current,
+            "speedup": previous / current if current else None
+        }
+
+    def shape(self, elements=10000, tags=20):
+        """Per element reading and shaping cost (microseconds) on a synthetic
+        tag heavy file, previously ElementTree elements shaped by NestedShape"""
+        fd, osm_file = tempfile.mkstemp(suffix=".osm")
+        os.close(fd)
+        try:
+            tag_heavy_osm(osm_file, elements, tags)
+            mappings = dict((f, {}) for f in Shape.MAPPING_FILES)
+            previous, expected = self.best(lambda: [NestedShape().shape_element(e, mappings) for e in OSMReader().trees(osm_file)])
+            current, data = self.best(lambda: [Shape().shape_element(e, mappings) for e in OSMReader().elements(osm_file)])
+            assert expected == data
+        finally:
+            os.remove(osm_file)
+
+        return {
+            "elements": elements,
+            "tags": tags,
+            "previous": previous * 1e6 / elements,
+            "current": current * 1e6 / elements,
+            "speedup": previous / current if current else None
+        }
+
+    def compact(self, elements=100000, way_types_file="data/FANTOIR1016-WAY-TYPE.csv"):
+        """Memory held by the shaped documents of a synthetic file, kept as
+        nested dicts (previously) and as CompactDocument (Shape.shape): peak
+        RSS increase (kB) of a new interpreter shaping them, and bytes per document"""
+        fd, osm_file = tempfile.mkstemp(suffix=".osm")
+        os.close(fd)
+        try:
+            Synthetic(way_types_file=way_types_file).write_osm(osm_file, elements)
+            mappings = dict((f, {}) for f in Shape.MAPPING_FILES)
+            previous = self.measure(elements, shape_dicts_task, osm_file, mappings)
+            current = self.measure(elements, shape_compact_task, osm_file, mappings)
+            expected = shape_dicts_task(osm_file, mappings)()
+            assert [to_dict(el) for el in shape_compact_task(osm_file, mappings)()] == expected
+            documents = len(expected)
+        finally:
+            os.remove(osm_file)
+
+        return {
+            "elements": elements,
+            "documents": documents,
+            "previous": previous,
+            "current": current,
+            "previous_bytes_per_document": previous["memory_kb"] * 1024 / documents,
+            "current_bytes_per_document": current["memory_kb"] * 1024 / documents,
+            "memory_ratio": float(previous["memory_kb"]) / current["memory_kb"] if current["memory_kb"] else None
+        }
+
+    def reader(self, elements=100000, way_types_file="data/FANTOIR1016-WAY-TYPE.csv"):
+        """Per element reading cost (microseconds) of the tags and node refs
+        of a synthetic file: ElementTree elements, Element records, Element
+        records of the elements having audited tags, and Element records of
+        the same file as PBF"""
+        fd, osm_file = tempfile.mkstemp(suffix=".osm")
+        os.close(fd)
+        pbf_file = osm_file + ".pbf"
+        try:
+            synthetic = Synthetic(way_types_file=way_types_file)
+            synthetic.write_osm(osm_file, elements)
+            synthetic.write_pbf(pbf_file, elements)
+            def read_trees():
+                return [(e.tag, e.attrib, [(t.attrib['k'], t.attrib['v']) for t in e.iter("tag")],
+                         [nd.attrib["ref"] for nd in e.iter("nd")]) for e in OSMReader().trees(osm_file)]
+            def read_elements(keys=None, source=osm_file):
+                return [(e.tag, e.attrib, e.tags, e.refs) for e in OSMReader().elements(source, keys=keys)]
+            keys = Audit().audited_keys()
+            previous, expected = self.best(read_trees)
+            current, data = self.best(read_elements)
+            assert expected == data
+            pushdown, audited = self.best(read_elements, keys)
+            assert audited == [(tag, attrib, [t for t in tags if t[0] in keys], refs)
+                               for tag, attrib, tags, refs in expected if any(t[0] in keys for t in tags)]
+            pbf, data = self.best(read_elements, None, pbf_file)
+            assert expected == data
+        finally:
+            os.remove(osm_file)
+            if os.path.exists(pbf_file):
+                os.remove(pbf_file)
+
+        return {
+            "elements": elements,
+            "audited_elements": len(audited),
+            "previous": previous * 1e6 / elements,
+            "current": current * 1e6 / elements,
+            "pushdown": pushdown * 1e6 / elements,
+            "pbf": pbf * 1e6 / elements,
+            "speedup": previous / current if current else None
+        }
+
+    def address(self, way_types_file="data/FANTOIR1016-WAY-TYPE.csv", count=100000, distinct=10000):
+        """Per value parsing cost (microseconds) of street names and house numbers,
+        count values drawn out of distinct ones (values are repeated in an OSM file)"""
+        way_types = fantoir.FANTOIR().way_types(way_types_file)
+        alternatives = reference.street_alternatives(way_types.TYPE.values, way_types.TYPE_NAME.values)
+        rand = random.Random(974)
+        corpus = address.corpus(alternatives, distinct)
+        values = [rand.choice(corpus) for _ in range(count)]
+
+        street_re = re.compile(reference.street_expression(way_types.TYPE.values, way_types.TYPE_NAME.values), re.IGNORECASE)
+        housenumber_re = re.compile(address.housenumber_expression(), re.IGNORECASE)
+        def search(value):
+            m = street_re.search(value)
+            return None if m is None else m.group("housenumber", "type", "name")
+        def parse(street_parser, housenumber_parser):
+            return [(street_parser.parse(v), housenumber_parser.match(v)) for v in values]
+
+        previous, expected = self.best(lambda: [(search(v), housenumber_re.match(v).group("housenumber")) for v in values])
+        current, parsed = self.best(lambda: parse(address.StreetParser(alternatives), address.HouseNumberParser()))
+        assert expected == parsed
+
+        return {
+            "values": count,
+            "distinct": len(corpus),
+            "previous": previous * 1e6 / count,
+            "current": current * 1e6 / count,
+            "speedup": previous / current if current else None
+        }
+
+    def suggest(self, names=20000, values=5000, scanned=200):
+        """Per value suggestion cost (microseconds) of values misspelled names out
+        of names reference names, the scan being timed over the first scanned values"""
+        references, misspelled = street_names(names)
+        misspelled = random.Random(974).sample(misspelled, min(values, len(misspelled)))
+        build, suggester = self.best(Suggester, references)
+        previous, expected = self.best(lambda: [suggest_scan(suggester, v) for v in misspelled[:scanned]])
+        current, suggestions = self.best(lambda: [suggester.suggest(v) for v in misspelled])
+        assert expected == suggestions[:scanned]
+
+        return {
+            "names": len(references),
+            "values": len(misspelled),
+            "index": build,
+            "total": current,
+            "previous": previous * 1e6 / scanned,
+            "current": current * 1e6 / len(misspelled),
+            "speedup": (previous / scanned) / (current / len(misspelled)) if current else None,
+            "confident": sum(1 for _, score in suggestions if suggester.is_confident(score))
+        }
+
+    def mongo(self, elements=10000, batch_size=MongoWriter.BATCH_SIZE):
+        """Number of round trips to load and correct elements documents in a
+        MongoDB stand-in (seconds include the stand-in in-memory work)"""
+        postcodes = ["97480", "97 480", "97410", "97430", "12345"]
+        city_by_postcode = { 97480: "ST JOSEPH", 97410: "ST PIERRE", 97430: "LE TAMPON" }
+        def documents():
+            for i in range(elements):
+                document = { "type": "node", "id": str(i + 1), "created": { "user": "u%d" % (i % 10) } }
+                if i % 2:
+                    document["address"] = { "postcode": postcodes[i % len(postcodes)], "city": "x" }
+                yield document
+
+        def load(collection):
+            writer = MongoWriter(collection, batch_size=batch_size)
+            with writer:
+                for document in documents():
+                    writer.write(document)
+            writer.correct(city_by_postcode)
+            return collection
+
+        previous, expected = self.best(lambda: notebook_load(documents(), MemoryCollection(), city_by_postcode))
+        current, collection = self.best(lambda: load(MemoryCollection()))
+        strip = lambda collection: [dict((k, v) for k, v in d.items() if k != "_id") for d in collection.documents]
+        assert strip(expected) == strip(collection)
+
+        return {
+            "documents": elements,
+            "previous": previous,
+            "current": current,
+            "previous_calls": expected.calls,
+            "current_calls": collection.calls,
+            "indexes": collection.indexes
+        }
+
+    def columnar(self, elements=10000, tags=20):
+        """Time to load the nodes (id, position, user) of a synthetic tag heavy
+        file from the JSON lines file and from the columnar export"""
+        fd, osm_file = tempfile.mkstemp(suffix=".osm")
+        os.close(fd)
+        folder = tempfile.mkdtemp()
+        try:
+            tag_heavy_osm(osm_file, elements, tags)
+            shaper = Shape()
+            mappings = dict((f, {}) for f in Shape.MAPPING_FILES)
+            shaper.export(osm_file, mappings)
+            shaper.export_columnar(osm_file, mappings, folder)
+
+            def load_json():
+                with io.open("{0}.json".format(osm_file), "rb") as f:
+                    documents = [json.loads(line) for line in f]
+                return pd.DataFrame({ "id": [int(d["id"]) for d in documents],
+                                      "lat": [d["pos"][0] for d in documents],
+                                      "lon": [d["pos"][1] for d in documents],
+                                      "user": [d["created"]["user"] for d in documents] })
+            load_columnar = lambda: ColumnarReader(folder).nodes()[["id", "lat", "lon", "user"]]
+            previous, expected = self.best(load_json)
+            current, nodes = self.best(load_columnar)
+            assert (expected.id.values == nodes.id.values).all() and list(expected.user) == list(nodes.user)
+            sizes = (os.path.getsize("{0}.json".format(osm_file)),
+                     sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)))
+        finally:
+            os.remove(osm_file)
+            os.remove("{0}.json".format(osm_file))
+            shutil.rmtree(folder)
+
+        return {
+            "elements": elements,
+            "tags": tags,
+            "previous": previous,
+            "current": current,
+            "speedup": previous / current if current else None,
+            "json_bytes": sizes[0],
+            "columnar_bytes": sizes[1]
+        }
+
+    def measure(self, elements, task, *args):
+        """Best wall time out of self.repeat runs of the function set up by
+        task(*args), each one in a new interpreter, throughput and peak memory
+        increase (kB)"""
+        runs = [in_interpreter(task, *args) for _ in range(self.repeat)]
+        seconds = min(run[0] for run in runs)
+        return {
+            "seconds": seconds,
+            "per_second": elements / seconds if seconds else None,
+            "memory_kb": max(run[1] for run in runs)
+        }
+
+    def run_tool(self, folder, tool, args, prepare=None):
+        """Best process wall time and time to the first element (see metrics.py)
+        out of self.repeat runs of the command line tool in folder, prepare
+        being called before each run"""
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "%s.py" % tool)
+        metrics_file = os.path.join(folder, "metrics.json")
+        runs = []
+        with io.open(os.devnull, "wb") as devnull:
+            for _ in range(self.repeat):
+                if prepare is not None:
+                    prepare()
+                start = timeit.default_timer()
+                subprocess.check_call([sys.executable, script] + args + ["--metrics-out", metrics_file],
+                                      cwd=folder, stdout=devnull)
+                wall_time = timeit.default_timer() - start
+                with io.open(metrics_file, "rb") as f:
+                    runs.append((wall_time, json.load(f)["first_element"]))
+        return { "wall_time": min(run[0] for run in runs), "first_element": min(run[1] for run in runs) }
+
+    def import_time(self, tool):
+        """Best time to import the module of the command line tool, in a new process"""
+        code = "import timeit; start = timeit.default_timer(); import %s; print(timeit.default_timer() - start)" % tool
+        return min(float(subprocess.check_output([sys.executable, "-c", code],
+                                                 cwd=os.path.dirname(os.path.abspath(__file__))))
+                   for _ in range(self.repeat))
+
+    def startup(self, elements=10000, localities=39000, way_types_file="data/FANTOIR1016-WAY-TYPE.csv", rules_file="data/rules.csv"):
+        """Start up cost of tags.py, audit.py, shape.py and pipeline.py on a
+        synthetic extract of elements elements (La Poste file of as many
+        localities as the national one): time to import the module, time from
+        the start of the run (options parsed) to the first element and process
+        wall time, with an up to date reference bundle ('audit' and 'pipeline')
+        or without any ('audit_build')"""
+        synthetic = Synthetic(way_types_file=way_types_file)
+        folder = tempfile.mkdtemp()
+        results = {}
+        try:
+            os.mkdir(os.path.join(folder, "data"))
+            os.mkdir(os.path.join(folder, "audit"))
+            shutil.copy(way_types_file, os.path.join(folder, "data", "FANTOIR1016-WAY-TYPE.csv"))
+            shutil.copy(rules_file, os.path.join(folder, "data", "rules.csv"))
+            osm_file = os.path.join("data", "synthetic.osm")
+            synthetic.write_osm(os.path.join(folder, osm_file), elements)
+            synthetic.write_fantoir(os.path.join(folder, "data", "FANTOIR"))
+            synthetic.write_postcodes(os.path.join(folder, "data", "laposte_hexasmal.csv"), localities)
+            audit_args = ["-i", "-o", osm_file, "-f", "data/FANTOIR", "-a", synthetic.area_code, "-u", "audit"]
+            bundle_file = os.path.join(folder, "data", "FANTOIR-%s.bundle" % synthetic.area_code)
+            def remove_bundle():
+                if os.path.exists(bundle_file):
+                    os.remove(bundle_file)
+
+            results["audit_build"] = self.run_tool(folder, "audit", audit_args, remove_bundle)
+            results["audit"] = self.run_tool(folder, "audit", audit_args)
+            results["tags"] = self.run_tool(folder, "tags", ["-o", osm_file])
+            results["shape"] = self.run_tool(folder, "shape", ["-o", osm_file, "-u", "audit"])
+            results["pipeline"] = self.run_tool(folder, "pipeline", audit_args + ["-m", "audit"])
+            for tool in ["audit", "tags", "shape", "pipeline"]:
+                results[tool]["imports"] = self.import_time(tool)
+        finally:
+            shutil.rmtree(folder)
+
+        return results
+
+    def scaling(self, sizes=SCALES, bad_share=0.1, way_types_file="data/FANTOIR1016-WAY-TYPE.csv"):
+        """Throughput (elements per second) and peak memory of TagChecker.summary,
+        Audit.audit_way_node and Shape.shape on synthetic OSM files of each size,
+        and of FANTOIR.ways on synthetic FANTOIR files of as many ways"""
+        synthetic = Synthetic(bad_share=bad_share, way_types_file=way_types_file)
+        folder = tempfile.mkdtemp()
+        results = {}
+        try:
+            fantoir_file = os.path.join(folder, "FANTOIR")
+            postcode_file = os.path.join(folder, "laposte_hexasmal.csv")
+            synthetic.write_fantoir(fantoir_file)
+            synthetic.write_postcodes(postcode_file)
+            bundle = reference.ReferenceBundle(fantoir_file, synthetic.area_code, postcode_file, way_types_file).load()
+            auditor = Audit(bundle["street_alternatives"])
+            references = auditor.references(bundle=bundle)
+            mappings = dict((f, {}) for f in Shape.MAPPING_FILES)
+
+            for size in sizes:
+                osm_file = os.path.join(folder, "synthetic-%d.osm" % size)
+                ways_file = os.path.join(folder, "FANTOIR-%d" % size)
+                start = timeit.default_timer()
+                synthetic.write_osm(osm_file, size)
+                synthetic.write_fantoir(ways_file, size)
+                result = { "generate": timeit.default_timer() - start, "osm_bytes": os.path.getsize(osm_file) }
+                result["tags"] = self.measure(size, tags_task, osm_file)
+                result["audit"] = self.measure(size, audit_task, osm_file, bundle["street_alternatives"], references)
+                result["shape"] = self.measure(size, shape_task, osm_file, mappings)
+                result["fantoir"] = self.measure(size, fantoir_task, ways_file, synthetic.area_code)
+                results[size] = result
+                for path in [osm_file, "{0}.json".format(osm_file), ways_file, ways_file + fantoir.FANTOIR.INDEX_SUFFIX]:
+                    if os.path.exists(path):
+                        os.remove(path)
+        finally:
+            shutil.rmtree(folder)
+
+        return results
+
+def usage():
+    print('benchmark.py -n <REPEAT> -b <BENCHMARK,...> -f <FANTOIR FILE> -a <AREA> -e <ELEMENTS> -s <SIZE,...>')
+
+def main(argv):
+    repeat = 3
+    benchmarks = ["fantoir", "shape", "reader", "compact", "address", "suggest", "mongo", "columnar", "startup"]
+    fantoir_file = None
+    area_code = None
+    elements = 10000
+    sizes = Benchmark.SCALES
+
+    try:
+        opts, args = getopt.getopt(argv,"hn:b:f:a:e:s:",["repeat=", "benchmark=", "fantoir=", "area=", "elements=", "sizes="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-n", "--repeat"):
+             repeat = int(arg)
+        elif opt in ("-b", "--benchmark"):
+             benchmarks = arg.split(",")
+        elif opt in ("-f", "--fantoir"):
+             fantoir_file = arg
+        elif opt in ("-a", "--area"):
+             area_code = arg
+        elif opt in ("-e", "--elements"):
+             elements = int(arg)
+        elif opt in ("-s", "--sizes"):
+             sizes = [int(size) for size in arg.split(",")]
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if "fantoir" in benchmarks and (fantoir_file is None or area_code is None):
+        print("You need to supply -f and -a for fantoir benchmark")
+        sys.exit(2)
+
+    benchmark = Benchmark(repeat)
+    results = {}
+    if "fantoir" in benchmarks:
+        results["fantoir"] = benchmark.fantoir(fantoir_file, area_code)
+    if "shape" in benchmarks:
+        results["shape"] = benchmark.shape(elements)
+    if "reader" in benchmarks:
+        results["reader"] = benchmark.reader(elements * 10)
+    if "compact" in benchmarks:
+        results["compact"] = benchmark.compact(elements * 10)
+    if "address" in benchmarks:
+        results["address"] = benchmark.address()
+    if "suggest" in benchmarks:
+        results["suggest"] = benchmark.suggest()
+    if "mongo" in benchmarks:
+        results["mongo"] = benchmark.mongo(elements)
+    if "columnar" in benchmarks:
+        results["columnar"] = benchmark.columnar(elements)
+    if "startup" in benchmarks:
+        results["startup"] = benchmark.startup(elements)
+    if "scaling" in benchmarks:
+        results["scaling"] = benchmark.scaling(sizes)
+    pprint.pprint(results)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
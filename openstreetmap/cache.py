@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local cache of the results of audit.py and tags.py runs
+
+Results are addressed by the sha1 of everything they depend on: the content
+of the OSM file, the reference data (sha1 of the bundle sources, area code)
+and the rules and regular expressions in use. Entries are pickled and zlib
+compressed, one file per key (<CACHE FOLDER>/<KEY>.cache). The least
+recently used entries are evicted to keep the folder under its size limit.
+
+The sha1 of the OSM files is remembered with their size and mtime
+(<CACHE FOLDER>/fingerprints), an unchanged file is not read again.
+"""
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import hashlib
+import io
+import os
+import pprint
+import tempfile
+import zlib
+import sys, getopt
+
+import reference
+
+class ResultCache(object):
+    VERSION = 2
+    MAX_SIZE = 256 << 20
+    EXTENSION = ".cache"
+
+    def __init__(self, folder, max_size=MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.fingerprints_file = os.path.join(folder, "fingerprints")
+        self.hits = self.misses = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def fingerprint(self, path):
+        """Return the sha1 of the content of path"""
+        fingerprints = self.load(self.fingerprints_file) or {}
+        path = os.path.abspath(path)
+        previous = fingerprints.get(path)
+        fingerprints[path] = reference.fingerprint(path, previous)
+        if fingerprints[path] is not previous:
+            self.dump(self.fingerprints_file, fingerprints)
+        return fingerprints[path]["sha1"]
+
+    def key(self, *parts):
+        """Return the key of a result from the (repr-able) values it depends on"""
+        return hashlib.sha1(repr((self.VERSION,) + parts)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + self.EXTENSION)
+
+    def load(self, path):
+        try:
+            with io.open(path, "rb") as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except (IOError, OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            return None
+
+    def dump(self, path, value):
+        """Write value to a temporary file renamed to path (no partial entry
+        is read by a concurrent run)"""
+        fd, tmp = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+        os.rename(tmp, path)
+
+    def get(self, key):
+        """Return the cached result, None on a miss"""
+        value = self.load(self.path(key))
+        if value is not None:
+            os.utime(self.path(key), None) # most recently used
+            self.hits += 1
+        else:
+            self.misses += 1
+        return value
+
+    def put(self, key, value):
+        self.dump(self.path(key), value)
+        self.evict()
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def entries(self):
+        """Return (mtime, size, path) of the entries, least recently used first"""
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(self.EXTENSION):
+                stat = os.stat(os.path.join(self.folder, name))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.folder, name)))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove the least recently used entries until the folder fits in
+        max_size, return the number of removed entries"""
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            os.remove(path)
+            size -= entry_size
+            removed += 1
+        return removed
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+
+def usage():
+    print('cache.py -c <CACHE FOLDER> [-s <CACHE SIZE (MB)>] [-x]')
+
+def main(argv):
+    folder = None
+    max_size = ResultCache.MAX_SIZE
+    clear = False
+
+    try:
+        opts, args = getopt.getopt(argv,"hc:s:x",["cache=", "size=", "clear"])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-c", "--cache"):
+             folder = arg
+        elif opt in ("-s", "--size"):
+             max_size = int(arg) << 20
+        elif opt in ("-x", "--clear"):
+             clear = True
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if folder is None:
+        print("You need to supply -c")
+        sys.exit(2)
+
+    cache = ResultCache(folder, max_size)
+    if clear:
+        cache.clear()
+    evicted = cache.evict()
+    entries = cache.entries()
+    pprint.pprint({ "entries": len(entries), "size": sum(entry[1] for entry in entries), "evicted": evicted })
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Columnar export of the nodes, ways and tags of an OpenStreetMap OSM file
+
+The export is a folder of NumPy .npy files (memory-mapped when loaded)
+described by manifest.json:
+
+'nodes.*', id (int64), lat and lon (float64), version (int32), timestamp
+(datetime64[s]), user and changeset (int32 codes in the users and changesets
+dictionaries),
+'ways.*', same id and metadata columns, refs (int64 node ids) and offsets
+(int64, CSR style: the refs of way i are refs[offsets[i]:offsets[i + 1]]),
+'tags.*', element (uint8, 0 for a node and 1 for a way), row (int64, row of
+the element in nodes or ways), key and value (int32 codes in the keys and
+values dictionaries).
+
+String dictionaries are stored as UTF-8 bytes (<name>.data) and offsets
+(<name>.offsets), the changesets dictionary as int64 changeset ids.
+"""
+
+import numpy as np
+import pandas as pd
+import io
+import json
+import os
+import pprint
+import sys, getopt
+
+class Column(object):
+    """Typed column, values are buffered and converted to NumPy by chunks
+    (strings are parsed by NumPy)"""
+    CHUNK_SIZE = 100000
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.pending = []
+        self.chunks = []
+
+    def append(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= self.CHUNK_SIZE:
+            self.flush()
+
+    def extend(self, values):
+        self.pending.extend(values)
+        if len(self.pending) >= self.CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.chunks.append(np.array(self.pending, dtype=self.dtype))
+            self.pending = []
+
+    def array(self):
+        self.flush()
+        if not self.chunks:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(self.chunks)
+
+class Dictionary(object):
+    """Interned values, each distinct value is given the next integer code"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        try:
+            return self.codes[value]
+        except KeyError:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            return code
+
+    def strings(self):
+        """Return the offsets and UTF-8 data arrays of the values"""
+        data = [v.encode('utf-8') if isinstance(v, unicode) else v for v in self.values]
+        offsets = np.zeros(len(data) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(d) for d in data])
+        return offsets, np.frombuffer(b"".join(data), dtype=np.uint8)
+
+class ColumnarWriter(object):
+    VERSION = 1
+    NODE = 0
+    WAY = 1
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.dictionaries = dict((name, Dictionary()) for name in ["users", "changesets", "keys", "values"])
+        self.columns = {}
+        for prefix in ["nodes", "ways"]:
+            self.columns.update({
+                prefix + ".id": Column(np.int64),
+                prefix + ".version": Column(np.int32),
+                prefix + ".timestamp": Column("datetime64[s]"),
+                prefix + ".user": Column(np.int32),
+                prefix + ".changeset": Column(np.int32)
+            })
+        self.columns.update({
+            "nodes.lat": Column(np.float64),
+            "nodes.lon": Column(np.float64),
+            "ways.refs": Column(np.int64),
+            "ways.offsets": Column(np.int64),
+            "tags.element": Column(np.uint8),
+            "tags.row": Column(np.int64),
+            "tags.key": Column(np.int32),
+            "tags.value": Column(np.int32)
+        })
+        self.columns["ways.offsets"].append(0)
+        self.counts = { "nodes": 0, "ways": 0, "refs": 0, "tags": 0 }
+
+    def write_metadata(self, prefix, attrib):
+        columns = self.columns
+        columns[prefix + ".id"].append(attrib["id"])
+        columns[prefix + ".version"].append(attrib.get("version", 0))
+        timestamp = attrib.get("timestamp", "NaT")
+        columns[prefix + ".timestamp"].append(timestamp[:-1] if timestamp.endswith("Z") else timestamp)
+        columns[prefix + ".user"].append(self.dictionaries["users"].code(attrib.get("user", u"")))
+        columns[prefix + ".changeset"].append(self.dictionaries["changesets"].code(attrib.get("changeset", "0")))
+
+    def write_tags(self, element, row, tags):
+        columns = self.columns
+        for key, value in tags:
+            columns["tags.element"].append(element)
+            columns["tags.row"].append(row)
+            columns["tags.key"].append(self.dictionaries["keys"].code(key))
+            columns["tags.value"].append(self.dictionaries["values"].code(value))
+            self.counts["tags"] += 1
+
+    def write_node(self, attrib, tags=()):
+        """Write a node from its attributes and its (key, value) tags"""
+        self.write_metadata("nodes", attrib)
+        self.columns["nodes.lat"].append(attrib.get("lat", "nan"))
+        self.columns["nodes.lon"].append(attrib.get("lon", "nan"))
+        self.write_tags(self.NODE, self.counts["nodes"], tags)
+        self.counts["nodes"] += 1
+
+    def write_way(self, attrib, refs, tags=()):
+        """Write a way from its attributes, its node ids and its (key, value) tags"""
+        self.write_metadata("ways", attrib)
+        self.columns["ways.refs"].extend(refs)
+        self.counts["refs"] += len(refs)
+        self.columns["ways.offsets"].append(self.counts["refs"])
+        self.write_tags(self.WAY, self.counts["ways"], tags)
+        self.counts["ways"] += 1
+
+    def save(self, name, array, arrays):
+        np.save(os.path.join(self.folder, name + ".npy"), array)
+        arrays[name] = { "dtype": array.dtype.str, "shape": list(array.shape) }
+
+    def close(self):
+        arrays = {}
+        for name, column in self.columns.items():
+            self.save(name, column.array(), arrays)
+            column.chunks = []
+        for name in ["users", "keys", "values"]:
+            offsets, data = self.dictionaries[name].strings()
+            self.save(name + ".offsets", offsets, arrays)
+            self.save(name + ".data", data, arrays)
+        self.save("changesets", np.array(self.dictionaries["changesets"].values, dtype=np.int64), arrays)
+
+        with io.open(os.path.join(self.folder, "manifest.json"), "wb") as f:
+            f.write(json.dumps({ "version": self.VERSION, "counts": self.counts, "arrays": arrays },
+                               indent=2, sort_keys=True))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+class ColumnarReader(object):
+    """Access to a columnar export, arrays are memory-mapped (mmap_mode=None
+    to read them in memory)"""
+
+    def __init__(self, folder, mmap_mode="r"):
+        self.folder = folder
+        self.mmap_mode = mmap_mode
+        with io.open(os.path.join(folder, "manifest.json"), "rb") as f:
+            self.manifest = json.loads(f.read())
+        if self.manifest["version"] != ColumnarWriter.VERSION:
+            raise ValueError("unsupported columnar export version %s" % self.manifest["version"])
+
+    def array(self, name):
+        return np.load(os.path.join(self.folder, name + ".npy"), mmap_mode=self.mmap_mode)
+
+    def strings(self, name):
+        """Return the values of a string dictionary"""
+        offsets = self.array(name + ".offsets")
+        data = self.array(name + ".data").tobytes()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def metadata(self, prefix):
+        return pd.DataFrame({
+            "id": self.array(prefix + ".id"),
+            "version": self.array(prefix + ".version"),
+            "timestamp": self.array(prefix + ".timestamp"),
+            "user": pd.Categorical.from_codes(self.array(prefix + ".user"), self.strings("users")),
+            "changeset": self.array("changesets")[self.array(prefix + ".changeset")]
+        }, columns=["id", "version", "timestamp", "user", "changeset"])
+
+    def nodes(self):
+        df = self.metadata("nodes")
+        df["lat"] = self.array("nodes.lat")
+        df["lon"] = self.array("nodes.lon")
+        return df
+
+    def ways(self):
+        """Metadata of the ways and number of node refs of each one"""
+        df = self.metadata("ways")
+        df["refs"] = np.diff(self.array("ways.offsets"))
+        return df
+
+    def refs(self, row):
+        """Node ids of the way at row"""
+        offsets = self.array("ways.offsets")
+        return self.array("ways.refs")[offsets[row]:offsets[row + 1]]
+
+    def tags(self, element=ColumnarWriter.NODE):
+        """Tags of the nodes (or ways), row being the row of the element"""
+        mask = self.array("tags.element") == element
+        return pd.DataFrame({
+            "row": self.array("tags.row")[mask],
+            "key": pd.Categorical.from_codes(self.array("tags.key")[mask], self.strings("keys")),
+            "value": pd.Categorical.from_codes(self.array("tags.value")[mask], self.strings("values"))
+        }, columns=["row", "key", "value"])
+
+def usage():
+    print('columnar.py -c <COLUMNAR FOLDER>')
+
+def main(argv):
+    folder = None
+
+    try:
+        opts, args = getopt.getopt(argv,"hc:",["columnar="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-c", "--columnar"):
+             folder = arg
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if folder is None:
+        print("You need to supply -c")
+        sys.exit(2)
+
+    reader = ColumnarReader(folder)
+    pprint.pprint(reader.manifest["counts"])
+    print(reader.nodes().head())
+    print(reader.ways().head())
+    print(reader.tags().head())
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compact in-memory form of the shaped documents (see shape.Shape)
+
+A shaped document is a nested dict: every document has its own dict
+objects and its own copy of each key and value. A CompactDocument keeps the
+same content in a few tuples, the keys, the 'created' values (users,
+changesets, timestamps...) and the tag values being shared through a
+StringTable, ids and node references being stored as integers when they
+are written as such. Documents held in memory (Shape.shape, MongoDB
+batches) are kept in this form and turned back into the dict layout with
+to_dict when serialized. A StringTable keeps every distinct string it has
+seen, one is used per list of documents (per batch for MongoDB).
+
+CompactDocument is read-only, doc["id"], doc.get("address")... give the
+values of the dict layout (nested values being copies).
+"""
+
+from array import array
+
+class StringTable(dict):
+    """Interning table: table[value] is the first value seen equal to value"""
+
+    def __missing__(self, value):
+        self[value] = value
+        return value
+
+    def flat(self, items):
+        """Return the (key, value) items as a flat (key, value, key, value...)
+        tuple of interned strings"""
+        flat = []
+        for key, value in items:
+            flat.append(self[key])
+            flat.append(self[value] if isinstance(value, basestring) else value)
+        return tuple(flat)
+
+def as_int(value):
+    """Return value as an int when it is written as one, unchanged otherwise"""
+    if isinstance(value, basestring) and value.isdigit() and (value == "0" or value[0] != "0"):
+        return int(value)
+    return value
+
+def as_array(values):
+    """Return values as an array of integers when all are written as such,
+    a tuple otherwise"""
+    numbers = [as_int(value) for value in values]
+    if all(isinstance(number, (int, long)) for number in numbers):
+        return array("l", numbers)
+    return tuple(values)
+
+class CompactDocument(object):
+    """Shaped document: type, id, created, pos and node_refs, the other
+    top level fields and the address sub document as flat (key, value...)
+    tuples, read as a mapping"""
+    __slots__ = ("type", "id", "created", "pos", "fields", "address", "node_refs")
+    NESTED = ["type", "id", "created", "pos", "address", "node_refs"]
+
+    @classmethod
+    def pack(cls, document, strings):
+        """Return the CompactDocument of document, strings being shared
+        through strings (a StringTable)"""
+        doc = cls()
+        doc.type = strings[document["type"]]
+        doc.id = as_int(document.get("id"))
+        created = document.get("created")
+        doc.created = None if created is None else strings.flat(created.items())
+        pos = document.get("pos")
+        doc.pos = None if pos is None else tuple(pos)
+        address = document.get("address")
+        doc.address = strings.flat(address.items()) if isinstance(address, dict) else None
+        refs = document.get("node_refs")
+        doc.node_refs = None if refs is None else as_array(refs) if refs else ()
+        doc.fields = strings.flat((key, value) for key, value in document.items()
+                                  if key not in cls.NESTED or (key == "address" and doc.address is None))
+        return doc
+
+    def expand(self, key):
+        """Return the value of the nested field key in the dict layout, None when missing"""
+        value = getattr(self, key)
+        if value is None or key == "type":
+            return value
+        if key == "id":
+            return value if isinstance(value, basestring) else str(value)
+        if key == "pos":
+            return list(value)
+        if key == "node_refs":
+            return [ref if isinstance(ref, basestring) else str(ref) for ref in value]
+        return dict(zip(value[::2], value[1::2]))
+
+    def to_dict(self):
+        """Return the document in its shaped dict layout (as shaped by Shape.shape_element)"""
+        document = { "type": self.type }
+        for key in ["id", "created", "pos"]:
+            if getattr(self, key) is not None:
+                document[key] = self.expand(key)
+        document.update(zip(self.fields[::2], self.fields[1::2]))
+        for key in ["address", "node_refs"]:
+            if getattr(self, key) is not None:
+                document[key] = self.expand(key)
+        return document
+
+    def __getitem__(self, key):
+        if key in self.NESTED and getattr(self, key) is not None:
+            return self.expand(key)
+        fields = self.fields
+        for i in range(0, len(fields), 2):
+            if fields[i] == key:
+                return fields[i + 1]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.NESTED if getattr(self, key) is not None] + list(self.fields[::2])
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, CompactDocument):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "CompactDocument(%r)" % self.to_dict()
+
+def to_dict(document):
+    """Return document in the dict layout, CompactDocument or already a dict"""
+    return document.to_dict() if isinstance(document, CompactDocument) else document
@@ -7,15 +7,97 @@ Reference: https://www.data.gouv.fr/fr/datasets/fichier-fantoir-des-voies-et-lie
 
 import pandas as pd
 import io
+import os
+import json
+import mmap
 import requests
 
 
 class FANTOIR(object):
     DATA_URL = "https://www.data.gouv.fr/s/resources/fichier-fantoir-des-voies-et-lieux-dits/20161116-165500/FANTOIR1016.zip"
-    
-    def ways(self, csv_file, code):
-        self.data = pd.read_table(csv_file, header=None)
-        df = self.data[self.data[0].str.startswith(code) == True][0]
+
+    """Sidecar index of the byte range covered by each department (3 characters,
+    department and direction codes) and commune (6 characters) prefix
+    """
+    INDEX_SUFFIX = ".idx"
+    INDEX_PREFIXES = [3, 6]
+
+    def build_index(self, csv_file):
+        """Scan csv_file once and return the index: source file size and mtime,
+        and for each prefix the [start, end[ byte range of its lines"""
+        stat = os.stat(csv_file)
+        ranges = {}
+        offset = 0
+        with io.open(csv_file, "rb") as f:
+            for line in f:
+                end = offset + len(line)
+                for n in self.INDEX_PREFIXES:
+                    prefix = line[:n].decode("latin-1")
+                    if prefix in ranges:
+                        ranges[prefix][1] = end
+                    else:
+                        ranges[prefix] = [offset, end]
+                offset = end
+
+        return { "size": stat.st_size, "mtime": stat.st_mtime, "ranges": ranges }
+
+    def index(self, csv_file):
+        """Return the index of csv_file, rebuilt and saved next to csv_file
+        when missing or when the size or mtime of csv_file changed"""
+        index_file = csv_file + self.INDEX_SUFFIX
+        stat = os.stat(csv_file)
+        if os.path.exists(index_file):
+            with io.open(index_file, "rb") as f:
+                index = json.load(f)
+            if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime:
+                return index
+
+        index = self.build_index(csv_file)
+        try:
+            with io.open(index_file, "wb") as f:
+                f.write(json.dumps(index).encode("utf-8"))
+        except (IOError, OSError):
+            pass # read only data folder, the index is only kept in memory
+
+        return index
+
+    def byte_range(self, csv_file, code):
+        """Return the [start, end[ byte range covering all lines starting with code
+        or None if there is none: the range of the longest indexed prefix of
+        code (commune before department), the union of the indexed prefixes
+        starting with code when code is shorter than all of them"""
+        code = code.decode("latin-1") if isinstance(code, bytes) else code
+        ranges = self.index(csv_file)["ranges"]
+        prefixes = [prefix for prefix in ranges if code.startswith(prefix)]
+        if len(prefixes):
+            return tuple(ranges[max(prefixes, key=len)])
+
+        ranges = [r for prefix, r in ranges.items() if prefix.startswith(code)]
+        if not len(ranges):
+            return None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    def read_lines(self, csv_file, code):
+        """Return the lines of csv_file starting with code, only the byte range
+        given by the index is read through a memory map"""
+        r = self.byte_range(csv_file, code)
+        if r is None:
+            return []
+
+        code = code.encode("latin-1") if not isinstance(code, bytes) else code
+        with io.open(csv_file, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                chunk = m[r[0]:r[1]]
+            finally:
+                m.close()
+
+        return [line for line in chunk.split(b"\n") if line.startswith(code)]
+
+    def ways(self, csv_file, code, way_types=None):
+        """Return the ways of the area code, way_types being read from the
+        default way types file when not given"""
+        lines = pd.Series(self.read_lines(csv_file, code), dtype=object)
         
         """
         For the project we are only considering the first 41 characters 
@@ -28,7 +110,7 @@ class FANTOIR(object):
         | Code nature de voie 
         | Libellé voie
         """
-        df = df.apply(lambda x : pd.Series(x[:41]))
+        lines = lines.str[:41].str.rstrip("\r\n")
         
         """
         Next we are filtering all lines not having at least 11 characters 
@@ -42,16 +124,17 @@ class FANTOIR(object):
         | Code nature de voie 
         | Libellé voie
         """
-        df["KEEP"] =df[0].apply(lambda x: len(x.split(' ')[0]) >= 11)
-        df = df[df.KEEP == True][0].apply(lambda x: pd.Series([x[:11].strip(),
-                                                               x[11:15].strip(), 
-                                                               x[15:41].strip()]))
-        df.columns = ["REFERENCE", "TYPE", "NAME"]
-        df = pd.merge(left=df, right=self.way_types(), on="TYPE")[["REFERENCE",
+        lines = lines[(lines.str.len() >= 11) & ~lines.str[:11].str.contains(" ", regex=False)]
+        df = pd.DataFrame({ "REFERENCE": lines.str[:11].str.strip(),
+                            "TYPE": lines.str[11:15].str.strip(),
+                            "NAME": lines.str[15:41].str.strip() },
+                          columns=["REFERENCE", "TYPE", "NAME"])
+        way_types = self.way_types() if way_types is None else way_types
+        df = pd.merge(left=df, right=way_types, on="TYPE")[["REFERENCE",
                                                                    "TYPE", 
                                                                    "TYPE_NAME", 
                                                                    "NAME"]]
-        df["FULL_NAME"] = df[["TYPE_NAME", "NAME"]].apply(lambda x: ' '.join(x), axis=1)
+        df["FULL_NAME"] = df.TYPE_NAME + " " + df.NAME
         
         return df
         
@@ -3,37 +3,152 @@
 
 """Utility class managing access to Official French Postal Code
 Reference:http://datanova.legroupe.laposte.fr/explore/dataset/laposte_hexasmal/download/?format=csv&timezone=Europe/Berlin&use_labels_for_header=true
+
+Only the columns in use are loaded (postcodes as integers, positions as
+floats, repeated names as categories), optionally filtered to the postcodes
+starting with an area prefix. Each lookup dictionary is built on first use
+and then reused.
+
+Without a local file, the national file is downloaded once and kept in a
+local snapshot (pickled, zlib compressed and sha1 checksummed) read by the
+next runs instead of the network; the snapshot is fetched again when it was
+written by another version or is corrupted. The source can be a local file
+standing for the download (same format, ';' separated).
 """
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import pandas as pd
+import numpy as np
+import hashlib
 import io
+import os
+import zlib
 import requests
 
 class PostalCode(object):
     DATA_URL = "http://datanova.legroupe.laposte.fr/explore/dataset/laposte_hexasmal/download/?format=csv&timezone=Europe/Berlin&use_labels_for_header=true"
+    SNAPSHOT_FILE = "data/laposte_hexasmal.snapshot"
+    SNAPSHOT_VERSION = 1
+    COLUMNS = ["Nom_commune", "Code_postal", "Libelle_acheminement", "coordonnees_gps"]
+    NAMES = ["Nom_commune", "Libelle_acheminement"]
+    CHUNK_SIZE = 100000
 
-    def __init__(self, local_file=None):
+    def __init__(self, local_file=None, area=None, source=DATA_URL, snapshot_file=SNAPSHOT_FILE):
+        self.area = area
+        self.indexes = {}
         if local_file is None:
-            self.data = self.load_csv()
+            self.data = self.select(self.snapshot(source, snapshot_file))
         else:
-            self.data = pd.read_csv(local_file)
+            self.data = self.read_csv(local_file)
+
+    def select(self, data):
+        """Return the rows of data whose postcode starts with self.area"""
+        if self.area is None:
+            return data
+        digits = 5 - len(self.area)
+        return data[data.Code_postal.values // 10 ** digits == int(self.area)].reset_index(drop=True)
+
+    def compact(self, data):
+        """Positions are parsed into lat and lon columns (NaN when missing),
+        names repeated enough are stored as categories"""
+        # not a string column when no position is filled in (all NaN) or none has a comma
+        gps = data.coordonnees_gps.fillna(u"").astype(unicode).str.extract(r"^\s*(?P<lat>[^,]*?)\s*,\s*(?P<lon>.*?)\s*$", expand=True)
+        gps = gps.replace(u"", np.nan).astype(float)
+        data = pd.DataFrame({ "Code_postal": data.Code_postal.values,
+                              "Nom_commune": data.Nom_commune.values,
+                              "Libelle_acheminement": data.Libelle_acheminement.values,
+                              "lat": gps.lat.values,
+                              "lon": gps.lon.values },
+                            columns=["Code_postal", "Nom_commune", "Libelle_acheminement", "lat", "lon"])
+        for column in self.NAMES:
+            if data[column].nunique() < len(data) // 2:
+                data[column] = data[column].astype("category")
+        return data
+
+    def read_csv(self, local_file, sep=","):
+        """Read the columns in use of local_file by chunks, the rows out of
+        the area being dropped from each chunk"""
+        chunks = pd.read_csv(local_file, sep=sep, usecols=self.COLUMNS, dtype={ "Code_postal": np.int32 },
+                             chunksize=self.CHUNK_SIZE)
+        return self.compact(pd.concat([self.select(chunk) for chunk in chunks], ignore_index=True))
+
+    def fetch(self, source):
+        """Return the content of source, an URL or a local file"""
+        if source.startswith("http://") or source.startswith("https://"):
+            return requests.get(source).content
+        with io.open(source, "rb") as f:
+            return f.read()
 
     def load_csv(self, data_url=DATA_URL, encoding='utf-8', sep=";"):
-        return pd.read_csv(io.StringIO(requests.get(data_url).content.decode(encoding)), sep=sep)
+        return self.read_csv(io.StringIO(self.fetch(data_url).decode(encoding)), sep=sep)
+
+    def snapshot(self, source=DATA_URL, snapshot_file=SNAPSHOT_FILE):
+        """Return the national data from snapshot_file, downloaded from source
+        and saved first when missing or invalid"""
+        data = self.load_snapshot(snapshot_file)
+        if data is None:
+            area, self.area = self.area, None # the snapshot holds all areas
+            try:
+                data = self.load_csv(source)
+            finally:
+                self.area = area
+            self.save_snapshot(snapshot_file, data)
+        return data
+
+    def load_snapshot(self, snapshot_file):
+        """Return the data of snapshot_file, None when missing, written by
+        another version or when its checksum does not match"""
+        try:
+            with io.open(snapshot_file, "rb") as f:
+                snapshot = pickle.load(f)
+        except (IOError, OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if (not isinstance(snapshot, dict) or snapshot.get("version") != self.SNAPSHOT_VERSION or
+            hashlib.sha1(snapshot["data"]).hexdigest() != snapshot["sha1"]):
+            return None
+        return pickle.loads(zlib.decompress(snapshot["data"]))
+
+    def save_snapshot(self, snapshot_file, data):
+        compressed = zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        snapshot = { "version": self.SNAPSHOT_VERSION, "sha1": hashlib.sha1(compressed).hexdigest(), "data": compressed }
+        try:
+            with io.open(snapshot_file, "wb") as f:
+                pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            pass # read only data folder, downloaded again next time
+
+    def index(self, key, value):
+        """Return the key -> value dictionary, built on first call (shared,
+        do not modify it)"""
+        if (key, value) not in self.indexes:
+            self.indexes[(key, value)] = dict(zip(self.data[key], self.data[value]))
+        return self.indexes[(key, value)]
 
     def cityByPostcode(self):
-        return dict(zip(self.data.Code_postal, self.data.Nom_commune))
+        return self.index("Code_postal", "Nom_commune")
 
     def postcodeByLocality(self):
-        return dict(zip(self.data.Libelle_acheminement , self.data.Code_postal))
-    
+        return self.index("Libelle_acheminement", "Code_postal")
+
     def localityByPostcode(self):
-        return dict(zip(self.data.Code_postal, self.data.Libelle_acheminement))
+        return self.index("Code_postal", "Libelle_acheminement")
+
+    def positions(self):
+        """Return the postcode, latitude and longitude of each locality having a position"""
+        if "positions" not in self.indexes:
+            df = self.data[["Code_postal", "lat", "lon"]].dropna()
+            self.indexes["positions"] = df.reset_index(drop=True)
+        return self.indexes["positions"]
 
     def save(self, local_file):
-        self.data.to_csv(local_file, index=False)
+        """Write the loaded columns, positions as coordonnees_gps again"""
+        gps = pd.Series(["%r,%r" % position for position in zip(self.data.lat, self.data.lon)]).where(self.data.lat.notnull())
+        data = self.data[["Nom_commune", "Code_postal", "Libelle_acheminement"]].assign(coordonnees_gps=gps)
+        data.to_csv(local_file, index=False)
 
 if __name__ == "__main__":
-    postalcode = PostalCode("data/laposte_hexasmal.csv")
-    #postalcode.save("data/laposte_hexasmal.csv")
-    assert(postalcode.cityByPostCode()[97480] == "ST JOSEPH")
\ No newline at end of file
+    postalcode = PostalCode("data/laposte_hexasmal.csv", area="974")
+    assert(postalcode.cityByPostcode()[97480] == "ST JOSEPH")
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Incremental audit and shaping of an OpenStreetMap OSM file from osmChange
+(.osc) diff files
+
+A first full pass builds a state (<OSM FILE>.state) holding the audit
+findings of each element and the position of each shaped document in
+<OSM FILE>.json. Applying a diff then only audits and shapes the created and
+modified elements: the findings of the touched elements are replaced, their
+previous documents are dropped from the JSON file (the other documents are
+copied by byte ranges, without being parsed) and their new documents are
+appended. The mapping files are regenerated from the updated findings.
+
+A state is only applied with the reference data, mapping files (when the
+mapping folder is given) and rules it was built with.
+
+Reference: http://wiki.openstreetmap.org/wiki/OsmChange
+"""
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import numpy as np
+from collections import defaultdict, OrderedDict
+import io
+import os
+import pprint
+import sys, getopt
+
+from reader import OSMReader
+from audit import Audit
+from shape import Shape, JSONWriter
+import reference
+
+class AuditState(object):
+    """Audit findings, (category, key, value) as filled by Audit.audit_element,
+    by element and their number of occurrences"""
+
+    def __init__(self):
+        self.findings = {}
+        self.counts = defaultdict(int)
+
+    def element_findings(self, auditor, elem, references):
+        results = auditor.audit_element(elem, auditor.init_results(), references)
+        return tuple((category, key, value)
+                     for category, values in results.items()
+                     for key, nested in values.items()
+                     for value in nested)
+
+    def remove(self, element):
+        for finding in self.findings.pop(element, ()):
+            self.counts[finding] -= 1
+            if not self.counts[finding]:
+                del self.counts[finding]
+
+    def update(self, element, findings):
+        self.remove(element)
+        if findings:
+            self.findings[element] = findings
+            for finding in findings:
+                self.counts[finding] += 1
+
+    def occurrences(self):
+        """Return the number of elements having each value to be fixed per category"""
+        occurrences = defaultdict(lambda: defaultdict(int))
+        for (category, _, value), count in self.counts.items():
+            occurrences[category][value] += count
+        return occurrences
+
+    def results(self, auditor):
+        """Return the findings as the results of Audit.audit_way_node"""
+        results = auditor.init_results()
+        for category, key, value in self.counts:
+            results.setdefault(category, defaultdict(set))[key].add(value)
+        return results
+
+class Incremental(object):
+    VERSION = 3
+    TYPES = { "node": 0, "way": 1 }
+
+    def __init__(self, osm_file, bundle, mappings, auditor=None, shaper=None, state_file=None, mapping_folder=None):
+        self.osm_file = osm_file
+        self.json_file = "{0}.json".format(osm_file)
+        self.state_file = "{0}.state".format(osm_file) if state_file is None else state_file
+        self.bundle = bundle
+        self.mappings = mappings
+        self.mapping_folder = mapping_folder
+        self.auditor = Audit(bundle["street_alternatives"]) if auditor is None else auditor
+        self.shaper = Shape() if shaper is None else shaper
+        self.references = self.auditor.references(bundle=bundle)
+
+    def key(self, elem):
+        """Element key: id * 2 + type (0 for a node, 1 for a way)"""
+        return int(elem.attrib["id"]) * 2 + self.TYPES[elem.tag]
+
+    def sources(self):
+        return dict((name, source["sha1"]) for name, source in self.bundle["sources"].items())
+
+    def mapping_sources(self):
+        """sha1 of the existing mapping files of the mapping folder, none when
+        the mappings were not read from a folder"""
+        if self.mapping_folder is None:
+            return {}
+        return dict((name, reference.fingerprint(path)["sha1"])
+                    for name, path in self.shaper.mapping_files(self.mapping_folder).items() if os.path.exists(path))
+
+    def rules(self):
+        return (self.auditor.rules.signature(), self.shaper.rules.signature())
+
+    def build(self):
+        """Full pass: audit and shape all elements, save and return the state"""
+        audit = AuditState()
+        keys, offsets = [], []
+        with JSONWriter(self.json_file) as writer:
+            for elem in OSMReader().elements(self.osm_file, tags=["node", "way"]):
+                key = self.key(elem)
+                audit.update(key, audit.element_findings(self.auditor, elem, self.references))
+                keys.append(key)
+                offsets.append(writer.write(self.shaper.shape_element(elem, self.mappings)))
+            size = writer.offset
+
+        state = {
+            "version": self.VERSION,
+            "sources": self.sources(),
+            "mappings": self.mapping_sources(),
+            "rules": self.rules(),
+            "audit": audit,
+            "keys": np.array(keys, dtype=np.int64),
+            "offsets": np.array(offsets + [size], dtype=np.int64)
+        }
+        self.save(state)
+        return state
+
+    def load(self):
+        with io.open(self.state_file, "rb") as f:
+            state = pickle.load(f)
+        if state["version"] != self.VERSION:
+            raise ValueError("state %s was built by another version, run a full pass" % self.state_file)
+        if state["sources"] != self.sources():
+            raise ValueError("reference data changed since state %s was built, run a full pass" % self.state_file)
+        if state["mappings"] != self.mapping_sources():
+            raise ValueError("mapping files changed since state %s was built, run a full pass" % self.state_file)
+        if state["rules"] != self.rules():
+            raise ValueError("rules changed since state %s was built, run a full pass" % self.state_file)
+        return state
+
+    def save(self, state):
+        with io.open(self.state_file, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+    def apply(self, osc_file):
+        """Apply an osmChange file to the state and the JSON file, return the
+        number of elements by action"""
+        state = self.load()
+        audit = state["audit"]
+        lines = OrderedDict()
+        actions = defaultdict(int)
+        writer = JSONWriter(os.devnull)
+        for action, elem in OSMReader().changes(osc_file, tags=["node", "way"]):
+            key = self.key(elem)
+            actions[action] += 1
+            if action == "delete":
+                audit.remove(key)
+                lines[key] = None
+            else:
+                audit.update(key, audit.element_findings(self.auditor, elem, self.references))
+                lines[key] = writer.line(self.shaper.shape_element(elem, self.mappings))
+        writer.close()
+
+        self.rewrite(state, lines)
+        self.save(state)
+        return dict(actions)
+
+    def rewrite(self, state, lines):
+        """Drop the documents of the touched elements from the JSON file and
+        append their new lines (None for a deleted element)"""
+        keys, offsets = state["keys"], state["offsets"]
+        touched = np.array(list(lines.keys()), dtype=np.int64)
+        kept = ~np.in1d(keys, touched)
+
+        tmp_file = self.json_file + ".tmp"
+        new_keys, new_offsets = [keys[kept]], []
+        with io.open(self.json_file, "rb") as fi:
+            with JSONWriter(tmp_file) as writer:
+                # copy the runs of consecutive kept lines
+                bounds = np.flatnonzero(np.diff(np.concatenate([[False], kept, [False]]).astype(np.int8)))
+                for start, end in zip(bounds[::2], bounds[1::2]):
+                    fi.seek(offsets[start])
+                    new_offsets.append(offsets[start:end] - offsets[start] + writer.offset)
+                    remaining = offsets[end] - offsets[start]
+                    while remaining:
+                        block = fi.read(min(remaining, JSONWriter.BUFFER_SIZE))
+                        writer.write_bytes(block)
+                        remaining -= len(block)
+
+                appended = [(key, line) for key, line in lines.items() if line is not None]
+                new_keys.append(np.array([key for key, _ in appended], dtype=np.int64))
+                new_offsets.append(np.array([writer.write_line(line) for _, line in appended], dtype=np.int64))
+                new_offsets.append(np.array([writer.offset], dtype=np.int64))
+        os.rename(tmp_file, self.json_file)
+
+        state["keys"] = np.concatenate(new_keys)
+        state["offsets"] = np.concatenate(new_offsets)
+
+    def summary(self, update_folder, verbose=False):
+        """Regenerate the mapping files from the findings (most frequent values
+        first), return the number of values to be fixed per category"""
+        state = self.load()
+        return self.auditor.summary(state["audit"].results(self.auditor),
+                                    update_folder=update_folder,
+                                    verbose=verbose,
+                                    init_mapping=True,
+                                    suggesters=self.auditor.suggesters(self.bundle),
+                                    occurrences=state["audit"].occurrences())
+
+def usage():
+    print('incremental.py -v -o <OSM FILE> -f <FANTOIR FILE> -a <AREA> -u <AUDIT FOLDER> -m <UPDATE MAPPING FOLDER> [-d <OSC FILE>]')
+
+def main(argv):
+    verbose = False
+    osm_file = None
+    fantoir_file = None
+    area_code = None
+    update_folder = None
+    mapping_folder = None
+    osc_file = None
+
+    try:
+        opts, args = getopt.getopt(argv,"hvo:f:a:u:m:d:",["verbose", "osm=", "fantoir=", "area=",
+                                                        "ufolder=", "mfolder=", "diff="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-v", "--verbose"):
+            verbose = True
+        elif opt in ("-o", "--osm"):
+             osm_file = arg
+        elif opt in ("-f", "--fantoir"):
+             fantoir_file = arg
+        elif opt in ("-a", "--area"):
+             area_code = arg
+        elif opt in ("-u", "--ufolder"):
+             update_folder = arg
+        elif opt in ("-m", "--mfolder"):
+             mapping_folder = arg
+        elif opt in ("-d", "--diff"):
+             osc_file = arg
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if None in [osm_file, fantoir_file, area_code, update_folder, mapping_folder]:
+        print("You need to supply -o, -f, -a, -u and -m")
+        sys.exit(2)
+
+    shaper = Shape()
+    incremental = Incremental(osm_file,
+                              reference.ReferenceBundle(fantoir_file, area_code).load(),
+                              shaper.load_mappings(mapping_folder),
+                              shaper=shaper,
+                              mapping_folder=mapping_folder)
+    if osc_file is None:
+        incremental.build()
+    else:
+        pprint.pprint(incremental.apply(osc_file))
+    pprint.pprint(incremental.summary(update_folder, verbose))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Node location store: node id -> (lat, lon) kept on disk and memory-mapped,
+used to resolve the node references of ways to coordinates
+
+The store is filled during a first streaming pass over the nodes (one chunk
+of locations in memory at a time, pipeline.py -l fills it along with its
+other stages) and saved as two .npy files sorted by id
+(<store>.ids.npy and <store>.coords.npy). Nodes are usually sorted by id in
+an OSM file; if not, the chunks are sorted and merged on disk block by block.
+Ways are then resolved in a second pass by batches of binary searches on the
+memory-mapped ids, so memory stays bounded whatever the size of the file.
+"""
+
+import numpy as np
+import io
+import csv
+import os
+import pprint
+import sys, getopt
+
+from reader import OSMReader
+from spatial import distance
+
+class NodeLocationWriter(object):
+    CHUNK_SIZE = 1 << 20
+    DTYPE = np.dtype([("id", "<i8"), ("lat", "<f8"), ("lon", "<f8")])
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.ids, self.lats, self.lons = [], [], []
+        self.runs = []
+        self.sorted = True
+        self.count = 0
+        self.raw = io.open(path + ".tmp", "wb")
+
+    def add(self, attrib):
+        """Add the location of a node from its attributes"""
+        if "lat" in attrib and "lon" in attrib:
+            self.ids.append(attrib["id"])
+            self.lats.append(attrib["lat"])
+            self.lons.append(attrib["lon"])
+            if len(self.ids) >= self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """Write the pending locations as one run sorted by id"""
+        if not self.ids:
+            return
+        chunk = np.zeros(len(self.ids), dtype=self.DTYPE)
+        chunk["id"] = np.array(self.ids, dtype=np.int64)
+        chunk["lat"] = np.array(self.lats, dtype=np.float64)
+        chunk["lon"] = np.array(self.lons, dtype=np.float64)
+        self.ids, self.lats, self.lons = [], [], []
+
+        if (np.diff(chunk["id"]) < 0).any():
+            chunk = chunk[np.argsort(chunk["id"], kind="mergesort")]
+        if self.runs and chunk["id"][0] < self.last:
+            self.sorted = False
+        self.last = chunk["id"][-1]
+
+        chunk.tofile(self.raw)
+        self.runs.append((self.count, len(chunk)))
+        self.count += len(chunk)
+
+    def merge(self, a, b, out):
+        """Merge the sorted runs a and b into out, one block of each at a time"""
+        i = j = k = 0
+        while i < len(a) and j < len(b):
+            block_a, block_b = a[i:i + self.chunk_size], b[j:j + self.chunk_size]
+            bound = min(block_a["id"][-1], block_b["id"][-1])
+            na = np.searchsorted(block_a["id"], bound, side="right")
+            nb = np.searchsorted(block_b["id"], bound, side="right")
+            merged = np.concatenate([block_a[:na], block_b[:nb]])
+            out[k:k + len(merged)] = merged[np.argsort(merged["id"], kind="mergesort")]
+            i, j, k = i + na, j + nb, k + len(merged)
+        for rest, n in [(a, i), (b, j)]:
+            while n < len(rest):
+                block = rest[n:n + self.chunk_size]
+                out[k:k + len(block)] = block
+                n, k = n + len(block), k + len(block)
+
+    def sort(self):
+        """Merge the runs two by two until one single run is left,
+        return the file holding it"""
+        source, target = self.path + ".tmp", self.path + ".tmp2"
+        runs = self.runs
+        while len(runs) > 1:
+            records = np.memmap(source, dtype=self.DTYPE, mode="r", shape=(self.count,))
+            out = np.memmap(target, dtype=self.DTYPE, mode="w+", shape=(self.count,))
+            merged = []
+            for n in range(0, len(runs), 2):
+                (start, count_a), (_, count_b) = runs[n], runs[n + 1] if n + 1 < len(runs) else (0, 0)
+                self.merge(records[start:start + count_a], records[start + count_a:start + count_a + count_b],
+                           out[start:start + count_a + count_b])
+                merged.append((start, count_a + count_b))
+            out.flush()
+            del records, out
+            source, target, runs = target, source, merged
+        return source
+
+    def close(self):
+        self.flush()
+        self.raw.close()
+        source = self.path + ".tmp" if self.sorted else self.sort()
+
+        ids = np.lib.format.open_memmap(self.path + ".ids.npy", mode="w+", dtype=np.int64, shape=(self.count,))
+        coords = np.lib.format.open_memmap(self.path + ".coords.npy", mode="w+", dtype=np.float64, shape=(self.count, 2))
+        if self.count:
+            records = np.memmap(source, dtype=self.DTYPE, mode="r", shape=(self.count,))
+            for start in range(0, self.count, self.chunk_size):
+                block = records[start:start + self.chunk_size]
+                ids[start:start + len(block)] = block["id"]
+                coords[start:start + len(block), 0] = block["lat"]
+                coords[start:start + len(block), 1] = block["lon"]
+            del records
+        ids.flush()
+        coords.flush()
+        del ids, coords
+
+        for tmp in [self.path + ".tmp", self.path + ".tmp2"]:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+class NodeLocations(object):
+    """Memory-mapped node location store"""
+
+    def __init__(self, path):
+        self.ids = np.load(path + ".ids.npy", mmap_mode="r")
+        self.coords = np.load(path + ".coords.npy", mmap_mode="r")
+
+    @classmethod
+    def build(cls, osm_file, path, chunk_size=NodeLocationWriter.CHUNK_SIZE, reader=None):
+        """Fill the store from the nodes of osm_file (first pass), pipeline.py
+        fills it with the other stages instead (LocationStage)"""
+        reader = OSMReader() if reader is None else reader
+        with NodeLocationWriter(path, chunk_size) as writer:
+            for element in reader.elements(osm_file, tags=["node"]):
+                writer.add(element.attrib)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def locate(self, ids):
+        """Return the (lat, lon) of each node id, NaN for unknown ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        coords = np.full((len(ids), 2), np.nan)
+        if len(self.ids) and len(ids):
+            positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            found = self.ids[positions] == ids
+            coords[found] = self.coords[positions[found]]
+        return coords
+
+    def ways(self, osm_file, batch_size=10000, reader=None):
+        """Yield the id and the coordinates of the nodes of each way of osm_file
+        (second pass), the node ids of batch_size ways are located at once"""
+        reader = OSMReader() if reader is None else reader
+        batch = []
+        for element in reader.elements(osm_file, tags=["way"]):
+            batch.append((element.attrib["id"], element.refs))
+            if len(batch) >= batch_size:
+                for way in self.locate_ways(batch):
+                    yield way
+                batch = []
+        for way in self.locate_ways(batch):
+            yield way
+
+    def locate_ways(self, ways):
+        if not ways:
+            return []
+        refs = [ref for _, way_refs in ways for ref in way_refs]
+        coords = self.locate(refs)
+        offsets = np.cumsum([0] + [len(way_refs) for _, way_refs in ways])
+        return [(way_id, coords[start:end]) for (way_id, _), start, end in zip(ways, offsets[:-1], offsets[1:])]
+
+def length(coords):
+    """Length (meters) of the line through coords, unknown locations skipped"""
+    coords = coords[~np.isnan(coords).any(axis=1)]
+    if len(coords) < 2:
+        return 0.0
+    return float(distance(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]).sum())
+
+def centroid(coords):
+    """Mean position of the nodes (the last node of a closed way counted once),
+    None when no node is located"""
+    if len(coords) > 1 and (coords[0] == coords[-1]).all():
+        coords = coords[:-1]
+    coords = coords[~np.isnan(coords).any(axis=1)]
+    if len(coords) == 0:
+        return None
+    return coords.mean(axis=0)
+
+def write_ways(locations, osm_file, reader=None):
+    """Write id, number of nodes, located nodes, length (meters) and centroid
+    of each way in <osm_file>.ways.csv, return the number of ways and of ways
+    having unknown nodes"""
+    counters = { "ways": 0, "unresolved": 0 }
+    with io.open("{0}.ways.csv".format(osm_file), "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "nodes", "located", "length", "lat", "lon"])
+        for way_id, coords in locations.ways(osm_file, reader=reader):
+            located = int((~np.isnan(coords).any(axis=1)).sum())
+            center = centroid(coords)
+            writer.writerow([way_id, len(coords), located, "%.1f" % length(coords)] +
+                            (["", ""] if center is None else ["%.7f" % center[0], "%.7f" % center[1]]))
+            counters["ways"] += 1
+            counters["unresolved"] += located < len(coords)
+    return counters
+
+def usage():
+    print('locations.py -o <OSM FILE> -s <STORE>')
+
+def main(argv):
+    osm_file = None
+    store = None
+
+    try:
+        opts, args = getopt.getopt(argv,"ho:s:",["osm=", "store="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-o", "--osm"):
+             osm_file = arg
+        elif opt in ("-s", "--store"):
+             store = arg
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if osm_file is None:
+        print("You need to supply -o")
+        sys.exit(2)
+
+    locations = NodeLocations.build(osm_file, osm_file if store is None else store)
+    counters = write_ways(locations, osm_file)
+    counters["nodes"] = len(locations)
+    pprint.pprint(counters)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
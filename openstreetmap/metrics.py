@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run metrics of the command line tools (--profile, --metrics-out)
+
+'stages', wall time (seconds) of each stage of a run, 'parse' being the
+time spent reading elements,
+'elements', number of elements by type, elements per second while they
+were read and processed, number of tags by key,
+'first_element', seconds from the start of the run to the first element,
+'timers', cumulative time and number of calls of the timed functions
+(audit validators by tag key),
+'caches', hits, misses and hit rate of the caches,
+'peak_rss_kb', peak resident set size of the process (and of its
+children, pool workers).
+
+Nothing is measured unless a Metrics object is given: the hooks are one
+timer per stage, per element and per timed call.
+
+With a pool of workers (audit.py -j), each worker measures its elements,
+validators and caches and sends its counters with the results of each
+byte range, they are merged in the metrics of the parent process: the
+stages of the workers ('parse') add up the time of all workers, elements
+per second are counted over the wall time of the pool.
+"""
+
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+import io
+import json
+import resource
+import sys
+import timeit
+
+class Metrics(object):
+
+    def __init__(self):
+        self.started = timeit.default_timer()
+        self.stages = OrderedDict()
+        self.counts = defaultdict(int)
+        self.keys = defaultdict(int)
+        self.timers = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.caches = OrderedDict()
+        self.merged_caches = OrderedDict()
+        self.sent_caches = {}
+        self.iterating = 0.0
+        self.first_element = None
+
+    def add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage name"""
+        start = timeit.default_timer()
+        try:
+            yield self
+        finally:
+            self.add_time(name, timeit.default_timer() - start)
+
+    def timed(self, name, function):
+        """Return function, its calls timed under name"""
+        timers, calls, timer = self.timers, self.calls, timeit.default_timer
+        def timed_function(*args):
+            start = timer()
+            try:
+                return function(*args)
+            finally:
+                timers[name] += timer() - start
+                calls[name] += 1
+        return timed_function
+
+    def elements(self, elements):
+        """Yield elements, counting them by type and their tags by key, the
+        time spent waiting for the next element being the 'parse' stage"""
+        counts, keys, timer = self.counts, self.keys, timeit.default_timer
+        parse = 0.0
+        first = timer()
+        try:
+            iterator = iter(elements)
+            while True:
+                start = timer()
+                try:
+                    elem = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    parse += timer() - start
+                if self.first_element is None:
+                    self.first_element = timer() - self.started
+                counts[elem.tag] += 1
+                for key, _ in elem.tags:
+                    keys[key] += 1
+                yield elem
+        finally:
+            self.add_time("parse", parse)
+            self.iterating += timer() - first
+
+    def watch(self, name, cache):
+        """Report the hits and misses of cache (any object counting them)"""
+        self.caches[name] = cache
+
+    @contextmanager
+    def workers(self):
+        """Time the enclosed block, where pool workers read the elements whose
+        counters are merged, as the time spent iterating over elements"""
+        start = timeit.default_timer()
+        try:
+            yield self
+        finally:
+            self.iterating += timeit.default_timer() - start
+
+    def counters(self):
+        """Return the counters measured since the previous call and reset them,
+        sent by a pool worker with its results to be merged by the parent"""
+        caches = {}
+        for name, cache in self.caches.items():
+            hits, misses = self.sent_caches.get(name, (0, 0))
+            caches[name] = (cache.hits - hits, cache.misses - misses)
+            self.sent_caches[name] = (cache.hits, cache.misses)
+        counters = {
+            "stages": dict(self.stages),
+            "counts": dict(self.counts),
+            "keys": dict(self.keys),
+            "timers": dict(self.timers),
+            "calls": dict(self.calls),
+            "caches": caches,
+            # timeit.default_timer is the wall clock, shared by the processes
+            "first_element": None if self.first_element is None else self.started + self.first_element
+        }
+        for counts in [self.stages, self.counts, self.keys, self.timers, self.calls]:
+            counts.clear()
+        return counters
+
+    def merge(self, counters):
+        """Add the counters of a pool worker (see counters)"""
+        for name, seconds in counters["stages"].items():
+            self.add_time(name, seconds)
+        for counts, other in [(self.counts, counters["counts"]), (self.keys, counters["keys"]),
+                              (self.timers, counters["timers"]), (self.calls, counters["calls"])]:
+            for name, count in other.items():
+                counts[name] += count
+        for name, (hits, misses) in counters["caches"].items():
+            merged_hits, merged_misses = self.merged_caches.get(name, (0, 0))
+            self.merged_caches[name] = (merged_hits + hits, merged_misses + misses)
+        if counters["first_element"] is not None:
+            first_element = counters["first_element"] - self.started
+            if self.first_element is None or first_element < self.first_element:
+                self.first_element = first_element
+
+    def cache_report(self):
+        report = OrderedDict()
+        names = list(self.caches) + [name for name in self.merged_caches if name not in self.caches]
+        for name in names:
+            cache = self.caches.get(name)
+            hits, misses = self.merged_caches.get(name, (0, 0))
+            if cache is not None:
+                hits, misses = hits + cache.hits, misses + cache.misses
+            lookups = hits + misses
+            report[name] = { "hits": hits, "misses": misses,
+                             "hit_rate": float(hits) / lookups if lookups else None }
+        return report
+
+    def report(self):
+        elements = sum(self.counts.values())
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "wall_time": timeit.default_timer() - self.started,
+            "stages": self.stages,
+            "first_element": self.first_element,
+            "elements": {
+                "total": elements,
+                "by_type": dict(self.counts),
+                "per_second": elements / self.iterating if self.iterating else None,
+                "tags_by_key": dict(self.keys)
+            },
+            "timers": dict((name, { "seconds": self.timers[name], "calls": self.calls[name] })
+                           for name in sorted(self.timers)),
+            "caches": self.cache_report(),
+            "peak_rss_kb": usage.ru_maxrss,
+            "peak_rss_children_kb": children.ru_maxrss
+        }
+
+    def dumps(self):
+        return json.dumps(self.report(), indent=2, ensure_ascii=False, encoding='utf8')
+
+    def write(self, metrics_file=None):
+        """Write the report as JSON to metrics_file, to stderr when None"""
+        data = self.dumps()
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        if metrics_file is None:
+            sys.stderr.write(data + b"\n")
+        else:
+            with io.open(metrics_file, "wb") as f:
+                f.write(data + b"\n")
+
+@contextmanager
+def stage(metrics, name):
+    """metrics.stage(name), nothing is measured when metrics is None"""
+    if metrics is None:
+        yield None
+    else:
+        with metrics.stage(name):
+            yield metrics
+
+@contextmanager
+def workers(metrics):
+    """metrics.workers(), nothing is measured when metrics is None"""
+    if metrics is None:
+        yield None
+    else:
+        with metrics.workers():
+            yield metrics
+
+class MeteredReader(object):
+    """OSMReader whose elements are counted and timed by metrics"""
+
+    def __init__(self, reader, metrics):
+        self.reader = reader
+        self.metrics = metrics
+
+    def elements(self, osm_file, tags=None, keys=None):
+        return self.metrics.elements(self.reader.elements(osm_file, tags, keys))
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
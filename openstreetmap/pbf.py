@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reader of OpenStreetMap PBF files (.osm.pbf) handing out the same elements
+as OSMReader.elements: reader.Element node, way and relation records with
+their attributes, tags, node refs and members as written in an OSM file
+
+The file is a sequence of blobs, each one a zlib compressed block of
+elements. Protocol buffers messages are decoded by the package: fields one
+by one, packed arrays (dense nodes, way refs, tag keys and values) at once
+with NumPy.
+
+PBFWriter writes Element records back as a PBF file (dense nodes, zlib
+blobs), synthetic.py uses it to generate PBF files of the same elements as
+its OSM files.
+
+Reference: http://wiki.openstreetmap.org/wiki/PBF_Format
+"""
+
+import numpy as np
+import calendar
+import io
+import multiprocessing
+import pprint
+import struct
+import time
+import zlib
+import sys, getopt
+
+from reader import prefetch, Element
+
+"""Protocol buffers wire types"""
+VARINT, FIXED64, LENGTH, FIXED32 = 0, 1, 2, 5
+
+"""Size (bytes) from which packed varints are decoded with NumPy"""
+PACKED_NUMPY = 256
+
+def varint(data, pos):
+    """Return the varint at pos of data (a bytearray) and the position
+    following it"""
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def int64(n):
+    """Two's complement of a varint (int32 and int64 fields)"""
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+def zigzag(n):
+    """Zigzag decoding of a varint (sint32 and sint64 fields)"""
+    return (n >> 1) ^ -(n & 1)
+
+def fields(data):
+    """Yield (field number, value) of a message, value being an integer for
+    varint fields and bytes otherwise (one byte varints are read inline)"""
+    buf = bytearray(data)
+    pos, end = 0, len(buf)
+    while pos < end:
+        key = buf[pos]
+        pos += 1
+        if key & 0x80:
+            key, pos = varint(buf, pos - 1)
+        wire = key & 7
+        if wire == VARINT:
+            value = buf[pos]
+            pos += 1
+            if value & 0x80:
+                value, pos = varint(buf, pos - 1)
+        elif wire == LENGTH:
+            length = buf[pos]
+            pos += 1
+            if length & 0x80:
+                length, pos = varint(buf, pos - 1)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire == FIXED64:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire == FIXED32:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("unsupported protocol buffers wire type %d" % wire)
+        yield key >> 3, value
+
+def message(data, repeated=()):
+    """Return the fields of a message by number: last value of a field, list
+    of values of a repeated field"""
+    msg = dict((number, []) for number in repeated)
+    for number, value in fields(data):
+        if number in repeated:
+            msg[number].append(value)
+        else:
+            msg[number] = value
+    return msg
+
+def packed(values):
+    """Decode the values of a repeated varint field (packed bytes or
+    integers) as uint64"""
+    arrays = []
+    for value in values:
+        if not isinstance(value, bytes):
+            arrays.append(np.array([value], dtype=np.uint64))
+            continue
+        b = np.frombuffer(value, dtype=np.uint8)
+        if not len(b):
+            continue
+        if b[-1] & 0x80:
+            raise ValueError("truncated packed varints")
+        ends = np.flatnonzero(b < 0x80)
+        starts = np.zeros(len(ends), dtype=np.int64)
+        starts[1:] = ends[:-1] + 1
+        shifts = (np.arange(len(b)) - np.repeat(starts, ends - starts + 1)) * 7
+        arrays.append(np.add.reduceat((b & 0x7f).astype(np.uint64) << shifts.astype(np.uint64), starts))
+    if not arrays:
+        return np.zeros(0, dtype=np.uint64)
+    return np.concatenate(arrays)
+
+def varints(values):
+    """Decode the values of a repeated varint field as a list, short packed
+    values one by one (NumPy calls would cost more)"""
+    if sum(len(value) for value in values if isinstance(value, bytes)) > PACKED_NUMPY:
+        return packed(values).tolist()
+    result = []
+    for value in values:
+        if not isinstance(value, bytes):
+            result.append(value)
+            continue
+        data = bytearray(value)
+        pos, end = 0, len(data)
+        while pos < end:
+            b = data[pos]
+            pos += 1
+            n, shift = b & 0x7f, 7
+            while b & 0x80:
+                b = data[pos]
+                pos += 1
+                n |= (b & 0x7f) << shift
+                shift += 7
+            result.append(n)
+    return result
+
+def deltas(values):
+    """Zigzag and delta decoding of a repeated sint64 field as a list"""
+    total = 0
+    result = []
+    for n in varints(values):
+        total += (n >> 1) ^ -(n & 1)
+        result.append(total)
+    return result
+
+def signed(values):
+    """Zigzag decoding of packed values (sint32 and sint64 fields)"""
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+def delta(values):
+    """Zigzag and delta decoding of packed values"""
+    return np.cumsum(signed(values))
+
+def text(s):
+    """UTF-8 string: str when ascii, unicode otherwise"""
+    try:
+        s.decode('ascii')
+        return s
+    except UnicodeDecodeError:
+        return s.decode('utf-8')
+
+def inflate(blob):
+    """Return the data of a Blob message"""
+    msg = message(blob)
+    if 1 in msg:
+        return msg[1]
+    if 3 in msg:
+        return zlib.decompress(msg[3])
+    raise ValueError("unsupported PBF blob compression (zlib only)")
+
+def inflate_block(args):
+    kind, blob = args
+    return kind, inflate(blob)
+
+class PBFReader(object):
+    FEATURES = ["OsmSchema-V0.6", "DenseNodes", "HistoricalInformation"]
+    MEMBER_TYPES = ["node", "way", "relation"]
+    """Element type of each field of a PrimitiveGroup (nodes, dense nodes,
+    ways and relations)"""
+    GROUPS = { 1: "node", 2: "node", 3: "way", 4: "relation" }
+    TOP_LEVEL = ["node", "way", "relation"]
+    PREFETCH_DEPTH = 8
+
+    def __init__(self, decompress=None):
+        self.decompress = decompress
+
+    def blobs(self, pbf_file):
+        """Yield (type, blob) of each blob of pbf_file"""
+        with io.open(pbf_file, "rb") as f:
+            while True:
+                size = f.read(4)
+                if not size:
+                    return
+                if len(size) < 4:
+                    raise ValueError("truncated PBF file %s" % pbf_file)
+                header = message(f.read(struct.unpack(">I", size)[0]))
+                blob = f.read(header[3])
+                if len(blob) < header[3]:
+                    raise ValueError("truncated PBF file %s" % pbf_file)
+                yield header[1], blob
+
+    def blocks(self, pbf_file):
+        """Yield (type, data) of each blob of pbf_file, inflated ahead in a
+        background thread ('thread') or in a pool of processes ('process')"""
+        if self.decompress == "process":
+            pool = multiprocessing.Pool()
+            try:
+                for block in pool.imap(inflate_block, self.blobs(pbf_file), 4):
+                    yield block
+            finally:
+                pool.terminate()
+                pool.join()
+            return
+
+        blocks = ((kind, inflate(blob)) for kind, blob in self.blobs(pbf_file))
+        if self.decompress == "thread":
+            blocks = prefetch(blocks, self.PREFETCH_DEPTH)
+        for block in blocks:
+            yield block
+
+    def elements(self, pbf_file, tags=None, keys=None):
+        """Yield each top level element of pbf_file whose tag is in tags, with
+        keys only the elements having tags of these keys (and only these tags)"""
+        tags = self.TOP_LEVEL if tags is None else tags
+        keys = None if keys is None else frozenset(keys)
+        for kind, data in self.blocks(pbf_file):
+            if kind == "OSMHeader":
+                self.check_header(data)
+            elif kind == "OSMData":
+                for elem in self.primitive_block(data, tags):
+                    if keys is not None:
+                        elem.tags = [tag for tag in elem.tags if tag[0] in keys]
+                        if not elem.tags:
+                            continue
+                    yield elem
+
+    def check_header(self, data):
+        header = message(data, repeated=(4,))
+        unsupported = [f for f in header[4] if f not in self.FEATURES]
+        if unsupported:
+            raise ValueError("unsupported PBF features %s" % ", ".join(unsupported))
+
+    def primitive_block(self, data, tags):
+        block = message(data, repeated=(2,))
+        strings = [text(s) for _, s in fields(block.get(1, b""))]
+        self.granularity = block.get(17, 100)
+        self.date_granularity = block.get(18, 1000)
+        self.lat_offset = int64(block.get(19, 0))
+        self.lon_offset = int64(block.get(20, 0))
+
+        for group in block[2]:
+            for number, value in fields(group):
+                if self.GROUPS.get(number) not in tags:
+                    continue
+                if number == 2:
+                    for elem in self.dense_nodes(value, strings):
+                        yield elem
+                elif number == 1:
+                    yield self.node(value, strings)
+                elif number == 3:
+                    yield self.way(value, strings)
+                else:
+                    yield self.relation(value, strings)
+
+    def timestamp(self, timestamp):
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp * self.date_granularity // 1000))
+
+    def coordinate(self, value, offset):
+        return "%.7f" % ((offset + self.granularity * value) * 1e-9)
+
+    def info(self, attrib, data, strings):
+        """Fill the metadata attributes from an Info message"""
+        info = message(data)
+        if 1 in info:
+            attrib["version"] = str(int64(info[1]))
+        if 2 in info:
+            attrib["timestamp"] = self.timestamp(int64(info[2]))
+        if 3 in info:
+            attrib["changeset"] = str(int64(info[3]))
+        if 4 in info:
+            attrib["uid"] = str(int64(info[4]))
+        if 5 in info:
+            attrib["user"] = strings[info[5]]
+        if 6 in info: # history files only
+            attrib["visible"] = "true" if info[6] else "false"
+        return attrib
+
+    def tags(self, keys, values, strings):
+        """Return the (k, v) tags of an element"""
+        return [(strings[key], strings[value]) for key, value in zip(varints(keys), varints(values))]
+
+    def node(self, data, strings):
+        msg = message(data, repeated=(2, 3))
+        attrib = { "id": str(zigzag(msg[1])),
+                   "lat": self.coordinate(zigzag(msg[8]), self.lat_offset),
+                   "lon": self.coordinate(zigzag(msg[9]), self.lon_offset) }
+        if 4 in msg:
+            self.info(attrib, msg[4], strings)
+        return Element("node", attrib, self.tags(msg[2], msg[3], strings))
+
+    def dense_nodes(self, data, strings):
+        dense = message(data, repeated=(1, 8, 9, 10))
+        ids = delta(packed(dense[1])).tolist()
+        lats = ((self.lat_offset + self.granularity * delta(packed(dense[8]))) * 1e-9).tolist()
+        lons = ((self.lon_offset + self.granularity * delta(packed(dense[9]))) * 1e-9).tolist()
+        keys_vals = packed(dense[10]).tolist()
+
+        metadata = None
+        if 5 in dense:
+            info = message(dense[5], repeated=(1, 2, 3, 4, 5, 6))
+            metadata = [
+                ("version", [str(v) for v in packed(info[1]).view(np.int64).tolist()]),
+                ("timestamp", [self.timestamp(t) for t in delta(packed(info[2])).tolist()]),
+                ("changeset", [str(c) for c in delta(packed(info[3])).tolist()]),
+                ("uid", [str(u) for u in delta(packed(info[4])).tolist()]),
+                ("user", [strings[s] for s in delta(packed(info[5])).tolist()]),
+                ("visible", ["true" if v else "false" for v in packed(info[6]).tolist()])
+            ]
+            metadata = [(name, values) for name, values in metadata if len(values) == len(ids)]
+
+        i = 0
+        for n in range(len(ids)):
+            attrib = { "id": str(ids[n]), "lat": "%.7f" % lats[n], "lon": "%.7f" % lons[n] }
+            if metadata:
+                for name, values in metadata:
+                    attrib[name] = values[n]
+            elem = Element("node", attrib)
+            if keys_vals:
+                while keys_vals[i]:
+                    elem.tags.append((strings[keys_vals[i]], strings[keys_vals[i + 1]]))
+                    i += 2
+                i += 1
+            yield elem
+
+    def way(self, data, strings):
+        msg = message(data, repeated=(2, 3, 8))
+        attrib = { "id": str(int64(msg[1])) }
+        if 4 in msg:
+            self.info(attrib, msg[4], strings)
+        return Element("way", attrib, self.tags(msg[2], msg[3], strings), [str(ref) for ref in deltas(msg[8])])
+
+    def relation(self, data, strings):
+        msg = message(data, repeated=(2, 3, 8, 9, 10))
+        attrib = { "id": str(int64(msg[1])) }
+        if 4 in msg:
+            self.info(attrib, msg[4], strings)
+        roles = varints(msg[8])
+        refs = deltas(msg[9])
+        types = varints(msg[10])
+        members = [(self.MEMBER_TYPES[member_type], str(ref), strings[role])
+                   for member_type, ref, role in zip(types, refs, roles)]
+        return Element("relation", attrib, self.tags(msg[2], msg[3], strings), members=members)
+
+def encode_varint(n):
+    """Varint bytes of n, negative int64 values as their two's complement"""
+    if n < 0:
+        n += 1 << 64
+    data = bytearray()
+    while n >= 0x80:
+        data.append((n & 0x7f) | 0x80)
+        n >>= 7
+    data.append(n)
+    return bytes(data)
+
+def encode_zigzag(n):
+    """Zigzag encoding of a sint64 value"""
+    return (n << 1) ^ (n >> 63)
+
+def encode_field(number, value):
+    """Bytes of a field, value being an integer (varint) or bytes"""
+    if isinstance(value, bytes):
+        return encode_varint(number << 3 | LENGTH) + encode_varint(len(value)) + value
+    return encode_varint(number << 3 | VARINT) + encode_varint(value)
+
+def encode_packed(number, values):
+    """Bytes of a packed repeated varint field, nothing when empty"""
+    if not len(values):
+        return b""
+    return encode_field(number, b"".join(encode_varint(v) for v in values))
+
+def encode_deltas(number, values):
+    """Bytes of a packed sint64 field, delta coded"""
+    previous = 0
+    coded = []
+    for v in values:
+        coded.append(encode_zigzag(v - previous))
+        previous = v
+    return encode_packed(number, coded)
+
+class PBFWriter(object):
+    """Write Element records (as handed out by PBFReader.elements) into a
+    PBF file, nodes as dense nodes, by blocks of BLOCK_SIZE elements of the
+    same type; attributes other than the ones of PBFReader are not kept"""
+    BLOCK_SIZE = 8000
+    GRANULARITY = 100
+    MEMBER_TYPES = dict((name, i) for i, name in enumerate(PBFReader.MEMBER_TYPES))
+
+    def __init__(self, pbf_file):
+        self.pbf_file = pbf_file
+        self.pending = []
+
+    def __enter__(self):
+        self.f = io.open(self.pbf_file, "wb")
+        header = b"".join(encode_field(4, feature) for feature in PBFReader.FEATURES)
+        self.write_blob("OSMHeader", header + encode_field(16, b"synthetic.py"))
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.flush()
+        finally:
+            self.f.close()
+
+    def write(self, element):
+        if self.pending and (self.pending[0].tag != element.tag or len(self.pending) >= self.BLOCK_SIZE):
+            self.flush()
+        self.pending.append(element)
+
+    def write_blob(self, kind, data):
+        blob = encode_field(2, len(data)) + encode_field(3, zlib.compress(data))
+        header = encode_field(1, kind) + encode_field(3, len(blob))
+        self.f.write(struct.pack(">I", len(header)) + header + blob)
+
+    def string(self, s):
+        """Index of s in the string table of the current block"""
+        s = s.encode("utf-8") if isinstance(s, unicode) else s
+        if s not in self.strings:
+            self.strings[s] = len(self.table)
+            self.table.append(s)
+        return self.strings[s]
+
+    def coordinate(self, value):
+        return int(round(float(value) * 1e9 / self.GRANULARITY))
+
+    def timestamp(self, value):
+        return calendar.timegm(time.strptime(value, "%Y-%m-%dT%H:%M:%SZ"))
+
+    def info(self, attrib):
+        info = b""
+        if "version" in attrib:
+            info += encode_field(1, int(attrib["version"]))
+        if "timestamp" in attrib:
+            info += encode_field(2, self.timestamp(attrib["timestamp"]))
+        if "changeset" in attrib:
+            info += encode_field(3, int(attrib["changeset"]))
+        if "uid" in attrib:
+            info += encode_field(4, int(attrib["uid"]))
+        if "user" in attrib:
+            info += encode_field(5, self.string(attrib["user"]))
+        if "visible" in attrib:
+            info += encode_field(6, int(attrib["visible"] == "true"))
+        return encode_field(4, info) if info else b""
+
+    def tags(self, element):
+        return (encode_packed(2, [self.string(k) for k, _ in element.tags]) +
+                encode_packed(3, [self.string(v) for _, v in element.tags]))
+
+    def dense_nodes(self, nodes):
+        dense = encode_deltas(1, [int(node.attrib["id"]) for node in nodes])
+        info = b""
+        for number, name, value in [(2, "timestamp", self.timestamp), (3, "changeset", int),
+                                    (4, "uid", int), (5, "user", self.string)]:
+            if all(name in node.attrib for node in nodes):
+                info += encode_deltas(number, [value(node.attrib[name]) for node in nodes])
+        if all("version" in node.attrib for node in nodes):
+            info = encode_packed(1, [int(node.attrib["version"]) for node in nodes]) + info
+        if all("visible" in node.attrib for node in nodes):
+            info += encode_packed(6, [int(node.attrib["visible"] == "true") for node in nodes])
+        if info:
+            dense += encode_field(5, info)
+        dense += encode_deltas(8, [self.coordinate(node.attrib["lat"]) for node in nodes])
+        dense += encode_deltas(9, [self.coordinate(node.attrib["lon"]) for node in nodes])
+        keys_vals = []
+        for node in nodes:
+            for k, v in node.tags:
+                keys_vals.extend((self.string(k), self.string(v)))
+            keys_vals.append(0)
+        if any(node.tags for node in nodes):
+            dense += encode_packed(10, keys_vals)
+        return encode_field(2, dense)
+
+    def way(self, way):
+        data = encode_field(1, int(way.attrib["id"])) + self.tags(way) + self.info(way.attrib)
+        return encode_field(3, data + encode_deltas(8, [int(ref) for ref in way.refs]))
+
+    def relation(self, relation):
+        data = encode_field(1, int(relation.attrib["id"])) + self.tags(relation) + self.info(relation.attrib)
+        data += encode_packed(8, [self.string(role) for _, _, role in relation.members])
+        data += encode_deltas(9, [int(ref) for _, ref, _ in relation.members])
+        data += encode_packed(10, [self.MEMBER_TYPES[member_type] for member_type, _, _ in relation.members])
+        return encode_field(4, data)
+
+    def flush(self):
+        """Write the pending elements as one block"""
+        if not self.pending:
+            return
+        self.strings, self.table = { b"": 0 }, [b""]
+        kind = self.pending[0].tag
+        if kind == "node":
+            group = self.dense_nodes(self.pending)
+        else:
+            group = b"".join(self.way(e) if kind == "way" else self.relation(e) for e in self.pending)
+        table = b"".join(encode_field(1, s) for s in self.table)
+        self.write_blob("OSMData", encode_field(1, table) + encode_field(2, group) + encode_field(17, self.GRANULARITY))
+        self.pending = []
+
+def usage():
+    print('pbf.py -o <PBF FILE> [-z <thread|process>]')
+
+def main(argv):
+    pbf_file = None
+    decompress = None
+
+    try:
+        opts, args = getopt.getopt(argv,"ho:z:",["osm=", "decompress="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-o", "--osm"):
+             pbf_file = arg
+        elif opt in ("-z", "--decompress"):
+             decompress = arg
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if pbf_file is None:
+        print("You need to supply -o")
+        sys.exit(2)
+
+    """Number of elements and tags by type"""
+    counters = {}
+    for elem in PBFReader(decompress).elements(pbf_file):
+        counters.setdefault(elem.tag, { "elements": 0, "tags": 0 })
+        counters[elem.tag]["elements"] += 1
+        counters[elem.tag]["tags"] += len(elem.tags)
+    pprint.pprint(counters)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
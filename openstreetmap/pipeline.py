@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Single pass processing of an OpenStreetMap OSM file
+
+The OSM file is parsed once and every top level element is sent to a list of
+pluggable stages (tag keys classification, audit, shaping/export) before
+being released, so that memory stays flat on a whole department or region.
+
+Tested with Map Area: Saint-Joseph - Île de La Réunion
+http://www.openstreetmap.org/relation/1282272#map=12/-21.2918/55.6440
+"""
+
+import pprint
+import sys, getopt
+
+from reader import OSMReader
+from tags import TagChecker
+from audit import Audit
+from shape import Shape, JSONWriter
+from reference import ReferenceBundle, Background, Pending
+from metrics import Metrics, MeteredReader, stage as metered
+
+
+class Stage(object):
+    """Base class of a pipeline stage
+
+    'name', key of the stage result in the pipeline report,
+    'start', called once before the first element,
+    'process', called for each top level element (node, way or relation),
+    'result', called once after the last element.
+    """
+    name = None
+
+    def start(self):
+        pass
+
+    def process(self, element):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class TagStage(Stage):
+    """Same result as TagChecker.summary"""
+    name = "tags"
+
+    def __init__(self, checker=None):
+        self.checker = TagChecker() if checker is None else checker
+
+    def start(self):
+        self.keys = self.checker.init_summary()
+
+    def process(self, element):
+        self.keys = self.checker.list_element(element, self.keys)
+
+    def result(self):
+        return self.keys
+
+
+class AuditStage(Stage):
+    """Same result as Audit.audit, values to be fixed per category"""
+    name = "audit"
+
+    def __init__(self, references, auditor=None, update_folder="data", verbose=False, init_mapping=False, suggesters=None):
+        self.auditor = Audit() if auditor is None else auditor
+        self.references = references
+        self.update_folder = update_folder
+        self.verbose = verbose
+        self.init_mapping = init_mapping
+        self.suggesters = suggesters
+
+    def start(self):
+        self.results = self.auditor.init_results()
+
+    def process(self, element):
+        self.auditor.audit_element(element, self.results, self.references)
+
+    def result(self):
+        return self.auditor.summary(self.results,
+                                    update_folder=self.update_folder,
+                                    verbose=self.verbose,
+                                    init_mapping=self.init_mapping,
+                                    suggesters=self.suggesters)
+
+
+class ShapeStage(Stage):
+    """Same output file as Shape.shape, the result is the number of documents"""
+    name = "shape"
+
+    def __init__(self, file_out, mappings, shaper=None, pretty=False, serializer="json"):
+        self.shaper = Shape() if shaper is None else shaper
+        self.file_out = file_out
+        self.mappings = mappings
+        self.pretty = pretty
+        self.serializer = serializer
+
+    def start(self):
+        self.documents = 0
+        self.writer = JSONWriter(self.file_out, pretty=self.pretty, serializer=self.serializer)
+
+    def process(self, element):
+        el = self.shaper.shape_element(element, self.mappings)
+        if el:
+            self.documents += 1
+            self.writer.write(el)
+
+    def result(self):
+        self.writer.close()
+        return { "documents": self.documents, "file": self.file_out }
+
+
+class LocationStage(Stage):
+    """Node locations stored (locations.py) while the other stages run, the
+    ways of osm_file are then resolved in a second pass (ways only) into
+    <osm_file>.ways.csv, the result is the number of nodes and ways"""
+    name = "locations"
+
+    def __init__(self, path, osm_file, reader=None, chunk_size=None):
+        self.path = path
+        self.osm_file = osm_file
+        self.reader = reader
+        self.chunk_size = chunk_size
+
+    def start(self):
+        from locations import NodeLocationWriter
+        self.writer = NodeLocationWriter(self.path, self.chunk_size or NodeLocationWriter.CHUNK_SIZE)
+
+    def process(self, element):
+        if element.tag == "node":
+            self.writer.add(element.attrib)
+
+    def result(self):
+        from locations import NodeLocations, write_ways
+        self.writer.close()
+        locations = NodeLocations(self.path)
+        counters = write_ways(locations, self.osm_file, self.reader)
+        counters.update({ "nodes": len(locations), "file": "{0}.ways.csv".format(self.osm_file) })
+        return counters
+
+
+class Pipeline(object):
+
+    def __init__(self, stages, reader=None, metrics=None):
+        self.stages = stages
+        self.reader = OSMReader() if reader is None else reader
+        self.metrics = metrics
+
+    def run(self, osm_file):
+        """Parse osm_file once and return the result of each stage by stage name,
+        with metrics the processing time of each stage is recorded"""
+        for stage in self.stages:
+            stage.start()
+
+        processes = [stage.process if self.metrics is None else self.metrics.timed("process:%s" % stage.name, stage.process)
+                     for stage in self.stages]
+        with metered(self.metrics, "run"):
+            for element in self.reader.elements(osm_file):
+                for process in processes:
+                    process(element)
+
+        results = {}
+        for stage in self.stages:
+            with metered(self.metrics, "result:%s" % stage.name):
+                results[stage.name] = stage.result()
+        return results
+
+def usage():
+    print('pipeline.py -i -v -p -o <OSM FILE> [-f <FANTOIR FILE> -a <AREA> -u <AUDIT FOLDER>] [-m <UPDATE MAPPING FOLDER>] [-z <thread|process>]')
+    print('            [-l <NODE LOCATION STORE>] [--profile] [--metrics-out <METRICS FILE>]')
+
+def main(argv):
+    verbose = False
+    init_mapping = False
+    pretty = False
+    osm_file = None
+    fantoir_file = None
+    area_code = None
+    update_folder = None
+    mapping_folder = None
+    decompress = None
+    profile = False
+    metrics_file = None
+    store = None
+
+    try:
+        opts, args = getopt.getopt(argv,"hivpo:f:a:u:m:z:l:",["init", "verbose", "pretty",
+                                                             "osm=", "fantoir=",
+                                                             "area=", "ufolder=", "mfolder=",
+                                                             "decompress=", "locations=", "profile", "metrics-out="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-i", "--init"):
+            init_mapping = True
+        elif opt in ("-v", "--verbose"):
+            verbose = True
+        elif opt in ("-p", "--pretty"):
+            pretty = True
+        elif opt in ("-o", "--osm"):
+             osm_file = arg
+        elif opt in ("-f", "--fantoir"):
+             fantoir_file = arg
+        elif opt in ("-a", "--area"):
+             area_code = arg
+        elif opt in ("-u", "--ufolder"):
+             update_folder = arg
+        elif opt in ("-m", "--mfolder"):
+             mapping_folder = arg
+        elif opt in ("-z", "--decompress"):
+             decompress = arg
+        elif opt in ("-l", "--locations"):
+             store = arg
+        elif opt == "--profile":
+             profile = True
+        elif opt == "--metrics-out":
+             metrics_file = arg
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    audit_options = [fantoir_file, area_code, update_folder]
+    if osm_file is None or (any(audit_options) and not all(audit_options)):
+        print("You need to supply -o, and -f, -a and -u together to audit")
+        sys.exit(2)
+
+    metrics = Metrics() if profile or metrics_file is not None else None
+    reader = OSMReader(decompress)
+    if metrics is not None:
+        reader = MeteredReader(reader, metrics)
+
+    if all(audit_options) or mapping_folder is not None:
+        # imported before the background loaders start: cPickle would find a
+        # partly imported numpy reading the bundle while pandas is imported
+        # for the mappings (or numpy for the node locations)
+        import pandas
+    if store is not None:
+        import locations
+
+    stages = [TagStage()]
+    if all(audit_options):
+        references = ReferenceBundle(fantoir_file, area_code)
+        if metrics is not None:
+            metrics.watch("bundle", references)
+        # the reference data are loaded while the OSM file starts being read
+        def load():
+            with metered(metrics, "bundle"):
+                return references.load()
+        bundle = Background(load)
+        auditor = Audit(Pending(lambda: bundle.result()["street_alternatives"]), metrics=metrics)
+        stages.append(AuditStage(auditor.references(bundle=bundle),
+                                 auditor=auditor,
+                                 update_folder=update_folder,
+                                 verbose=verbose,
+                                 init_mapping=init_mapping,
+                                 suggesters=Pending(lambda: auditor.suggesters(bundle)) if init_mapping else None))
+    if mapping_folder is not None:
+        shaper = Shape()
+        stages.append(ShapeStage("{0}.json".format(osm_file),
+                                 Pending(Background(shaper.load_mappings, mapping_folder).result),
+                                 shaper=shaper,
+                                 pretty=pretty))
+    if store is not None:
+        # the second pass (ways) is not part of the run metrics
+        stages.append(LocationStage(store, osm_file, OSMReader(decompress)))
+
+    pprint.pprint(Pipeline(stages, reader, metrics).run(osm_file))
+    if metrics is not None:
+        metrics.write(metrics_file)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
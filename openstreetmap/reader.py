@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Streaming access to the top level elements of an OpenStreetMap OSM file
+
+Elements are scanned with expat into compact Element records (attributes,
+(k, v) tags, node refs and members) without building an ElementTree: each
+record only lives as long as the consumer keeps it, so memory stays flat
+whatever the size of the extract. With keys, the tags of other keys are
+dropped while scanning and the elements left without tags are skipped.
+
+Compressed files (.osm.bz2, .osm.gz, concatenated streams included) are
+decompressed on the fly, inline, ahead in a background thread ('thread') or
+in an external bzip2/gzip process ('process'). PBF files (.osm.pbf) are read
+by pbf.PBFReader.
+
+Reference: http://wiki.openstreetmap.org/wiki/API_v0.6/DTD
+"""
+
+import xml.etree.cElementTree as ET
+import xml.parsers.expat as expat
+from distutils.spawn import find_executable
+import bz2
+import io
+import os
+import re
+import subprocess
+import sys
+import threading
+import zlib
+import Queue
+
+def prefetch(iterable, depth):
+    """Yield the items of iterable, computed ahead in a background thread
+    (at most depth items waiting), exceptions are raised to the consumer"""
+    queue = Queue.Queue(depth)
+    stopped = threading.Event()
+    end = object()
+
+    def run():
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                queue.put((item, None))
+            queue.put((end, None))
+        except Exception:
+            queue.put((end, sys.exc_info()))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if item is end:
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                return
+            yield item
+    finally:
+        stopped.set()
+        while thread.is_alive(): # unblock the producer
+            try:
+                queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+def decompressed_blocks(path, decompressor, block_size):
+    """Yield the decompressed blocks of a compressed file, a new decompressor
+    being started for each concatenated stream (pbzip2, multi-member gzip)"""
+    with io.open(path, "rb") as f:
+        d = decompressor()
+        for data in iter(lambda: f.read(block_size), b""):
+            while data:
+                try:
+                    block = d.decompress(data)
+                except EOFError: # bz2 stream ended on the previous block
+                    d = decompressor()
+                    continue
+                if block:
+                    yield block
+                data = d.unused_data
+                if data:
+                    d = decompressor()
+
+class Element(object):
+    """Top level element: tag ('node', 'way' or 'relation'), attrib (its
+    attributes), tags ((k, v) of its tag children), refs (ref of its nd
+    children) and members ((type, ref, role) of its member children)"""
+    __slots__ = ("tag", "attrib", "tags", "refs", "members")
+
+    def __init__(self, tag, attrib, tags=None, refs=None, members=None):
+        self.tag = tag
+        self.attrib = attrib
+        self.tags = [] if tags is None else tags
+        self.refs = [] if refs is None else refs
+        self.members = [] if members is None else members
+
+    def __repr__(self):
+        return "<Element %s %s>" % (self.tag, self.attrib.get("id"))
+
+def scan(source, tags, keys=None, actions=None, block_size=1 << 16):
+    """Yield the Element of each top level element of source (file name or
+    file object) whose tag is in tags, as soon as the block holding its end
+    is parsed
+
+    With keys, only the tags whose key is in keys are kept and the elements
+    left without tags are not yielded. With actions, (action, element) is
+    yielded, action being the last started element whose name is in actions
+    (osmChange).
+    """
+    # expat names are unicode, elements and actions are named by str constants
+    top_level = dict((name, name) for name in OSMReader.TOP_LEVEL)
+    tags = frozenset(tags)
+    keys = None if keys is None else frozenset(keys)
+    actions = dict((name, name) for name in actions or ())
+    pending, skipped = [], []
+    # current element, its tags, refs and members appenders, current action
+    current = [None, skipped.append, skipped.append, skipped.append, None]
+
+    def start(name, attrib):
+        if name == "tag":
+            key = attrib["k"]
+            if keys is None or key in keys:
+                current[1]((key, attrib["v"]))
+        elif name == "nd":
+            current[2](attrib["ref"])
+        elif name in top_level:
+            if name in tags:
+                elem = current[0] = Element(top_level[name], attrib, [], [], [])
+                current[1:4] = elem.tags.append, elem.refs.append, elem.members.append
+            else:
+                current[0] = None
+                current[1:4] = skipped.append, skipped.append, skipped.append
+        elif name == "member":
+            current[3]((attrib["type"], attrib["ref"], attrib.get("role", "")))
+        elif name in actions:
+            current[4] = actions[name]
+
+    def end(name):
+        if name in top_level:
+            elem = current[0]
+            if elem is not None and (keys is None or elem.tags):
+                pending.append((current[4], elem) if actions else elem)
+            current[0] = None
+            del skipped[:]
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    f = io.open(source, "rb") if isinstance(source, basestring) else source
+    try:
+        while True:
+            data = f.read(block_size)
+            parser.Parse(data, not data)
+            for item in pending:
+                yield item
+            del pending[:]
+            if not data:
+                return
+    finally:
+        if f is not source:
+            f.close()
+
+class BlockFile(object):
+    """Read only file object over an iterator of data blocks"""
+
+    def __init__(self, blocks, close=None):
+        self.blocks = blocks
+        self.block = b""
+        self.pos = 0
+        self.on_close = close
+
+    def read(self, size=-1):
+        if size < 0:
+            data = [self.block[self.pos:]] + list(self.blocks)
+            self.block, self.pos = b"", 0
+            return b"".join(data)
+        while self.pos >= len(self.block):
+            self.block, self.pos = next(self.blocks, None), 0
+            if self.block is None:
+                self.block = b""
+                return b""
+        data = self.block[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        if self.on_close is not None:
+            self.on_close()
+            self.on_close = None
+
+
+class RangeFile(object):
+    """Read only file object over the [start, end[ byte range of an OSM file
+    holding complete top level elements, wrapped into an <osm> root element
+    so that it can be parsed on its own"""
+    HEADER = b'<?xml version="1.0" encoding="UTF-8"?><osm>'
+    FOOTER = b'</osm>'
+
+    def __init__(self, osm_file, start, end):
+        self.f = io.open(osm_file, "rb")
+        self.f.seek(start)
+        self.remaining = end - start
+        self.pending = self.HEADER
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.pending) + self.remaining + len(self.FOOTER)
+        if not self.pending and self.remaining > 0:
+            self.pending = self.f.read(min(size, self.remaining))
+            self.remaining = self.remaining - len(self.pending) if self.pending else 0
+        if not self.pending and self.f is not None:
+            self.pending = self.FOOTER
+            self.close()
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class OSMReader(object):
+    """List of top level elements handed out to the consumers
+    """
+    TOP_LEVEL = ["node", "way", "relation"]
+    TOP_LEVEL_RE = re.compile(br"<(?:node|way|relation)[\s/>]")
+    ACTIONS = ["create", "modify", "delete"]
+    BLOCK_SIZE = 1 << 16
+    DECOMPRESS_BLOCK_SIZE = 1 << 20
+    PREFETCH_DEPTH = 16
+    DECOMPRESSORS = {
+        ".bz2": bz2.BZ2Decompressor,
+        ".gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    }
+    """External decompression commands, in order of preference"""
+    COMMANDS = {
+        ".bz2": [["pbzip2", "-dc"], ["lbzip2", "-dc"], ["bzip2", "-dc"]],
+        ".gz": [["pigz", "-dc"], ["gzip", "-dc"]]
+    }
+    MODES = [None, "thread", "process"]
+
+    def __init__(self, decompress=None):
+        if decompress not in self.MODES:
+            raise ValueError("unknown decompression mode %s" % decompress)
+        self.decompress = decompress
+
+    def is_pbf(self, osm_file):
+        return isinstance(osm_file, basestring) and osm_file.endswith(".pbf")
+
+    def is_splittable(self, osm_file):
+        """Return True if osm_file is an uncompressed OSM file, that ranges can split"""
+        return (isinstance(osm_file, basestring) and not self.is_pbf(osm_file) and
+                os.path.splitext(osm_file)[1] not in self.DECOMPRESSORS)
+
+    def command(self, extension):
+        for command in self.COMMANDS[extension]:
+            if find_executable(command[0]):
+                return command
+        return None
+
+    def open(self, osm_file):
+        """Return what iterparse reads: osm_file as is when uncompressed, a
+        file object decompressing it otherwise"""
+        extension = os.path.splitext(osm_file)[1] if isinstance(osm_file, basestring) else None
+        if extension not in self.DECOMPRESSORS:
+            return osm_file
+
+        command = self.command(extension) if self.decompress == "process" else None
+        if command is not None:
+            process = subprocess.Popen(command + [osm_file], stdout=subprocess.PIPE, bufsize=-1)
+            def close():
+                process.stdout.close()
+                process.wait()
+            return BlockFile(iter(lambda: process.stdout.read(self.DECOMPRESS_BLOCK_SIZE), b""), close)
+
+        blocks = decompressed_blocks(osm_file, self.DECOMPRESSORS[extension], self.DECOMPRESS_BLOCK_SIZE)
+        if self.decompress is not None: # no external command found for 'process'
+            blocks = prefetch(blocks, self.PREFETCH_DEPTH)
+        return BlockFile(blocks, blocks.close)
+
+    def elements(self, osm_file, tags=None, keys=None):
+        """Yield the Element record of each top level element whose tag is
+        in tags, with keys only the elements having tags of these keys
+        (and only these tags, see scan)"""
+        tags = self.TOP_LEVEL if tags is None else tags
+        if self.is_pbf(osm_file):
+            from pbf import PBFReader
+            for elem in PBFReader(self.decompress).elements(osm_file, tags, keys):
+                yield elem
+            return
+
+        source = self.open(osm_file)
+        try:
+            for elem in scan(source, tags, keys, block_size=self.BLOCK_SIZE):
+                yield elem
+        finally:
+            if source is not osm_file:
+                source.close()
+
+    def changes(self, osc_file, tags=None):
+        """Yield (action, Element) for each top level element of an osmChange
+        file, action being 'create', 'modify' or 'delete'
+
+        Reference: http://wiki.openstreetmap.org/wiki/OsmChange
+        """
+        tags = self.TOP_LEVEL if tags is None else tags
+        source = self.open(osc_file)
+        try:
+            for action, elem in scan(source, tags, actions=self.ACTIONS, block_size=self.BLOCK_SIZE):
+                yield action, elem
+        finally:
+            if source is not osc_file:
+                source.close()
+
+    def trees(self, osm_file, tags=None):
+        """Yield each top level element of an OSM file (no PBF) as an
+        ElementTree element once fully parsed (children included), as
+        elements did before the Element records (benchmarks)
+
+        The element and the references the root keeps on it are released
+        as soon as the consumer asks for the next element: do not keep
+        references on yielded elements.
+        """
+        tags = self.TOP_LEVEL if tags is None else tags
+        source = self.open(osm_file)
+        try:
+            context = ET.iterparse(source, events=("start", "end"))
+            _, root = next(context)
+            for event, elem in context:
+                if event == "end" and elem.tag in self.TOP_LEVEL:
+                    if elem.tag in tags:
+                        yield elem
+                    elem.clear()
+                    root.clear()
+        finally:
+            if source is not osm_file:
+                source.close()
+
+    def find_element(self, f, offset):
+        """Return the offset of the first top level element starting at or after offset"""
+        f.seek(offset)
+        data = b""
+        while True:
+            block = f.read(self.BLOCK_SIZE)
+            if not block:
+                return None
+            data += block
+            m = self.TOP_LEVEL_RE.search(data)
+            if m:
+                return offset + m.start()
+            keep = min(len(data), 16) # a tag could be split over two blocks
+            offset += len(data) - keep
+            data = data[-keep:]
+
+    def find_end(self, f, start, end):
+        """Return the offset of the last </osm> closing tag of f in [start, end[,
+        None if there is none (blocks read backwards from end)"""
+        tag = b"</osm>"
+        while end > start:
+            block_start = max(start, end - self.BLOCK_SIZE)
+            f.seek(block_start)
+            # overlapping the next block, for a tag across both
+            i = f.read(end - block_start + len(tag) - 1).rfind(tag)
+            if i >= 0:
+                return block_start + i
+            end = block_start
+        return None
+
+    def ranges(self, osm_file, count):
+        """Split osm_file into at most count [start, end[ byte ranges, each one
+        starting on a top level element and ending before the next range"""
+        size = os.path.getsize(osm_file)
+        with io.open(osm_file, "rb") as f:
+            first = self.find_element(f, 0)
+            if first is None:
+                return []
+            last = self.find_end(f, first, size)
+            if last is None:
+                raise ValueError("no closing </osm> tag in %s (truncated file?)" % osm_file)
+
+            bounds = [first]
+            for i in range(1, count):
+                offset = self.find_element(f, first + (last - first) * i // count)
+                if offset is not None and bounds[-1] < offset < last:
+                    bounds.append(offset)
+            bounds.append(last)
+
+        return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
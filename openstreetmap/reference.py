@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reference bundle: all reference data required to audit a French area
+(FANTOIR way types and names, La Poste postcodes and localities, street
+regular expression) compiled once and saved in one single binary file
+
+The bundle is rebuilt only when the area code or the content of one
+of the source files changes (FANTOIR and La Poste data being read in
+parallel).
+
+Reference data can be loaded in a background thread while an OSM file
+starts being read: Background runs the loading, Pending stands for its
+result and only blocks the first time it is used.
+"""
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import hashlib
+import io
+import os
+import pprint
+import threading
+import unicodedata
+import sys, getopt
+
+"""House number mentions (french format)"""
+MENTIONS = ["bis", "ter", "quater", "ante"]
+
+def street_alternatives(way_types, way_type_names):
+    """Way types looked up at the beginning of a street name, in order"""
+    return list(way_types) + list(way_type_names) + ["place"]
+
+def street_expression(way_types, way_type_names):
+    """Regular expression previously used by the audit for street names (optional
+    house number before the street type, french format), see address.StreetParser"""
+    return r"^((?P<housenumber>(\d+)\s*(%s)?)\,?\s+)?((?P<type>(%s))\s+)?(?P<name>(.*))$" % (
+        '|'.join(MENTIONS),
+        '|'.join(street_alternatives(way_types, way_type_names))
+    )
+
+def fingerprint(path, previous=None, buffer_size=1 << 20):
+    """Return size, mtime and sha1 of path, the sha1 of previous
+    is reused when size and mtime did not change"""
+    stat = os.stat(path)
+    if previous is not None and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+        return previous
+
+    sha1 = hashlib.sha1()
+    with io.open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(buffer_size), b""):
+            sha1.update(chunk)
+    return { "size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1.hexdigest() }
+
+class Background(object):
+    """Result of func(*args) computed in a background thread, result()
+    waits for it (exceptions are raised to the caller)"""
+
+    def __init__(self, func, *args):
+        self.done = threading.Event()
+        self.value = self.error = None
+        thread = threading.Thread(target=self.run, args=(func,) + args)
+        thread.daemon = True
+        thread.start()
+
+    def run(self, func, *args):
+        try:
+            self.value = func(*args)
+        except Exception:
+            self.error = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def result(self):
+        while not self.done.wait(0.1): # a bare wait() would not be interrupted by ^C
+            pass
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+class Pending(object):
+    """Stands for the value returned by build(), called the first time an
+    attribute or an item is looked up (methods are then looked up on the
+    value only once)"""
+
+    def __init__(self, build):
+        # own attributes prefixed not to hide the ones of the value
+        self.__dict__["_build"] = build
+        self.__dict__["_lock"] = threading.Lock()
+
+    def result(self):
+        with self._lock:
+            if "_value" not in self.__dict__:
+                self.__dict__["_value"] = self._build()
+        return self._value
+
+    def __getattr__(self, name):
+        value = getattr(self.result(), name)
+        if callable(value):
+            self.__dict__[name] = value
+        return value
+
+    def __getitem__(self, key):
+        return self.result()[key]
+
+    def __iter__(self):
+        return iter(self.result())
+
+    def __len__(self):
+        return len(self.result())
+
+def resolve(value):
+    """Return the value a Background or a Pending stands for, value itself otherwise"""
+    if isinstance(value, (Background, Pending)):
+        return value.result()
+    return value
+
+class ReferenceBundle(object):
+    VERSION = 4
+
+    def __init__(self, fantoir_file="data/FANTOIR1016",
+                 area_code="974",
+                 postcode_file="data/laposte_hexasmal.csv",
+                 way_types_file="data/FANTOIR1016-WAY-TYPE.csv",
+                 bundle_file=None):
+        self.fantoir_file = fantoir_file
+        self.area_code = area_code
+        self.postcode_file = postcode_file
+        self.way_types_file = way_types_file
+        self.bundle_file = "%s-%s.bundle" % (fantoir_file, area_code) if bundle_file is None else bundle_file
+        self.hits = self.misses = 0
+
+    def sources(self):
+        return {
+            "fantoir": self.fantoir_file,
+            "postcodes": self.postcode_file,
+            "way_types": self.way_types_file
+        }
+
+    def fingerprints(self, previous=None):
+        """Fingerprints of the sources, hashed in parallel (hashlib releases the GIL)"""
+        previous = {} if previous is None else previous
+        hashing = dict((name, Background(fingerprint, path, previous.get(name)))
+                       for name, path in self.sources().items())
+        return dict((name, background.result()) for name, background in hashing.items())
+
+    def build_postcodes(self):
+        from data_gouv_fr import postalcode
+        postcodes = postalcode.PostalCode(self.postcode_file)
+        positions = postcodes.positions()
+        return {
+            "city_by_postcode": postcodes.cityByPostcode(),
+            "locality_by_postcode": postcodes.localityByPostcode(),
+            "postcode_by_locality": postcodes.postcodeByLocality(),
+            "postcode_positions": dict((column, positions[column].values) for column in positions.columns)
+        }
+
+    def build_ways(self):
+        from data_gouv_fr import fantoir
+        db = fantoir.FANTOIR()
+        way_types = db.way_types(self.way_types_file)
+        ways = db.ways(self.fantoir_file, self.area_code, way_types)
+        return {
+            "way_types": frozenset(way_types.TYPE.values),
+            "way_type_names": frozenset(way_types.TYPE_NAME.values),
+            "way_names": frozenset(ways.NAME.values),
+            "way_full_names": frozenset(ways.FULL_NAME.values),
+            "street_alternatives": street_alternatives(way_types.TYPE.values, way_types.TYPE_NAME.values)
+        }
+
+    def build(self, fingerprints=None):
+        """Compile the bundle, La Poste data being read in a background thread
+        while FANTOIR is read"""
+        import pandas # imported before the La Poste thread starts, not while it reads
+        postcodes = Background(self.build_postcodes)
+        bundle = {
+            "version": self.VERSION,
+            "area_code": self.area_code,
+            "sources": self.fingerprints() if fingerprints is None else fingerprints
+        }
+        bundle.update(self.build_ways())
+        bundle.update(postcodes.result())
+        return bundle
+
+    def save(self, bundle):
+        with io.open(self.bundle_file, "wb") as f:
+            pickle.dump(bundle, f, pickle.HIGHEST_PROTOCOL)
+
+    def is_valid(self, bundle, fingerprints):
+        return (bundle.get("version") == self.VERSION and
+                bundle.get("area_code") == self.area_code and
+                all(bundle["sources"][name]["sha1"] == fingerprints[name]["sha1"] for name in fingerprints))
+
+    def load(self):
+        """Return the bundle, rebuilt and saved when an input changed"""
+        bundle = None
+        if os.path.exists(self.bundle_file):
+            with io.open(self.bundle_file, "rb") as f:
+                bundle = pickle.load(f)
+
+        fingerprints = self.fingerprints(None if bundle is None else bundle.get("sources"))
+        if bundle is not None and self.is_valid(bundle, fingerprints):
+            if bundle["sources"] != fingerprints: # touched only, keep the new mtimes
+                bundle["sources"] = fingerprints
+                self.save(bundle)
+            self.hits += 1
+            return bundle
+
+        self.misses += 1
+        bundle = self.build(fingerprints)
+        self.save(bundle)
+        return bundle
+
+class ReferenceIndex(object):
+    """Hash based lookups of reference values
+
+    All names are stored as uppercase ASCII strings (as in FANTOIR database),
+    the values checked against the index are normalized the same way through
+    a bounded memo cache, as the same values are repeated all over an OSM file.
+    """
+    CACHE_SIZE = 100000
+
+    def __init__(self, way_types=(), way_names=(), postcodes=(), cities=(), positions=None, cache_size=CACHE_SIZE):
+        self.cache = {}
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self.way_types = frozenset(self.normalize(x) for x in way_types)
+        self.way_names = frozenset(self.normalize(x) for x in way_names)
+        self.postcodes = frozenset(int(x) for x in postcodes)
+        self.cities = frozenset(self.normalize(x) for x in cities)
+        self.localities = None
+        if positions is not None and len(positions["Code_postal"]):
+            from spatial import GridIndex
+            self.localities = GridIndex(positions["lat"], positions["lon"])
+            self.locality_postcodes = positions["Code_postal"]
+
+    @classmethod
+    def from_bundle(cls, bundle, cache_size=CACHE_SIZE):
+        return cls(way_types=bundle["way_type_names"],
+                   way_names=bundle["way_names"],
+                   postcodes=bundle["locality_by_postcode"].keys(),
+                   cities=bundle["postcode_by_locality"].keys(),
+                   positions=bundle["postcode_positions"],
+                   cache_size=cache_size)
+
+    def normalize(self, x):
+        """Downgrade to uppercase ascii, the cache is emptied once full"""
+        try:
+            value = self.cache[x]
+            self.hits += 1
+            return value
+        except KeyError:
+            self.misses += 1
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            value = self.cache[x] = unicodedata.normalize('NFKD', u'%s' % x).encode('ascii', 'ignore').upper()
+            return value
+
+    def normalize_all(self, values):
+        """normalize over a Series of values, at once (not cached)"""
+        return values.map(lambda x: u'%s' % x).str.normalize('NFKD').str.encode('ascii', 'ignore').str.upper()
+
+    def is_way_type(self, way_type):
+        return self.normalize(way_type) in self.way_types
+
+    def is_way_name(self, name):
+        return self.normalize(name) in self.way_names
+
+    def is_postcode(self, postcode):
+        return int(postcode) in self.postcodes
+
+    def is_city(self, city):
+        return self.normalize(city) in self.cities
+
+    def nearest_postcode(self, lat, lon):
+        """Postcode of the nearest La Poste locality, None without positions"""
+        if self.localities is None:
+            return None
+        indices, _ = self.localities.nearest(lat, lon)
+        return int(self.locality_postcodes[indices[0]])
+
+def usage():
+    print('reference.py -f <FANTOIR FILE> -a <AREA> -p <POSTCODE FILE> -b <BUNDLE FILE>')
+
+def main(argv):
+    fantoir_file = None
+    area_code = None
+    postcode_file = "data/laposte_hexasmal.csv"
+    bundle_file = None
+
+    try:
+        opts, args = getopt.getopt(argv,"hf:a:p:b:",["fantoir=", "area=", "postcode=", "bundle="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-f", "--fantoir"):
+             fantoir_file = arg
+        elif opt in ("-a", "--area"):
+             area_code = arg
+        elif opt in ("-p", "--postcode"):
+             postcode_file = arg
+        elif opt in ("-b", "--bundle"):
+             bundle_file = arg
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if fantoir_file is None or area_code is None:
+        print("You need to supply -f and -a")
+        sys.exit(2)
+
+    references = ReferenceBundle(fantoir_file, area_code,
+                                 postcode_file=postcode_file,
+                                 bundle_file=bundle_file)
+    bundle = references.load()
+    print(references.bundle_file)
+    pprint.pprint(dict((k, len(v)) for k, v in bundle.items() if isinstance(v, (frozenset, dict)) and k not in ["sources", "postcode_positions"]))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
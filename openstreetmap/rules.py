@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Registry of the audit and shaping rules of each tag key, loaded from
+a configuration file (data/rules.csv) shared by audit.py and shape.py
+
+| KEY, tag key
+| CATEGORY, audit results category and mapping file (<CATEGORY>-update.csv)
+| VALIDATOR, audit validator (city, street, housenumber, postcode or regex), empty to only map values
+| PATTERN, regular expression used by postcode and regex validators
+| FIXER, value fix applied before mapping when shaping (nospace)
+"""
+
+import csv
+import io
+import re
+import pprint
+import sys
+
+
+class Rule(object):
+    VALIDATORS = ["city", "street", "housenumber", "postcode", "regex"]
+    FIXERS = {
+        "nospace": lambda val: val.replace(' ', '')
+    }
+
+    def __init__(self, key, category, validator=None, pattern=None, fixer=None):
+        if validator and validator not in self.VALIDATORS:
+            raise ValueError("unknown validator %s for key %s" % (validator, key))
+        if fixer and fixer not in self.FIXERS:
+            raise ValueError("unknown fixer %s for key %s" % (fixer, key))
+        self.key = key
+        self.category = category
+        self.validator = validator or None
+        self.pattern = re.compile(pattern) if pattern else None
+        self.fixer = fixer or None
+        self.fix = self.FIXERS[fixer] if fixer else (lambda val: val)
+
+    def __repr__(self):
+        return "Rule(%r, %r, %r)" % (self.key, self.category, self.validator)
+
+
+class RuleRegistry(object):
+    RULES_FILE = "data/rules.csv"
+
+    def __init__(self, rules_file=RULES_FILE):
+        self.rules = {}
+        with io.open(rules_file, "rb") as f:
+            for row in csv.DictReader(f, delimiter=";"):
+                rule = Rule(row["KEY"], row["CATEGORY"], row["VALIDATOR"], row["PATTERN"], row["FIXER"])
+                self.rules[rule.key] = rule
+
+    def get(self, key):
+        """Return the rule of tag key, None if the key has no rule"""
+        return self.rules.get(key)
+
+    def validated(self):
+        """Return the rules having a validator"""
+        return [rule for rule in self.rules.values() if rule.validator is not None]
+
+    def categories(self):
+        return set(rule.category for rule in self.rules.values())
+
+    def signature(self):
+        """Return the configuration of the rules (result cache key)"""
+        return tuple(sorted((rule.key, rule.category, rule.validator,
+                             rule.pattern.pattern if rule.pattern else None, rule.fixer)
+                            for rule in self.rules.values()))
+
+if __name__ == "__main__":
+    pprint.pprint(RuleRegistry(sys.argv[1] if len(sys.argv) > 1 else RuleRegistry.RULES_FILE).rules)
@@ -13,18 +13,19 @@ Reference: The cleansing is driven by the JSOM file format as described at http:
 
 Note that part of the code are inspired, modified or copy&paste from udacity quizz/course
 """
-import pandas as pd
-import numpy as np
-import xml.etree.cElementTree as ET
 from collections import defaultdict
-import codecs
+import io
 import json
 import re
 import pprint
 import sys, os, getopt
 import unicodedata
 
-from data_gouv_fr import fantoir, postalcode
+from reader import OSMReader
+from reference import Background, Pending
+from compact import CompactDocument, StringTable, to_dict
+from rules import RuleRegistry
+from metrics import Metrics, MeteredReader, stage
 
 class Shape(object):
     """
@@ -40,107 +41,383 @@ class Shape(object):
     """
     JSON_CREATED = [ "version", "changeset", "timestamp", "user", "uid" ]
 
+    """List of mapping files (<name>-update.csv) looked up in the update folder
+    """
+    MAPPING_FILES = [
+        "cities", 
+        "street_names", 
+        "street_types", 
+        "house_numbers", 
+        "house_postcodes", 
+        "postal_codes", 
+        "populations", 
+        "directions", 
+        "elevations", 
+        "capacities", 
+        "phones", 
+        "ref_insees"
+    ]
+
+    def mapping_files(self, update_folder):
+        """Return the mapping file of each mapped key, existing or not"""
+        return dict((f, "%s/%s-update.csv" % (update_folder, f)) for f in set(self.MAPPING_FILES) | self.rules.categories())
+
+    def load_mappings(self, update_folder):
+        """Get all updated mapped key"""
+        import pandas as pd
+        mappings = {}
+        for f, mapping_file in self.mapping_files(update_folder).items():
+            mappings[f] = {}
+            if os.path.exists(mapping_file):
+                df = pd.read_csv(mapping_file, encoding = 'utf-8')
+                mappings[f] = df.set_index("NEW")["OLD"].to_dict()
+
+        return mappings
+
+    def __init__(self, rules=None, reader=None, metrics=None):
+        self.rules = RuleRegistry() if rules is None else rules
+        self.reader = OSMReader() if reader is None else reader
+        self.metrics = metrics
+
+    def metered(self, writer, name):
+        """Return writer, the time of its flushes (serialization and output)
+        being recorded as name by metrics"""
+        if self.metrics is not None:
+            writer.flush = self.metrics.timed(name, writer.flush)
+        return writer
+
     def update_key(self, val, mapping):
-        if val in mapping.keys():
-            val = mapping[val]
-        return val
+        return mapping.get(val, val)
 
-    def shape_tag(self, tag, node, mappings):
-        key = tag.attrib['k']
-        val = tag.attrib['v']
- 
-        if not self.PROBLEM_CHARS_RE.match(key):
-            if key.startswith("addr:"):
-                address = node.setdefault("address", {})
-                addr_key = tag.attrib['k'][len("addr:") : ]
-                if not self.LOWER_COLON_RE.match(addr_key):
-                    if addr_key == "street":
-                        new_val = self.update_key(u'%s' % val, mappings["street_names"])
-                        address.update({ addr_key: new_val })
-                    elif addr_key == "city":
-                        new_val = self.update_key(u'%s' % val, mappings["cities"])
-                        address.update({ addr_key: new_val })
-                    elif addr_key == "housenumber":
-                        new_val = self.update_key(u'%s' % val, mappings["house_numbers"])
-                        address.update({ addr_key: new_val})
-                    elif addr_key == "postcode":
-                        # one fix for an extra space character inside the postcode value
-                        address.update({ addr_key: self.update_key(val.replace(' ', ''), mappings["house_postcodes"]) })
-                    else:
-                        address.update({ addr_key: u'%s' % val })
-            
-            elif key == "phone":
-                node[key] = self.update_key(val, mappings["phones"])
-            elif key == "capacity":
-                node[key] = self.update_key(val, mappings["capacities"])
-            elif key == "direction":
-                node[key] = self.update_key(val, mappings["directions"])
-            elif key == "ele":
-                node[key] = self.update_key(val, mappings["elevations"])
-            elif key == "postal_code":
-                node[key] = self.update_key(val, mappings["postal_codes"])
-            elif key == "population":
-                node[key] = self.update_key(val, mappings["populations"])
-            if key == "name":
-                node[key] = self.update_key(u'%s' % val, mappings["street_names"])
-            elif self.LOWER_RE.match(key):
+    def tag_handler(self, key, mappings):
+        """Return the function shaping the values of tag key into a node,
+        None when the tag is not exported"""
+        if self.PROBLEM_CHARS_RE.match(key):
+            return None
+
+        rule = self.rules.get(key)
+        mapping = {} if rule is None else mappings.get(rule.category, {})
+        if key.startswith("addr:"):
+            addr_key = key[len("addr:") : ]
+            if self.LOWER_COLON_RE.match(addr_key):
+                return lambda node, val: node.setdefault("address", {})
+            elif rule is not None:
+                def shape_address(node, val):
+                    val = rule.fix(u'%s' % val)
+                    node.setdefault("address", {})[addr_key] = mapping.get(val, val)
+                return shape_address
+            else:
+                def shape_address(node, val):
+                    node.setdefault("address", {})[addr_key] = u'%s' % val
+                return shape_address
+
+        elif rule is not None:
+            def shape_mapped(node, val):
+                val = rule.fix(u'%s' % val)
+                node[key] = mapping.get(val, val)
+            return shape_mapped
+        elif self.LOWER_RE.match(key):
+            def shape_lower(node, val):
                 node[key] = u'%s' % val
+            return shape_lower
+
+        return None
+
+    def dispatch(self, mappings):
+        """Return the tag key -> handler table for mappings, each key is resolved
+        (regular expressions and mapping selection) only the first time it is seen"""
+        table = getattr(self, "dispatch_table", None)
+        if table is None or table.mappings is not mappings:
+            table = self.dispatch_table = TagDispatch(self, mappings)
+        return table
+
+    def shape_tag(self, tag, node, mappings):
+        key, val = tag
+        handler = self.dispatch(mappings)[key]
+        if handler is not None:
+            handler(node, val)
 
     def shape_lat_lon(self, node, key, val):
         node.setdefault("pos", [0.0, 0.0])[0 if key == "lat" else 1] = float(val)
 
     def shape_element(self, element, mappings):
-        node = {}
         # you should process only 2 types of top level tags: "node" and "way"
         if element.tag == "node" or element.tag == "way" :
+            node = { "type": element.tag }
             created = node.setdefault("created", {})
-            for key in element.attrib.keys():
-                val = element.attrib[key]
-                node["type"] = element.tag
-
+            for key, val in element.attrib.items():
                 if key in self.JSON_CREATED:
-                    created.update({ key: val })
+                    created[key] = val
                 elif key == "lat" or key == "lon":
                     self.shape_lat_lon(node, key, val)
                 else:
                     node[key] = val
 
-                for tag in element.iter("tag"):
-                    self.shape_tag(tag, node, mappings)
+            dispatch = self.dispatch(mappings)
+            for key, val in element.tags:
+                handler = dispatch[key]
+                if handler is not None:
+                    handler(node, val)
 
-            node_refs = node.setdefault("node_refs", [])        
-            for tag in element.iter("nd"):
-                node_refs.append(tag.attrib["ref"])
+            node["node_refs"] = element.refs
 
             return node
         else:
             return None
 
-    def shape(self, osm_file, mappings, pretty = False):
-        # You do not need to change this file
+    def iter_shape(self, osm_file, mappings):
+        """Yield the shaped document of each node and way of osm_file"""
+        for element in self.reader.elements(osm_file, tags=["node", "way"]):
+            el = self.shape_element(element, mappings)
+            if el:
+                yield el
+
+    def shape(self, osm_file, mappings, pretty = False, serializer = "json"):
+        """Write all documents to <osm_file>.json and return them as a list
+        of CompactDocument (read-only mappings, to_dict gives the shaped dict),
+        see export to only keep counters in memory"""
         file_out = "{0}.json".format(osm_file)
         data = []
-        with codecs.open(file_out, "w", "utf-8") as fo:
-            for _, element in ET.iterparse(osm_file):
-                el = self.shape_element(element, mappings)
-                if el:
-                    data.append(el)
-                    if pretty:
-                        fo.write(json.dumps(el, indent=2, ensure_ascii=False, encoding='utf8')+"\n")
-                    else:
-                        fo.write(json.dumps(el, ensure_ascii=False, encoding='utf8') + "\n")
+        strings = StringTable()
+        with self.metered(JSONWriter(file_out, pretty=pretty, serializer=serializer), "json_write") as writer:
+            for el in self.iter_shape(osm_file, mappings):
+                data.append(CompactDocument.pack(el, strings))
+                writer.write(el)
         return data
+
+    def export(self, osm_file, mappings, pretty = False, serializer = "json", sample_id = None):
+        """Write all documents to <osm_file>.json and return the number
+        of documents by type and the documents whose id is sample_id"""
+        file_out = "{0}.json".format(osm_file)
+        counters = defaultdict(int)
+        sample = []
+        with self.metered(JSONWriter(file_out, pretty=pretty, serializer=serializer), "json_write") as writer:
+            for el in self.iter_shape(osm_file, mappings):
+                counters[el["type"]] += 1
+                if el["id"] == sample_id:
+                    sample.append(el)
+                writer.write(el)
+        return dict(counters), sample
+
+    def shape_tags(self, element, mappings):
+        """Return the shaped (key, value) tags of element, address sub keys
+        being prefixed with 'addr:' again"""
+        tags = {}
+        dispatch = self.dispatch(mappings)
+        for key, val in element.tags:
+            handler = dispatch[key]
+            if handler is not None:
+                handler(tags, val)
+        address = tags.pop("address", None)
+        tags = tags.items()
+        if isinstance(address, dict):
+            tags.extend(("addr:%s" % key, val) for key, val in address.items())
+        elif address is not None:
+            tags.append(("address", address))
+        return tags
+
+    def export_columnar(self, osm_file, mappings, folder):
+        """Write all nodes and ways with their shaped tags as a columnar export
+        into folder (see columnar.py), return the number of documents by type"""
+        from columnar import ColumnarWriter
+        with ColumnarWriter(folder) as writer:
+            for element in self.reader.elements(osm_file, tags=["node", "way"]):
+                if element.tag == "node":
+                    writer.write_node(element.attrib, self.shape_tags(element, mappings))
+                else:
+                    writer.write_way(element.attrib, element.refs, self.shape_tags(element, mappings))
+        return { "node": writer.counts["nodes"], "way": writer.counts["ways"] }
+
+    def load(self, osm_file, mappings, collection, batch_size = None, ordered = False, city_by_postcode = None):
+        """Insert all documents into collection (MongoDB), then correct postcodes
+        and cities, return the number of documents by type and of corrections"""
+        counters = defaultdict(int)
+        writer = self.metered(MongoWriter(collection, batch_size=batch_size or MongoWriter.BATCH_SIZE, ordered=ordered),
+                              "mongo_write")
+        with writer:
+            for el in self.iter_shape(osm_file, mappings):
+                counters[el["type"]] += 1
+                writer.write(el)
+        return dict(counters), writer.correct(city_by_postcode)
+
+class TagDispatch(dict):
+    """Tag key -> handler table, filled on first lookup of each key"""
+
+    def __init__(self, shape, mappings):
+        dict.__init__(self)
+        self.shape = shape
+        self.mappings = mappings
+
+    def __missing__(self, key):
+        handler = self[key] = self.shape.tag_handler(key, self.mappings)
+        return handler
+
+class JSONWriter(object):
+    """Buffered JSON lines writer, documents are serialized and written
+    by batches of batch_size lines
+
+    'json', standard library serializer (default),
+    'ujson', faster serializer if installed (https://pypi.python.org/pypi/ujson)
+    """
+    BATCH_SIZE = 10000
+    BUFFER_SIZE = 1 << 20
+    SERIALIZERS = ["json", "ujson"]
+
+    def __init__(self, file_out, pretty = False, serializer = "json", batch_size = BATCH_SIZE):
+        self.dumps = self.serializer(serializer, pretty)
+        self.batch_size = batch_size
+        self.batch = []
+        self.offset = 0
+        self.fo = io.open(file_out, "wb", buffering=self.BUFFER_SIZE)
+
+    def serializer(self, name, pretty):
+        indent = 2 if pretty else None
+        if name == "json":
+            return lambda el: json.dumps(el, indent=indent, ensure_ascii=False, encoding='utf8')
+        elif name == "ujson":
+            import ujson
+            return lambda el: ujson.dumps(el, indent=indent or 0, ensure_ascii=False)
+        raise ValueError("unknown serializer %s, expected one of %s" % (name, self.SERIALIZERS))
+
+    def line(self, el):
+        """Return the serialized line of el (without line break), a shaped
+        dict or a CompactDocument"""
+        line = self.dumps(to_dict(el))
+        return line if isinstance(line, bytes) else line.encode('utf-8')
+
+    def write(self, el):
+        """Write el, return the offset of its line in the file"""
+        return self.write_line(self.line(el))
+
+    def write_line(self, line):
+        offset = self.offset
+        self.batch.append(line)
+        self.offset += len(line) + 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        return offset
+
+    def write_bytes(self, data):
+        """Write already serialized lines as is"""
+        self.flush()
+        self.fo.write(data)
+        self.offset += len(data)
+
+    def flush(self):
+        if self.batch:
+            self.batch.append(b"")
+            self.fo.write(b"\n".join(self.batch))
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.fo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
+class MongoWriter(object):
+    """Batched MongoDB writer, documents are inserted by batches of batch_size
+    documents (ordered or unordered insert_many), the indexes used by the
+    analysis are created once all documents are inserted
+
+    Any collection object providing insert_many, create_index, distinct and
+    update_many can be used (pymongo collection or an in-memory stand-in).
+    Documents are held as CompactDocument until their batch is inserted,
+    their strings being shared through a StringTable of the batch only.
+    """
+    BATCH_SIZE = 1000
+    INDEXES = ["type", "created.user", "address.postcode"]
+
+    def __init__(self, collection, batch_size = BATCH_SIZE, ordered = False):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.batch = []
+        self.strings = StringTable()
+        self.inserted = 0
+
+    def write(self, el):
+        self.batch.append(el if isinstance(el, CompactDocument) else CompactDocument.pack(el, self.strings))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.collection.insert_many([to_dict(el) for el in self.batch], ordered=self.ordered)
+            self.inserted += len(self.batch)
+            self.batch = []
+            self.strings = StringTable()
+
+    def create_indexes(self):
+        for key in self.INDEXES:
+            self.collection.create_index(key)
+
+    def correct(self, city_by_postcode = None):
+        """Remove spaces from postcodes and set the city of each postcode
+        (city_by_postcode keys are integers), one update_many per distinct
+        postcode instead of one update per document"""
+        corrections = { "postcodes": 0, "cities": 0 }
+        node = { "type": "node" }
+        for postcode in self.collection.distinct("address.postcode", node):
+            fixed = postcode.replace(' ', '')
+            if fixed != postcode:
+                result = self.collection.update_many(dict(node, **{ "address.postcode": postcode }),
+                                                     { "$set": { "address.postcode": fixed } })
+                corrections["postcodes"] += result.modified_count
+
+        if city_by_postcode is not None:
+            for postcode in self.collection.distinct("address.postcode", node):
+                city = city_by_postcode.get(int(postcode)) if postcode.isdigit() else None
+                if city is not None:
+                    result = self.collection.update_many(dict(node, **{ "address.postcode": postcode,
+                                                                        "address.city": { "$ne": city } }),
+                                                         { "$set": { "address.city": city } })
+                    corrections["cities"] += result.modified_count
+
+        return corrections
+
+    def close(self):
+        self.flush()
+        self.create_indexes()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
 def usage():
-    print 'shape.py -i -v -o <OSM FILE> -u <UPDATE MAPPING FOLDER>'
+    print 'shape.py -i -v -o <OSM FILE> -u <UPDATE MAPPING FOLDER> -s <SAMPLE ID> -j <json|ujson>'
+    print '         [-d <DATABASE> -c <COLLECTION> -r <MONGODB URI> -b <BATCH SIZE> -l <POSTCODE FILE> -O]'
+    print '         [-x <COLUMNAR FOLDER>] [-z <thread|process>] [--profile] [--metrics-out <METRICS FILE>]'
 
 def main(argv):
     pretty = False
     osm_file = None
     update_folder = None
+    sample_id = "3480487005"
+    serializer = "json"
+    database = None
+    collection = None
+    uri = "mongodb://localhost:27017"
+    batch_size = MongoWriter.BATCH_SIZE
+    postcode_file = "data/laposte_hexasmal.csv"
+    ordered = False
+    columnar_folder = None
+    decompress = None
+    profile = False
+    metrics_file = None
     
     try:
-        opts, args = getopt.getopt(argv,"hpvo:u:",["pretty", "osm=", "ufolder="])
+        opts, args = getopt.getopt(argv,"hpvo:u:s:j:d:c:r:b:l:Ox:z:",["pretty", "osm=", "ufolder=", "sample=", "serializer=",
+                                                                    "database=", "collection=", "uri=", "batch=",
+                                                                    "postcode=", "ordered", "columnar=", "decompress=",
+                                                                    "profile", "metrics-out="])
     except getopt.GetoptError as err:
         print str(err)
         usage()
@@ -155,6 +432,30 @@ def main(argv):
              osm_file = arg
         elif opt in ("-u", "--ufolder"):
              update_folder = arg
+        elif opt in ("-s", "--sample"):
+             sample_id = arg
+        elif opt in ("-j", "--serializer"):
+             serializer = arg
+        elif opt in ("-d", "--database"):
+             database = arg
+        elif opt in ("-c", "--collection"):
+             collection = arg
+        elif opt in ("-r", "--uri"):
+             uri = arg
+        elif opt in ("-b", "--batch"):
+             batch_size = int(arg)
+        elif opt in ("-l", "--postcode"):
+             postcode_file = arg
+        elif opt in ("-O", "--ordered"):
+             ordered = True
+        elif opt in ("-x", "--columnar"):
+             columnar_folder = arg
+        elif opt in ("-z", "--decompress"):
+             decompress = arg
+        elif opt == "--profile":
+             profile = True
+        elif opt == "--metrics-out":
+             metrics_file = arg
         else:
             print("unhandled option")
             sys.exit(2)
@@ -163,40 +464,64 @@ def main(argv):
         print("You need to supply -o and -u")        
         sys.exit(2)
 
-    """Get all updated mapped key"""
-    mapping_files = [
-        "cities", 
-        "street_names", 
-        "street_types", 
-        "house_numbers", 
-        "house_postcodes", 
-        "postal_codes", 
-        "populations", 
-        "directions", 
-        "elevations", 
-        "capacities", 
-        "phones", 
-        "ref_insees"
-    ]
-    
-    mappings = {}
-    for f in mapping_files:
-        mappings[f] = {}
-        
-    for f in [mf for mf in mapping_files if os.path.exists("%s/%s-update.csv" % (update_folder, mf))]:
-        df = pd.read_csv("%s/%s-update.csv" % (update_folder, f), encoding = 'utf-8')
-        mappings[f] = df.set_index("NEW")["OLD"].to_dict()
-        
-    data = Shape().shape(
-        osm_file= osm_file,
-        mappings=mappings, 
-        pretty=pretty
-    )
-    
-    print("- SAMPLE -")
-    pprint.pprint([x for x in data if x["id"] == "3480487005"])
-    print("")
-    print("Number of documents: %d" %len(data))
+    if (database is None) != (collection is None):
+        print("You need to supply -d and -c together to load MongoDB")
+        sys.exit(2)
+
+    metrics = Metrics() if profile or metrics_file is not None else None
+    reader = OSMReader(decompress)
+    if metrics is not None:
+        reader = MeteredReader(reader, metrics)
+    shape = Shape(reader=reader, metrics=metrics)
+    # the mapping files are read while the OSM file starts being read,
+    # the first lookup of a mapping waits for them
+    def load_mappings():
+        with stage(metrics, "mappings"):
+            return shape.load_mappings(update_folder)
+    mappings = Pending(Background(load_mappings).result)
+
+    if columnar_folder is not None:
+        with stage(metrics, "columnar"):
+            counters = shape.export_columnar(osm_file, mappings, columnar_folder)
+        print("Number of documents: %d" % sum(counters.values()))
+        pprint.pprint(counters)
+
+    elif database is not None:
+        from pymongo import MongoClient
+        from data_gouv_fr import postalcode
+        with stage(metrics, "postcodes"):
+            city_by_postcode = postalcode.PostalCode(postcode_file).cityByPostcode()
+        with stage(metrics, "load"):
+            counters, corrections = shape.load(
+                osm_file= osm_file,
+                mappings=mappings,
+                collection=MongoClient(uri)[database][collection],
+                batch_size=batch_size,
+                ordered=ordered,
+                city_by_postcode=city_by_postcode
+            )
+        print("Number of documents: %d" % sum(counters.values()))
+        pprint.pprint(counters)
+        print("Number of corrections:")
+        pprint.pprint(corrections)
+
+    else:
+        with stage(metrics, "export"):
+            counters, sample = shape.export(
+                osm_file= osm_file,
+                mappings=mappings, 
+                pretty=pretty,
+                serializer=serializer,
+                sample_id=sample_id
+            )
+        print("- SAMPLE -")
+        pprint.pprint(sample)
+        print("")
+        print("Number of documents: %d" % sum(counters.values()))
+        pprint.pprint(counters)
+
+    if metrics is not None:
+        metrics.write(metrics_file)
     
 if __name__ == "__main__":
     main(sys.argv[1:])
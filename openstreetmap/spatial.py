@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Spatial index over node positions (the 'pos' [lat, lon] of shaped
+documents)
+
+Points are bucketed into a uniform latitude/longitude grid: the point indices
+are sorted by cell (row major), so the cells of one grid row overlapped by a
+bounding box are one contiguous slice of the sorted indices. Candidates are
+then filtered with NumPy. Distances are great circle distances in meters,
+the grid does not wrap around the antimeridian.
+"""
+
+import numpy as np
+import math
+import pprint
+import timeit
+import sys, getopt
+
+"""Mean earth radius (meters)"""
+EARTH_RADIUS = 6371008.8
+
+def distance(lat, lon, lats, lons):
+    """Haversine distance (meters) from lat, lon to each of lats, lons"""
+    lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class GridIndex(object):
+    POINTS_PER_CELL = 16
+
+    def __init__(self, lat, lon, cell_size=None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        n = len(self.lat)
+        if n:
+            self.south, self.north = self.lat.min(), self.lat.max()
+            self.west, self.east = self.lon.min(), self.lon.max()
+        else:
+            self.south = self.north = self.west = self.east = 0.0
+
+        if cell_size is None:
+            area = max(self.north - self.south, 1e-6) * max(self.east - self.west, 1e-6)
+            cell_size = math.sqrt(area / max(1, n // self.POINTS_PER_CELL))
+        self.cell_size = cell_size
+        self.rows = int((self.north - self.south) / cell_size) + 1
+        self.cols = int((self.east - self.west) / cell_size) + 1
+
+        keys = self.row(self.lat) * self.cols + self.col(self.lon)
+        self.order = np.argsort(keys, kind="mergesort")
+        self.starts = np.searchsorted(keys[self.order], np.arange(self.rows * self.cols + 1))
+
+    @classmethod
+    def from_documents(cls, documents, cell_size=None):
+        """Index of the documents having a position, return (index, documents)"""
+        documents = [d for d in documents if "pos" in d]
+        return cls([d["pos"][0] for d in documents], [d["pos"][1] for d in documents], cell_size), documents
+
+    @classmethod
+    def from_columnar(cls, reader, cell_size=None):
+        """Index of the nodes of a columnar export (rows of reader.nodes())"""
+        return cls(reader.array("nodes.lat"), reader.array("nodes.lon"), cell_size)
+
+    def row(self, lat):
+        return np.clip(np.floor((np.asarray(lat) - self.south) / self.cell_size), 0, self.rows - 1).astype(np.int64)
+
+    def col(self, lon):
+        return np.clip(np.floor((np.asarray(lon) - self.west) / self.cell_size), 0, self.cols - 1).astype(np.int64)
+
+    def bbox(self, south, west, north, east):
+        """Return the indices (ascending) of the points inside the bounding box"""
+        if len(self.lat) == 0 or north < self.south or south > self.north or east < self.west or west > self.east:
+            return np.zeros(0, dtype=np.int64)
+
+        c0, c1 = self.col(west), self.col(east)
+        slices = [self.order[self.starts[r * self.cols + c0]:self.starts[r * self.cols + c1 + 1]]
+                  for r in range(self.row(south), self.row(north) + 1)]
+        candidates = np.concatenate(slices)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        return np.sort(candidates[(lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)])
+
+    def radius(self, lat, lon, meters):
+        """Return the indices and distances of the points within meters of
+        lat, lon, nearest first"""
+        dlat = math.degrees(meters / EARTH_RADIUS)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-12)
+        candidates = self.bbox(lat - dlat, lon - min(dlon, 360.0), lat + dlat, lon + min(dlon, 360.0))
+        distances = distance(lat, lon, self.lat[candidates], self.lon[candidates])
+        inside = distances <= meters
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="mergesort")
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lon, k=1):
+        """Return the indices and distances of the k nearest points of lat, lon,
+        the search radius being doubled until k points are found"""
+        k = min(k, len(self.lat))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        meters = math.radians(self.cell_size) * EARTH_RADIUS
+        while True:
+            indices, distances = self.radius(lat, lon, meters)
+            if len(indices) >= k or meters > math.pi * EARTH_RADIUS:
+                return indices[:k], distances[:k]
+            meters *= 2
+
+def usage():
+    print('spatial.py -n <POINTS> -q <QUERIES>')
+
+def main(argv):
+    points = 1000000
+    queries = 1000
+
+    try:
+        opts, args = getopt.getopt(argv,"hn:q:",["points=", "queries="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-n", "--points"):
+             points = int(arg)
+        elif opt in ("-q", "--queries"):
+             queries = int(arg)
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    """Random points over La Réunion bounding box, timings in microseconds per query"""
+    rand = np.random.RandomState(974)
+    lat = rand.uniform(-21.4, -20.9, points)
+    lon = rand.uniform(55.2, 55.8, points)
+    start = timeit.default_timer()
+    index = GridIndex(lat, lon)
+    build = timeit.default_timer() - start
+
+    centers = zip(rand.uniform(-21.4, -20.9, queries), rand.uniform(55.2, 55.8, queries))
+    timings = {}
+    for name, query in [("bbox", lambda y, x: index.bbox(y - 0.001, x - 0.001, y + 0.001, x + 0.001)),
+                        ("radius", lambda y, x: index.radius(y, x, 100)),
+                        ("nearest", lambda y, x: index.nearest(y, x, 10))]:
+        start = timeit.default_timer()
+        for y, x in centers:
+            query(y, x)
+        timings[name] = (timeit.default_timer() - start) * 1e6 / queries
+
+    y, x = centers[0]
+    expected = np.argsort(distance(y, x, lat, lon), kind="mergesort")[:10]
+    assert (index.nearest(y, x, 10)[0] == expected).all()
+    assert (index.bbox(y - 0.01, x - 0.01, y + 0.01, x + 0.01) ==
+            np.flatnonzero((lat >= y - 0.01) & (lat <= y + 0.01) & (lon >= x - 0.01) & (lon <= x + 0.01))).all()
+
+    pprint.pprint({ "points": points, "build": build, "queries": timings })
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Suggested fixes of the values reported by the audit: closest reference
+name (FANTOIR way full names, La Poste localities) of each value
+
+Reference names are indexed by character trigrams (inverted index), only the
+names sharing enough trigrams with a value are compared with it (prefix
+filtering: a name sharing none of the rarest trigrams of the value can not
+reach the minimum score, nor the best score found so far). The score is the Dice coefficient of the trigram
+sets, 1.0 for the same name once normalized.
+"""
+
+from collections import defaultdict
+import math
+import re
+import unicodedata
+
+"""Abbreviations used by the reference names (La Poste localities)"""
+ABBREVIATIONS = { "SAINT": "ST", "SAINTE": "STE" }
+
+class Suggester(object):
+    NGRAM = 3
+    MIN_SCORE = 0.5
+    CONFIDENCE = 0.8
+    SEPARATORS_RE = re.compile(r'[^A-Z0-9]+')
+
+    def __init__(self, names, min_score=MIN_SCORE, confidence=CONFIDENCE):
+        self.min_score = min_score
+        self.confidence = confidence
+        self.names = []
+        self.grams = []
+        self.exact = {}
+        self.postings = defaultdict(list)
+        for name in sorted(set(names)):
+            key = self.normalize(name)
+            if not key or key in self.exact:
+                continue
+            self.exact[key] = len(self.names)
+            for gram in self.ngrams(key):
+                self.postings[gram].append(len(self.names))
+            self.names.append(name)
+            self.grams.append(self.ngrams(key))
+
+    def normalize(self, x):
+        """Uppercase ascii words separated by one space (as in FANTOIR database)"""
+        x = unicodedata.normalize('NFKD', u'%s' % x).encode('ascii', 'ignore').upper()
+        return ' '.join(ABBREVIATIONS.get(w, w) for w in self.SEPARATORS_RE.split(x) if w)
+
+    def ngrams(self, key):
+        key = " %s " % key
+        return frozenset(key[i:i + self.NGRAM] for i in range(len(key) - self.NGRAM + 1))
+
+    def prefix(self, grams, score):
+        """Number of the rarest trigrams of grams a reference name must share
+        at least one of to reach score"""
+        overlap = int(math.ceil(score * len(grams) / (2 - score) - 1e-9))
+        return len(grams) - overlap + 1
+
+    def score(self, grams, other):
+        return 2.0 * len(grams & other) / (len(grams) + len(other))
+
+    def suggest(self, value):
+        """Return (closest reference name, score), (None, 0.0) when no name
+        reaches min_score
+
+        Names are scored as they are found in the postings of the rarest
+        trigrams first, the number of postings to read decreasing as the best
+        score increases (the first name wins in case of a tie)"""
+        key = self.normalize(value)
+        if key in self.exact:
+            return self.names[self.exact[key]], 1.0
+
+        grams = self.ngrams(key)
+        if not grams:
+            return None, 0.0 # no letter nor digit ("-", "?")
+
+        rarest = sorted(grams, key=lambda g: len(self.postings.get(g, ())))
+        seen = set()
+        suggestion, best = None, 0.0
+        i = 0
+        while i < min(len(rarest), self.prefix(grams, max(best, self.min_score))):
+            for index in self.postings.get(rarest[i], ()):
+                if index not in seen:
+                    seen.add(index)
+                    score = self.score(grams, self.grams[index])
+                    if score > best or (score == best and suggestion is not None and index < suggestion):
+                        suggestion, best = index, score
+            i += 1
+
+        if best < self.min_score:
+            return None, 0.0
+        return self.names[suggestion], best
+
+    def is_confident(self, score):
+        return score >= self.confidence
+
+if __name__ == "__main__":
+    suggester = Suggester([u"RUE DES LILAS", u"ALLEE DE VIVOI", u"IMPASSE DU PITON DUGAIN", u"ST JOSEPH"])
+    assert(suggester.suggest(u"Rue des Lilas") == (u"RUE DES LILAS", 1.0))
+    assert(suggester.suggest(u"Saint-Joseph") == (u"ST JOSEPH", 1.0))
+    assert(suggester.suggest(u"Allée de vivoi")[0] == u"ALLEE DE VIVOI")
+    assert(suggester.suggest(u"IMPASSE PITON DUGAIN")[0] == u"IMPASSE DU PITON DUGAIN")
+    assert(suggester.suggest(u"Chemin du Stade") == (None, 0.0))
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Deterministic synthetic data to benchmark the tools at any scale: OSM XML
+or PBF files and the FANTOIR and La Poste reference files they refer to
+
+The same seed always gives the same files. Way types are the FANTOIR ones
+(data/FANTOIR1016-WAY-TYPE.csv), the i-th way name only depends on i, so an
+OSM file generated with -w <STREETS> refers to the ways of any FANTOIR file
+generated with at least as many ways. Addresses are located next to the La
+Poste locality of their postcode.
+
+A share of the audited values (-b) is made bad the way they are found in
+real extracts: misspelled or unknown street names, missing way types,
+unknown cities, spaced or out of area postcodes, postcodes of another
+locality, malformed house numbers, phones and numbers.
+"""
+
+from collections import defaultdict, OrderedDict
+from xml.sax.saxutils import quoteattr
+import io
+import pprint
+import random
+import sys, getopt
+
+from data_gouv_fr import fantoir
+from reader import Element
+from pbf import PBFWriter
+
+class Synthetic(object):
+    """Probability for an element to have each tag, 'address' standing for
+    addr:street, addr:housenumber, addr:postcode and addr:city together"""
+    TAG_MIX = OrderedDict([
+        ("address", 0.25),
+        ("name", 0.15),
+        ("highway", 0.1),
+        ("building", 0.1),
+        ("amenity", 0.05),
+        ("source", 0.1),
+        ("phone", 0.03),
+        ("ele", 0.02),
+        ("capacity", 0.01),
+        ("direction", 0.01),
+        ("population", 0.005),
+        ("postal_code", 0.005),
+        ("name:fr", 0.01),
+        ("note", 0.01),
+        ("Bad Key", 0.005)
+    ])
+    """Share of nodes, ways and relations"""
+    ELEMENT_MIX = [("node", 0.85), ("way", 0.13), ("relation", 0.02)]
+
+    PARTICLES = ["DES", "DU", "DE LA", "DE", "D"]
+    WORDS = ["MARTINS", "LILAS", "PENSEES", "BARBADINES", "VIVOI", "PITON ROUGE", "STADE",
+             "GENERAL DE GAULLE", "RAPHAEL BABET", "TAMARINS", "FILAOS", "VACOAS", "CANNES",
+             "GOYAVIERS", "LETCHIS", "MANGUIERS", "BADAMIERS", "FLAMBOYANTS", "HIBISCUS",
+             "ORCHIDEES", "VANILLIERS", "GERANIUMS", "CAFRINE", "PLATEAU", "RAVINE", "RIVIERE",
+             "SOURCE", "CASCADE", "BASSIN", "PLAINE", "COTEAU", "CRETE", "GRAND BOIS",
+             "PETITE ILE", "LANGEVIN", "VINCENDO", "JEAN PETIT", "MANAPANY", "CAYENNE",
+             "GOYAVES", "CHAMP BORNE", "BOIS DE NEFLES", "ECOLE", "EGLISE", "MAIRIE", "PORT",
+             "PHARE", "CIMETIERE", "MARCHE", "GARE"]
+    LOCALITIES = ["ST JOSEPH", "ST PIERRE", "LE TAMPON", "ST DENIS", "ST PAUL", "ST LOUIS",
+                  "ST ANDRE", "ST BENOIT", "LE PORT", "LA POSSESSION", "ST LEU", "ST PHILIPPE",
+                  "STE MARIE", "STE SUZANNE", "STE ROSE", "LES AVIRONS", "L ETANG SALE",
+                  "PETITE ILE", "CILAOS", "ENTRE DEUX", "SALAZIE", "BRAS PANON", "LA PLAINE DES PALMISTES",
+                  "TROIS BASSINS"]
+    """Bounding box of the localities (Île de La Réunion)"""
+    BOUNDS = (-21.39, 55.21, -20.87, 55.84)
+    """Addresses are at most JITTER degrees away from their locality"""
+    JITTER = 0.02
+    RIVOLI_KEYS = "ABCDEFGHJKLMNPRSTUVWXYZ"
+
+    def __init__(self, seed=974, bad_share=0.1, tag_mix=None, streets=2000,
+                 way_types_file="data/FANTOIR1016-WAY-TYPE.csv", area_code="974"):
+        self.seed = seed
+        self.bad_share = bad_share
+        self.tag_mix = self.TAG_MIX if tag_mix is None else tag_mix
+        self.streets = streets
+        self.area_code = area_code
+        types = fantoir.FANTOIR().way_types(way_types_file)
+        # way type names starting with another way type (CHEMIN RURAL) are
+        # left out, the audit splits them on the shorter one
+        alternatives = set(types.TYPE.values) | set(types.TYPE_NAME.values)
+        self.way_types = [(way_type, name) for way_type, name in zip(types.TYPE.values, types.TYPE_NAME.values)
+                          if not any(name.startswith(other + " ") for other in alternatives)]
+        self.localities = self.init_localities()
+
+    def init_localities(self):
+        """Return the localities (INSEE code, name, postcode, latitude, longitude)
+        of the area, on a grid wide enough for an address to be nearer to its
+        locality than to any other one"""
+        count = len(self.LOCALITIES)
+        columns = int(count ** 0.5 + 0.999)
+        rows = (count + columns - 1) // columns
+        min_lat, min_lon, max_lat, max_lon = self.BOUNDS
+        localities = []
+        for i, name in enumerate(self.LOCALITIES):
+            lat = min_lat + (max_lat - min_lat) * (i // columns + 0.5) / rows
+            lon = min_lon + (max_lon - min_lon) * (i % columns + 0.5) / columns
+            localities.append((u"%s%02d" % (self.area_code, i + 11), name,
+                               int(self.area_code) * 100 + 10 + i * 3, round(lat, 4), round(lon, 4)))
+        return localities
+
+    def way(self, i):
+        """Return the FANTOIR way type, way type name and name of the i-th way"""
+        way_type, type_name = self.way_types[(i * 7919) % len(self.way_types)]
+        n = len(self.PARTICLES) * len(self.WORDS)
+        name = u"%s %s" % (self.PARTICLES[i % len(self.PARTICLES)], self.WORDS[(i // len(self.PARTICLES)) % len(self.WORDS)])
+        if i >= n:
+            name = u"%s %d" % (name, i // n)
+        return way_type, type_name, name
+
+    def misspell(self, rand, value):
+        i = rand.randrange(len(value))
+        if rand.random() < 0.5:
+            return value[:i] + value[i + 1:]
+        return value[:i] + value[i] + value[i:]
+
+    def is_bad(self, rand):
+        return rand.random() < self.bad_share
+
+    def street(self, rand):
+        _, type_name, name = self.way(rand.randrange(self.streets))
+        if not self.is_bad(rand):
+            return u"%s %s" % (type_name.title(), name.title())
+        choice = rand.randrange(3)
+        if choice == 0:
+            return u"%s %s" % (type_name.title(), self.misspell(rand, name).title())
+        elif choice == 1:
+            return name.title() # no way type
+        return u"%s %s" % (type_name.lower(), self.WORDS[rand.randrange(len(self.WORDS))].title() + u" Nord")
+
+    def city(self, rand, locality):
+        name = locality[1]
+        if not self.is_bad(rand):
+            return name.title()
+        choice = rand.randrange(3)
+        if choice == 0:
+            return name.replace(u"STE ", u"Sainte ").replace(u"ST ", u"Saint ").replace(u" ", u"-").title()
+        elif choice == 1:
+            return self.misspell(rand, name).title()
+        return u"%s (La Réunion)" % name.title()
+
+    def housenumber(self, rand):
+        number = rand.randint(1, 300)
+        if not self.is_bad(rand):
+            return rand.choice([u"%d" % number, u"%d" % number, u"%d bis" % number, u"%d ter" % number,
+                                u"%d,%d" % (number, number + 2), u"Appt %d,%d" % (number, number + 1),
+                                u"BP %d" % number, u"bat A"])
+        return rand.choice([u"%d-%d" % (number, number + 2), u"n°%d" % number, u"#%d" % number,
+                            u"%d / %d" % (number, number + 1)])
+
+    def postcode(self, rand, locality):
+        code = u"%d" % locality[2]
+        if not self.is_bad(rand):
+            return code
+        choice = rand.randrange(3)
+        if choice == 0:
+            return u"%s %s" % (code[:2], code[2:])
+        elif choice == 1:
+            return u"%05d" % rand.randint(1000, 95999)
+        return u"%d" % self.localities[(self.localities.index(locality) + 1) % len(self.localities)][2] # another locality
+
+    def phone(self, rand):
+        digits = u"%08d" % rand.randint(0, 99999999)
+        if not self.is_bad(rand):
+            return rand.choice([u"+262 262 %s %s %s %s" % (digits[:2], digits[2:4], digits[4:6], digits[6:]),
+                                u"0262%s" % digits[2:], u"0692 %s" % digits[2:]])
+        return rand.choice([u"262 %s" % digits[:4], u"tel: 0262%s" % digits[2:], u"inconnu"])
+
+    def number(self, rand, good, bad):
+        return good if not self.is_bad(rand) else bad
+
+    def tags(self, rand, element):
+        """Return the tags (key, value) of an element and the locality of its
+        address (None without address)"""
+        tags = []
+        locality = None
+        for key, probability in self.tag_mix.items():
+            if rand.random() >= probability:
+                continue
+            if key == "address":
+                locality = self.localities[rand.randrange(len(self.localities))]
+                tags.extend([(u"addr:street", self.street(rand)),
+                             (u"addr:housenumber", self.housenumber(rand)),
+                             (u"addr:postcode", self.postcode(rand, locality)),
+                             (u"addr:city", self.city(rand, locality))])
+            elif key == "name":
+                tags.append((key, self.street(rand)))
+            elif key == "phone":
+                tags.append((key, self.phone(rand)))
+            elif key == "ele":
+                tags.append((key, self.number(rand, u"%.1f" % rand.uniform(0, 3000), u"%d m" % rand.randint(0, 3000))))
+            elif key == "capacity":
+                tags.append((key, self.number(rand, u"%d" % rand.randint(1, 500), u"%d places" % rand.randint(1, 500))))
+            elif key == "direction":
+                tags.append((key, self.number(rand, u"%d" % rand.randint(1, 359), rand.choice([u"N", u"SE", u"-90"]))))
+            elif key == "population":
+                tags.append((key, self.number(rand, u"%d" % rand.randint(1, 99999), u"%d %03d" % (rand.randint(1, 99), rand.randint(0, 999)))))
+            elif key == "postal_code":
+                tags.append((key, self.postcode(rand, self.localities[rand.randrange(len(self.localities))])))
+            elif key == "highway":
+                tags.append((key, rand.choice([u"residential", u"service", u"track", u"footway", u"primary"]) if element == "way" else u"crossing"))
+            elif key == "building":
+                tags.append((key, rand.choice([u"yes", u"house", u"residential"])))
+            elif key == "amenity":
+                tags.append((key, rand.choice([u"school", u"place_of_worship", u"parking", u"townhall"])))
+            elif key == "source":
+                tags.append((key, u"cadastre-dgi-fr source : Direction Générale des Impôts - Cadastre. Mise à jour : 2016"))
+            else:
+                tags.append((key, u"%s %d" % (key, rand.randint(1, 100))))
+        return tags, locality
+
+    def position(self, rand, locality):
+        if locality is None:
+            min_lat, min_lon, max_lat, max_lon = self.BOUNDS
+            return rand.uniform(min_lat, max_lat), rand.uniform(min_lon, max_lon)
+        return (locality[3] + rand.uniform(-self.JITTER, self.JITTER),
+                locality[4] + rand.uniform(-self.JITTER, self.JITTER))
+
+    def counts(self, elements):
+        """Return the number of nodes, ways and relations out of elements"""
+        counts = OrderedDict((element, int(elements * share)) for element, share in self.ELEMENT_MIX)
+        counts["node"] += elements - sum(counts.values())
+        return counts
+
+    def elements(self, elements):
+        """Yield the elements nodes, ways and relations of the file as
+        reader.Element records (attributes in the order they are written)"""
+        rand = random.Random(self.seed)
+        counts = self.counts(elements)
+        for element, count in counts.items():
+            for i in range(count):
+                element_id = i + 1
+                tags, locality = self.tags(rand, element)
+                attrib = OrderedDict([("id", u"%d" % element_id), ("visible", u"true"),
+                                      ("version", u"%d" % rand.randint(1, 5)),
+                                      ("changeset", u"%d" % rand.randint(1, 100000)),
+                                      ("timestamp", u"2016-%02d-%02dT12:00:00Z" % (rand.randint(1, 12), rand.randint(1, 28))),
+                                      ("user", u"user%d" % (element_id % 500)),
+                                      ("uid", u"%d" % (element_id % 500 + 1))])
+                refs, members = [], []
+                if element == "node":
+                    lat, lon = self.position(rand, locality)
+                    attrib["lat"], attrib["lon"] = u"%.7f" % lat, u"%.7f" % lon
+                elif element == "way":
+                    refs = [u"%d" % rand.randint(1, max(1, counts["node"])) for _ in range(rand.randint(2, 8))]
+                else:
+                    members = [(u"way", u"%d" % rand.randint(1, max(1, counts["way"])), role)
+                               for role in [u"outer", u"inner"][:rand.randint(1, 2)]]
+                yield Element(element, attrib, tags, refs, members)
+
+    def write_osm(self, osm_file, elements):
+        """Write an OSM file of elements nodes, ways and relations, return
+        the number of elements by type and of tags by key"""
+        keys = defaultdict(int)
+        with io.open(osm_file, "w", encoding="utf-8", buffering=1 << 20) as f:
+            f.write(u'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="synthetic.py">\n')
+            f.write(u' <bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>\n' % self.BOUNDS)
+            for element in self.elements(elements):
+                attributes = u" ".join(u'%s="%s"' % item for item in element.attrib.items())
+                children = [u'  <nd ref="%s"/>\n' % ref for ref in element.refs]
+                children.extend(u'  <member type="%s" ref="%s" role="%s"/>\n' % member for member in element.members)
+                for key, value in element.tags:
+                    keys[key] += 1
+                    children.append(u'  <tag k=%s v=%s/>\n' % (quoteattr(key), quoteattr(value)))
+                if children:
+                    f.write(u' <%s %s>\n%s </%s>\n' % (element.tag, attributes, u"".join(children), element.tag))
+                else:
+                    f.write(u' <%s %s/>\n' % (element.tag, attributes))
+            f.write(u'</osm>\n')
+        return { "elements": dict(self.counts(elements)), "tags": dict(keys) }
+
+    def write_pbf(self, pbf_file, elements):
+        """Write the elements of write_osm as a PBF file, return the number
+        of elements by type and of tags by key"""
+        keys = defaultdict(int)
+        with PBFWriter(pbf_file) as writer:
+            for element in self.elements(elements):
+                for key, _ in element.tags:
+                    keys[key] += 1
+                writer.write(element)
+        return { "elements": dict(self.counts(elements)), "tags": dict(keys) }
+
+    def fantoir_line(self, text):
+        return (u"%-150s\n" % text).encode("latin-1")
+
+    def write_fantoir(self, fantoir_file, ways=None, other_ways=1000):
+        """Write a FANTOIR file of ways ways (the street names of the OSM
+        files by default) spread over the communes of the area, surrounded
+        by other_ways ways of two other departments, return the number of
+        ways of the area"""
+        ways = self.streets if ways is None else ways
+        departments = [(u"%03d" % (int(self.area_code) - 1), other_ways // 2, self.streets),
+                       (self.area_code, ways, 0),
+                       (u"%03d" % (int(self.area_code) + 1), other_ways - other_ways // 2, self.streets)]
+        with io.open(fantoir_file, "wb", buffering=1 << 20) as f:
+            f.write(self.fantoir_line(u"          Ligne d'en-tete"))
+            for department, count, first in departments:
+                f.write(self.fantoir_line(u"%s        DIRECTION DEPARTEMENTALE %s" % (department, department)))
+                communes = [u"%s" % locality[0][-3:] for locality in self.localities]
+                for c, commune in enumerate(communes):
+                    f.write(self.fantoir_line(u"%s%s    COMMUNE %s" % (department, commune, commune)))
+                    # the ways of the c-th commune are the ways i such that i % len(communes) == c
+                    for n, i in enumerate(range(c, count, len(communes))):
+                        way_type, _, name = self.way(first + i)
+                        reference = u"%s%s%04d%s" % (department, commune, n % 10000, self.RIVOLI_KEYS[(n // 10000) % len(self.RIVOLI_KEYS)])
+                        f.write(self.fantoir_line(u"%s%-4s%-26s" % (reference, way_type, name)))
+        return ways
+
+    def write_postcodes(self, postcode_file, other_localities=2000):
+        """Write a La Poste file of the localities of the area and of
+        other_localities localities out of the area"""
+        rand = random.Random(self.seed)
+        with io.open(postcode_file, "w", encoding="utf-8") as f:
+            f.write(u"Code_commune_INSEE,Nom_commune,Code_postal,Libelle_acheminement,Ligne_5,coordonnees_gps\n")
+            for insee, name, postcode, lat, lon in self.localities:
+                f.write(u'%s,%s,%d,%s,,"%s,%s"\n' % (insee, name, postcode, name, lat, lon))
+            for i in range(other_localities):
+                department = 1 + i * 95 // max(1, other_localities)
+                name = u"COMMUNE %d" % (i + 1)
+                position = u'"%.4f,%.4f"' % (rand.uniform(42.0, 51.0), rand.uniform(-4.5, 8.0)) if i % 10 else u""
+                f.write(u'%02d%03d,%s,%02d%03d,%s,%s,%s\n' % (department, i % 1000, name, department, i % 1000, name,
+                                                            u"LIEU DIT %d" % i if i % 7 == 0 else u"", position))
+        return len(self.localities) + other_localities
+
+def parse_tag_mix(value):
+    """Parse a <KEY>=<PROBABILITY>,... tag mix"""
+    tag_mix = OrderedDict()
+    for item in value.split(","):
+        key, probability = item.rsplit("=", 1)
+        tag_mix[key] = float(probability)
+    return tag_mix
+
+def usage():
+    print('synthetic.py -o <OSM FILE> -e <ELEMENTS> [-f <FANTOIR FILE> -w <WAYS>] [-p <POSTCODE FILE>] [-n <STREETS>] [-b <BAD SHARE>] [-s <SEED>] [-t <KEY>=<PROBABILITY>,...] [-y <WAY TYPES FILE>]')
+
+def main(argv):
+    osm_file = None
+    elements = 10000
+    fantoir_file = None
+    ways = None
+    postcode_file = None
+    streets = 2000
+    bad_share = 0.1
+    seed = 974
+    tag_mix = None
+    way_types_file = "data/FANTOIR1016-WAY-TYPE.csv"
+
+    try:
+        opts, args = getopt.getopt(argv,"ho:e:f:w:p:n:b:s:t:y:",["osm=", "elements=", "fantoir=", "ways=", "postcodes=",
+                                                                "streets=", "bad=", "seed=", "tags=", "waytypes="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-o", "--osm"):
+             osm_file = arg
+        elif opt in ("-e", "--elements"):
+             elements = int(arg)
+        elif opt in ("-f", "--fantoir"):
+             fantoir_file = arg
+        elif opt in ("-w", "--ways"):
+             ways = int(arg)
+        elif opt in ("-p", "--postcodes"):
+             postcode_file = arg
+        elif opt in ("-n", "--streets"):
+             streets = int(arg)
+        elif opt in ("-b", "--bad"):
+             bad_share = float(arg)
+        elif opt in ("-s", "--seed"):
+             seed = int(arg)
+        elif opt in ("-t", "--tags"):
+             tag_mix = parse_tag_mix(arg)
+        elif opt in ("-y", "--waytypes"):
+             way_types_file = arg
+        else:
+            print("unhandled option")
+            sys.exit(2)
+
+    if osm_file is None and fantoir_file is None and postcode_file is None:
+        print("You need to supply at least one of -o, -f and -p")
+        sys.exit(2)
+
+    synthetic = Synthetic(seed, bad_share, tag_mix, streets, way_types_file)
+    results = {}
+    if osm_file is not None and osm_file.endswith(".pbf"):
+        results["osm"] = synthetic.write_pbf(osm_file, elements)
+    elif osm_file is not None:
+        results["osm"] = synthetic.write_osm(osm_file, elements)
+    if fantoir_file is not None:
+        results["fantoir"] = synthetic.write_fantoir(fantoir_file, ways)
+    if postcode_file is not None:
+        results["postcodes"] = synthetic.write_postcodes(postcode_file)
+    pprint.pprint(results)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
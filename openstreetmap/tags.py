@@ -4,10 +4,13 @@
 """ Various tests to assess quality of different tags
 """
 
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import os, sys, re, getopt, pprint
 
+from reader import OSMReader
+from cache import ResultCache
+from metrics import Metrics, MeteredReader, stage
+
 class TagChecker(object):
     
     """
@@ -18,36 +21,63 @@ class TagChecker(object):
     LOWER_RE = re.compile(r'^([a-z]|_)*$')
     LOWER_COLON_RE = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
     PROBLEM_CHARS_RE = re.compile(r'^.*?[=\+/&\<\>;\'"\?%#$@\,\. \t\r\n].*?$')
+
+    def __init__(self, reader=None):
+        self.reader = OSMReader() if reader is None else reader
     
-    def list(self, element, keys):
-        if element.tag == "tag":
-            key = element.attrib['k']
-            if self.LOWER_COLON_RE.match(key):
-                keys["lower_colon"] = keys["lower_colon"] + 1
-            elif self.LOWER_RE.match(key):
-                keys["lower"] = keys["lower"] + 1
-            elif not self.PROBLEM_CHARS_RE.match(key):
-                keys["problemchars"] = keys["problemchars"] + 1
-            else:  
-                keys["other"] = keys["other"] + 1
+    def list(self, key, keys):
+        """Count the class of one tag key"""
+        if self.LOWER_COLON_RE.match(key):
+            keys["lower_colon"] = keys["lower_colon"] + 1
+        elif self.LOWER_RE.match(key):
+            keys["lower"] = keys["lower"] + 1
+        elif not self.PROBLEM_CHARS_RE.match(key):
+            keys["problemchars"] = keys["problemchars"] + 1
+        else:  
+            keys["other"] = keys["other"] + 1
 
         return keys
 
-    def summary(self, osm_file):
-        keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
-        for _, element in ET.iterparse(osm_file):
-            keys = self.list(element, keys)
+    def init_summary(self):
+        return {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+
+    def list_element(self, element, keys):
+        """Classify all tags of one top level element (node, way or relation)"""
+        for key, _ in element.tags:
+            keys = self.list(key, keys)
 
         return keys
 
+    def summary(self, osm_file, cache=None):
+        """Number of tag keys per class, looked up in cache (a cache.ResultCache) first"""
+        if cache is not None:
+            key = cache.key("tags", cache.fingerprint(osm_file), self.signature())
+            return cache.get_or_compute(key, lambda: self.summary(osm_file))
+
+        keys = self.init_summary()
+        for element in self.reader.elements(osm_file):
+            keys = self.list_element(element, keys)
+
+        return keys
+
+    def signature(self):
+        return (self.LOWER_RE.pattern, self.LOWER_COLON_RE.pattern, self.PROBLEM_CHARS_RE.pattern)
+
 def usage():
-    print('tags.py -o <OSM FILE>')
+    print('tags.py -o <OSM FILE> [-c <CACHE FOLDER> -s <CACHE SIZE (MB)>] [-z <thread|process>]')
+    print('        [--profile] [--metrics-out <METRICS FILE>]')
 
 def main(argv):
     osm_file = None
+    cache_folder = None
+    cache_size = ResultCache.MAX_SIZE
+    decompress = None
+    profile = False
+    metrics_file = None
     
     try:
-        opts, args = getopt.getopt(argv,"ho:",["osm="])
+        opts, args = getopt.getopt(argv,"ho:c:s:z:",["osm=", "cache=", "cachesize=", "decompress=",
+                                                     "profile", "metrics-out="])
     except getopt.GetoptError as err:
         print str(err)
         usage()
@@ -58,6 +88,16 @@ def main(argv):
             sys.exit()
         elif opt in ("-o", "--osm"):
              osm_file = arg
+        elif opt in ("-c", "--cache"):
+             cache_folder = arg
+        elif opt in ("-s", "--cachesize"):
+             cache_size = int(arg) << 20
+        elif opt in ("-z", "--decompress"):
+             decompress = arg
+        elif opt == "--profile":
+             profile = True
+        elif opt == "--metrics-out":
+             metrics_file = arg
         else:
             print("unhandled option")
             sys.exit(2)
@@ -66,7 +106,18 @@ def main(argv):
         print("You need to supply -o")        
         sys.exit(2)
 
-    pprint.pprint(TagChecker().summary(osm_file=osm_file))
+    metrics = Metrics() if profile or metrics_file is not None else None
+    reader = OSMReader(decompress)
+    cache = None if cache_folder is None else ResultCache(cache_folder, cache_size)
+    if metrics is not None:
+        reader = MeteredReader(reader, metrics)
+        if cache is not None:
+            metrics.watch("results", cache)
+
+    with stage(metrics, "summary"):
+        pprint.pprint(TagChecker(reader).summary(osm_file=osm_file, cache=cache))
+    if metrics is not None:
+        metrics.write(metrics_file)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
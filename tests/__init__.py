@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""Unit tests (python -m unittest discover -s tests -t . from the repository
+root, data/FANTOIR1016-WAY-TYPE.csv and data/rules.csv being read from there)"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "openstreetmap"))
+
+def synthetic_bundle(folder, synthetic=None):
+    """Write the synthetic FANTOIR and La Poste files into folder and return
+    their loaded reference bundle"""
+    import reference
+    from synthetic import Synthetic
+    synthetic = Synthetic() if synthetic is None else synthetic
+    fantoir_file = os.path.join(folder, "FANTOIR")
+    postcode_file = os.path.join(folder, "laposte_hexasmal.csv")
+    synthetic.write_fantoir(fantoir_file)
+    synthetic.write_postcodes(postcode_file)
+    return reference.ReferenceBundle(fantoir_file, synthetic.area_code, postcode_file,
+                                     "data/FANTOIR1016-WAY-TYPE.csv").load()
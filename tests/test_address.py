@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import unittest
+
+from address import StreetParser, HouseNumberParser, housenumber_expression, corpus
+from data_gouv_fr import fantoir
+import reference
+
+WAY_TYPES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "way-types.csv")
+
+HOUSE_NUMBERS = [u"12", u"12 bis", u"12 ter 3", u"12,14", u"Appt 12,13", u"BP 12", u"B.P. 12", u"b.p 1 2",
+                 u"bat A", u"bat A appt 1,2", u"12A", u"12 bis appt 1,2", u"12 bis A", u"bis", u"bp",
+                 u" 12 ", u"12\n", u"12-14", u"n°12", u"#12", u"12 / 13", u"12,#14", u"Appt 12-13", u"é"]
+
+class DifferentialTest(unittest.TestCase):
+    """The parsers give the same results as the regular expressions they
+    replace (address.py docstring) on a corpus built from fixed way types"""
+
+    @classmethod
+    def setUpClass(cls):
+        way_types = fantoir.FANTOIR().way_types(WAY_TYPES_FILE)
+        cls.street_re = re.compile(reference.street_expression(way_types.TYPE.values, way_types.TYPE_NAME.values),
+                                   re.IGNORECASE)
+        cls.housenumber_re = re.compile(housenumber_expression(), re.IGNORECASE)
+        # the audit checks whole values (surrounding spaces excepted)
+        cls.housenumber_fullmatch = re.compile(r"(?:%s)$" % housenumber_expression(), re.IGNORECASE)
+        alternatives = reference.street_alternatives(way_types.TYPE.values, way_types.TYPE_NAME.values)
+        cls.street_parser = StreetParser(alternatives)
+        cls.housenumber_parser = HouseNumberParser()
+        values = corpus(alternatives, 5000) + HOUSE_NUMBERS
+        cls.values = values + [value.encode("utf-8") for value in values]
+
+    def test_street_names(self):
+        for value in self.values:
+            m = self.street_re.search(value)
+            expected = None if m is None else m.group("housenumber", "type", "name")
+            self.assertEqual(self.street_parser.parse(value), expected, repr(value))
+
+    def test_house_number_match(self):
+        for value in self.values:
+            self.assertEqual(self.housenumber_parser.match(value), self.housenumber_re.match(value).group("housenumber"),
+                             repr(value))
+
+    def test_house_number_is_valid(self):
+        for value in self.values:
+            self.assertEqual(self.housenumber_parser.is_valid(value),
+                             self.housenumber_fullmatch.match(value.strip()) is not None, repr(value))
+
+    def test_decisions(self):
+        # the audit splits the values on commas first, except Appt lists
+        self.assertEqual([value for value in HOUSE_NUMBERS if not self.housenumber_parser.is_valid(value)],
+                         [u"12,14", u"12-14", u"n°12", u"#12", u"12 / 13", u"12,#14", u"Appt 12-13", u"é"])
+
+if __name__ == "__main__":
+    unittest.main()
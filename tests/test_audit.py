@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+import unittest
+
+from audit import Audit
+
+class HouseNumberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.auditor = Audit(street_alternatives=["RUE", "CHEMIN", "place"])
+
+    def findings(self, values):
+        house_numbers = defaultdict(set)
+        for value in values:
+            self.auditor.audit_house_number(house_numbers, value)
+        return sorted(house_numbers)
+
+    def test_valid_house_numbers(self):
+        self.assertEqual(self.findings([u"12", u"12 bis", u"12 ter 3", u"12,14", u"Appt 12,13",
+                                        u"BP 12", u"B.P. 12", u"bat A", u"12A", u"12 bis appt 1,2"]), [])
+
+    def test_invalid_house_numbers(self):
+        values = [u"12-14", u"n°12", u"#12", u"12 / 13", u"12,#14", u"Appt 12-13"]
+        self.assertEqual(self.findings(values + [u"12"]), sorted(values))
+
+    def test_byte_strings(self):
+        self.assertEqual(self.findings([b"12 bis", b"n\xb012"]), [b"n\xb012"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from audit import Audit
+from cache import ResultCache
+from synthetic import Synthetic
+from tags import TagChecker
+from tests import synthetic_bundle
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.folder, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_or_compute(self):
+        calls = []
+        def compute():
+            calls.append(1)
+            return { "lower": 1 }
+        key = self.cache.key("tags", "sha1", ("re",))
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(self.cache.get_or_compute(key, compute), { "lower": 1 })
+        self.assertEqual(ResultCache(self.cache.folder).get_or_compute(key, compute), { "lower": 1 })
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        self.assertNotEqual(self.cache.key("tags", "sha1", ("other",)), key)
+
+    def test_corrupted_entry(self):
+        key = self.cache.key("corrupted")
+        with io.open(self.cache.path(key), "wb") as f:
+            f.write(b"not compressed")
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(self.cache.get_or_compute(key, lambda: [1]), [1])
+        self.assertEqual(self.cache.get(key), [1])
+
+    def test_evict(self):
+        value = os.urandom(1000) # not compressible
+        keys = [self.cache.key(i) for i in range(4)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, value)
+            os.utime(self.cache.path(key), (i, i))
+        # least recently used first, a hit makes the entry the most recent one
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.cache.max_size = 2500
+        self.assertEqual(self.cache.evict(), 2)
+        self.assertEqual(sorted(os.path.basename(path) for _, _, path in self.cache.entries()),
+                         sorted(os.path.basename(self.cache.path(key)) for key in [keys[0], keys[3]]))
+        self.cache.clear()
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_fingerprint(self):
+        path = os.path.join(self.folder, "data.osm")
+        with io.open(path, "wb") as f:
+            f.write(b"<osm/>")
+        sha1 = self.cache.fingerprint(path)
+        self.assertEqual(ResultCache(self.cache.folder).fingerprint(path), sha1)
+        with io.open(path, "wb") as f:
+            f.write(b"<osm></osm>")
+        self.assertNotEqual(self.cache.fingerprint(path), sha1)
+
+class CachedRunTest(unittest.TestCase):
+    """A cached run returns the results of a full run"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        synthetic = Synthetic(bad_share=0.3)
+        synthetic.write_osm(cls.osm_file, 2000)
+        cls.bundle = synthetic_bundle(cls.folder, synthetic)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def test_tags(self):
+        cache = ResultCache(os.path.join(self.folder, "tags"))
+        expected = TagChecker().summary(self.osm_file)
+        self.assertEqual(TagChecker().summary(self.osm_file, cache), expected)
+        self.assertEqual(TagChecker().summary(self.osm_file, cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_audit(self):
+        cache = ResultCache(os.path.join(self.folder, "audit"))
+        auditor = Audit(self.bundle["street_alternatives"])
+        expected = auditor.audit_way_node(self.osm_file, auditor.references(bundle=self.bundle))
+        self.assertEqual(auditor.cached_audit_way_node(self.osm_file, self.bundle, cache=cache), expected)
+        self.assertEqual(auditor.cached_audit_way_node(self.osm_file, self.bundle, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        results, occurrences = auditor.cached_audit_distinct(self.osm_file, self.bundle, cache=cache)
+        self.assertEqual(results, expected)
+        self.assertEqual(cache.misses, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from columnar import ColumnarWriter, ColumnarReader
+from reader import OSMReader
+from shape import Shape
+from spatial import GridIndex
+from synthetic import Synthetic
+
+class ColumnarTest(unittest.TestCase):
+    """The columnar export holds the nodes, ways and shaped tags of the OSM file"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        Synthetic(bad_share=0.3).write_osm(cls.osm_file, 3000)
+        cls.mappings = dict((f, {}) for f in Shape.MAPPING_FILES)
+        cls.elements = list(OSMReader().elements(cls.osm_file, tags=["node", "way"]))
+        cls.export = os.path.join(cls.folder, "columnar")
+        cls.counts = Shape().export_columnar(cls.osm_file, cls.mappings, cls.export)
+        cls.reader = ColumnarReader(cls.export)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def of_type(self, tag):
+        return [element for element in self.elements if element.tag == tag]
+
+    def test_counts(self):
+        self.assertEqual(self.counts, { "node": len(self.of_type("node")), "way": len(self.of_type("way")) })
+        self.assertEqual(self.reader.manifest["counts"]["nodes"], self.counts["node"])
+        self.assertEqual(self.reader.manifest["counts"]["refs"], sum(len(way.refs) for way in self.of_type("way")))
+
+    def test_nodes(self):
+        nodes = self.reader.nodes()
+        expected = self.of_type("node")
+        self.assertEqual(list(nodes["id"]), [int(node.attrib["id"]) for node in expected])
+        self.assertEqual(list(nodes["lat"]), [float(node.attrib["lat"]) for node in expected])
+        self.assertEqual(list(nodes["lon"]), [float(node.attrib["lon"]) for node in expected])
+        self.assertEqual(list(nodes["version"]), [int(node.attrib["version"]) for node in expected])
+        self.assertEqual(list(nodes["user"]), [node.attrib["user"] for node in expected])
+        self.assertEqual(list(nodes["changeset"]), [int(node.attrib["changeset"]) for node in expected])
+        self.assertEqual([str(t)[:19] for t in nodes["timestamp"]],
+                         [node.attrib["timestamp"][:-1].replace("T", " ") for node in expected])
+
+    def test_ways(self):
+        ways = self.reader.ways()
+        expected = self.of_type("way")
+        self.assertEqual(list(ways["id"]), [int(way.attrib["id"]) for way in expected])
+        self.assertEqual(list(ways["refs"]), [len(way.refs) for way in expected])
+        for row in [0, len(expected) // 2, len(expected) - 1]:
+            self.assertEqual(list(self.reader.refs(row)), [int(ref) for ref in expected[row].refs])
+
+    def test_tags(self):
+        for element, tag in [(ColumnarWriter.NODE, "node"), (ColumnarWriter.WAY, "way")]:
+            tags = self.reader.tags(element)
+            expected = sorted((row, key, value) for row, el in enumerate(self.of_type(tag))
+                              for key, value in Shape().shape_tags(el, self.mappings))
+            self.assertEqual(sorted(zip(tags["row"], tags["key"], tags["value"])), expected)
+            self.assertGreater(len(expected), 0)
+
+    def test_spatial_index(self):
+        index = GridIndex.from_columnar(self.reader)
+        nodes = self.of_type("node")
+        row = index.nearest(float(nodes[10].attrib["lat"]), float(nodes[10].attrib["lon"]))[0][0]
+        self.assertEqual(self.reader.nodes()["id"][row], int(nodes[10].attrib["id"]))
+
+    def test_in_memory(self):
+        reader = ColumnarReader(self.export, mmap_mode=None)
+        self.assertFalse(isinstance(reader.array("nodes.id"), np.memmap))
+        self.assertTrue(isinstance(self.reader.array("nodes.id"), np.memmap))
+
+    def test_version(self):
+        folder = os.path.join(self.folder, "other")
+        with ColumnarWriter(folder) as writer:
+            writer.write_node({ "id": "1", "lat": "1.5", "lon": "2.5" }, [(u"name", u"É")])
+        self.assertEqual(ColumnarReader(folder).strings("values"), [u"É"])
+        manifest_file = os.path.join(folder, "manifest.json")
+        with io.open(manifest_file, "rb") as f:
+            manifest = json.loads(f.read())
+        manifest["version"] = ColumnarWriter.VERSION + 1
+        with io.open(manifest_file, "wb") as f:
+            f.write(json.dumps(manifest))
+        self.assertRaises(ValueError, ColumnarReader, folder)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmark import MemoryCollection
+from compact import CompactDocument, StringTable, to_dict
+from shape import Shape, MongoWriter
+from synthetic import Synthetic
+
+NODE = { "type": "node", "id": "42",
+         "created": { "user": u"Jean", "uid": "7", "timestamp": "2016-01-01T00:00:00Z" },
+         "pos": [-21.3, 55.6], "name": u"Saint-Joseph",
+         "address": { "street": u"Rue des Lilas", "housenumber": "12" } }
+WAY = { "type": "way", "id": "0123", "highway": "residential", "node_refs": ["1", "2", "30"] }
+
+def documents(collection):
+    return [dict((key, value) for key, value in document.items() if key != "_id")
+            for document in collection.documents]
+
+class CompactDocumentTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        strings = StringTable()
+        for document in [NODE, WAY, { "type": "node", "id": "1", "address": u"12 rue des Lilas" }]:
+            self.assertEqual(CompactDocument.pack(document, strings).to_dict(), document)
+
+    def test_shared_strings(self):
+        strings = StringTable()
+        a = CompactDocument.pack(NODE, strings)
+        b = CompactDocument.pack(dict(NODE, created=dict(NODE["created"])), strings)
+        self.assertIs(a.created[a.created.index("user") + 1], b.created[b.created.index("user") + 1])
+
+    def test_mapping(self):
+        doc = CompactDocument.pack(NODE, StringTable())
+        self.assertEqual(doc["id"], "42")
+        self.assertEqual(doc["type"], "node")
+        self.assertEqual(doc["name"], u"Saint-Joseph")
+        self.assertEqual(doc["address"], NODE["address"])
+        self.assertEqual(doc["pos"], [-21.3, 55.6])
+        self.assertEqual(doc.get("node_refs"), None)
+        self.assertEqual(doc.get("highway", "none"), "none")
+        self.assertRaises(KeyError, lambda: doc["highway"])
+        self.assertIn("created", doc)
+        self.assertNotIn("node_refs", doc)
+        self.assertEqual(sorted(doc), sorted(NODE))
+        self.assertEqual(len(doc), len(NODE))
+        self.assertEqual(dict(doc.items()), NODE)
+        way = CompactDocument.pack(WAY, StringTable())
+        self.assertEqual(way["id"], "0123")
+        self.assertEqual(way["node_refs"], ["1", "2", "30"])
+
+    def test_read_only(self):
+        doc = CompactDocument.pack(NODE, StringTable())
+        doc["address"]["street"] = u"Chemin"
+        self.assertEqual(doc["address"]["street"], u"Rue des Lilas")
+        def set_id():
+            doc["id"] = "1"
+        self.assertRaises(TypeError, set_id)
+
+class MongoWriterTest(unittest.TestCase):
+
+    def test_batches(self):
+        collection = MemoryCollection()
+        with MongoWriter(collection, batch_size=2) as writer:
+            writer.write(NODE)
+            self.assertEqual(len(writer.batch), 1)
+            self.assertGreater(len(writer.strings), 0)
+            writer.write(WAY)
+            # the strings of a batch are released with it
+            self.assertEqual(len(writer.batch), 0)
+            self.assertEqual(len(writer.strings), 0)
+            writer.write(WAY)
+        self.assertEqual(documents(collection), [NODE, WAY, WAY])
+        self.assertEqual(collection.indexes, MongoWriter.INDEXES)
+        self.assertEqual(writer.inserted, 3)
+
+class ShapeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        Synthetic(bad_share=0.3).write_osm(cls.osm_file, 2000)
+        cls.mappings = dict((f, {}) for f in Shape.MAPPING_FILES)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def test_shape_documents(self):
+        expected = list(Shape().iter_shape(self.osm_file, self.mappings))
+        data = Shape().shape(self.osm_file, self.mappings)
+        self.assertEqual([to_dict(doc) for doc in data], expected)
+        self.assertEqual([doc["id"] for doc in data], [doc["id"] for doc in expected])
+        self.assertEqual([doc.get("address") for doc in data], [doc.get("address") for doc in expected])
+
+    def test_load(self):
+        collection = MemoryCollection()
+        expected = list(Shape().iter_shape(self.osm_file, self.mappings))
+        counters, corrections = Shape().load(self.osm_file, self.mappings, collection, batch_size=100)
+        self.assertEqual(corrections, { "postcodes": 0, "cities": 0 })
+        self.assertEqual(documents(collection), expected)
+        self.assertEqual(sum(counters.values()), len(expected))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from data_gouv_fr.fantoir import FANTOIR
+from synthetic import Synthetic
+
+class ByteRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.fantoir_file = os.path.join(self.folder, "FANTOIR")
+        self.synthetic = Synthetic()
+        self.synthetic.write_fantoir(self.fantoir_file, 500)
+        with io.open(self.fantoir_file, "rb") as f:
+            self.lines = f.read().split(b"\n")
+        self.commune = "974" + self.synthetic.localities[3][0][-3:] # department and commune code
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_commune_range_within_department(self):
+        db = FANTOIR()
+        department = db.byte_range(self.fantoir_file, "974")
+        commune = db.byte_range(self.fantoir_file, self.commune)
+        self.assertTrue(department[0] <= commune[0] and commune[1] <= department[1])
+        self.assertLess(commune[1] - commune[0], department[1] - department[0])
+
+    def test_read_lines(self):
+        db = FANTOIR()
+        for code in ["974", self.commune, self.commune + "0001", "97", "9", "975", "999"]:
+            expected = [line for line in self.lines if line.startswith(code.encode("latin-1"))]
+            self.assertEqual(db.read_lines(self.fantoir_file, code), expected, code)
+
+    def test_unknown_code(self):
+        self.assertIsNone(FANTOIR().byte_range(self.fantoir_file, "999"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from incremental import Incremental
+from rules import RuleRegistry
+from shape import Shape
+from tests import synthetic_bundle
+
+HEADER = u'<?xml version="1.0" encoding="UTF-8"?>\n'
+NODES = {
+    1: u'<node id="1" version="1" changeset="1" timestamp="2016-01-01T00:00:00Z" user="a" uid="1" lat="-21.28" lon="55.41">'
+       u'<tag k="addr:city" v="Saint-Joseph"/><tag k="addr:postcode" v="97480"/></node>',
+    2: u'<node id="2" version="1" changeset="1" timestamp="2016-01-01T00:00:00Z" user="a" uid="1" lat="-21.29" lon="55.42">'
+       u'<tag k="addr:street" v="Rue des Lilas"/><tag k="addr:housenumber" v="12-14"/></node>',
+    3: u'<node id="3" version="1" changeset="1" timestamp="2016-01-01T00:00:00Z" user="a" uid="1" lat="-21.30" lon="55.43">'
+       u'<tag k="addr:postcode" v="97 400"/><tag k="addr:city" v="Petite Ile"/></node>',
+}
+MODIFIED = u'<node id="2" version="2" changeset="2" timestamp="2016-01-02T00:00:00Z" user="b" uid="2" lat="-21.29" lon="55.42">' \
+           u'<tag k="addr:street" v="Chemin Inconnu"/><tag k="addr:city" v="Petite Île"/></node>'
+CREATED = u'<node id="9" version="1" changeset="2" timestamp="2016-01-02T00:00:00Z" user="b" uid="2" lat="-21.31" lon="55.44">' \
+          u'<tag k="addr:postcode" v="75001"/><tag k="phone" v="0262 12"/></node>'
+WAY = u'<way id="1" version="1" changeset="1" timestamp="2016-01-01T00:00:00Z" user="a" uid="1">' \
+      u'<nd ref="1"/><nd ref="2"/><tag k="highway" v="residential"/><tag k="addr:street" v="Rue des Lilas"/></way>'
+
+def osm(elements):
+    return HEADER + u'<osm version="0.6">\n' + u"\n".join(elements) + u'\n</osm>\n'
+
+class IncrementalTest(unittest.TestCase):
+    """A full pass then a diff give the same findings and documents as a full
+    pass on the updated file"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bundle_folder = tempfile.mkdtemp()
+        cls.bundle = synthetic_bundle(cls.bundle_folder)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bundle_folder)
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mapping_folder = os.path.join(self.folder, "update")
+        os.mkdir(self.mapping_folder)
+        self.write("update/cities-update.csv", u"NEW,OLD\nPetite Ile,Petite Île\n")
+        self.write("base.osm", osm([NODES[1], NODES[2], NODES[3], WAY]))
+        self.write("updated.osm", osm([NODES[1], MODIFIED, WAY, CREATED]))
+        self.write("diff.osc", HEADER + u'<osmChange version="0.6">\n<create>%s</create>\n<modify>%s</modify>\n'
+                                        u'<delete>%s</delete>\n</osmChange>\n' % (CREATED, MODIFIED, NODES[3]))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, text):
+        with io.open(os.path.join(self.folder, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def incremental(self, name, shaper=None):
+        shaper = Shape() if shaper is None else shaper
+        return Incremental(os.path.join(self.folder, name), self.bundle, shaper.load_mappings(self.mapping_folder),
+                           shaper=shaper, mapping_folder=self.mapping_folder)
+
+    def lines(self, incremental):
+        with io.open(incremental.json_file, "rb") as f:
+            return sorted(f.read().splitlines())
+
+    def test_apply(self):
+        incremental = self.incremental("base.osm")
+        incremental.build()
+        self.assertEqual(incremental.apply(os.path.join(self.folder, "diff.osc")),
+                         { "create": 1, "modify": 1, "delete": 1 })
+        expected = self.incremental("updated.osm")
+        expected_state = expected.build()
+        state = incremental.load()
+        self.assertEqual(self.lines(incremental), self.lines(expected))
+        self.assertEqual(dict(state["audit"].counts), dict(expected_state["audit"].counts))
+        self.assertEqual(sorted(state["keys"]), sorted(expected_state["keys"]))
+        # the offsets still point at the line of each document
+        with io.open(incremental.json_file, "rb") as f:
+            data = f.read()
+        for key, start, end in zip(state["keys"], state["offsets"][:-1], state["offsets"][1:]):
+            self.assertIn(b'"id": "%d"' % (key // 2), data[start:end])
+        self.assertEqual(len(data), state["offsets"][-1])
+
+    def test_mappings_changed(self):
+        incremental = self.incremental("base.osm")
+        incremental.build()
+        self.write("update/cities-update.csv", u"NEW,OLD\nPetite Ile,PETITE ILE\n")
+        self.assertRaises(ValueError, self.incremental("base.osm").load)
+        self.write("update/cities-update.csv", u"NEW,OLD\nPetite Ile,Petite Île\n")
+        self.incremental("base.osm").load()
+        self.write("update/phones-update.csv", u"NEW,OLD\n0262 12,+262 12\n")
+        self.assertRaises(ValueError, self.incremental("base.osm").apply, os.path.join(self.folder, "diff.osc"))
+
+    def test_rules_changed(self):
+        incremental = self.incremental("base.osm")
+        incremental.build()
+        with io.open("data/rules.csv", "rb") as f:
+            rules = f.read()
+        rules_file = os.path.join(self.folder, "rules.csv")
+        with io.open(rules_file, "wb") as f:
+            f.write(rules.replace(b"^(974[0-9]{2})$", b"^(97[0-9]{3})$"))
+        self.assertRaises(ValueError, self.incremental("base.osm", Shape(RuleRegistry(rules_file))).load)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from locations import NodeLocationWriter, NodeLocations, write_ways, length, centroid
+from pipeline import Pipeline, TagStage, LocationStage
+from synthetic import Synthetic
+
+class NodeLocationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "nodes")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_unsorted_nodes(self):
+        rand = np.random.RandomState(974)
+        ids = rand.permutation(np.arange(1, 2001) * 3)
+        with NodeLocationWriter(self.path, chunk_size=128) as writer:
+            for node_id in ids:
+                writer.add({ "id": str(node_id), "lat": str(node_id / 1e4), "lon": str(-node_id / 1e4) })
+            writer.add({ "id": "7" }) # no location (deleted node)
+            self.assertFalse(writer.sorted)
+        locations = NodeLocations(self.path)
+        self.assertEqual(list(locations.ids), sorted(ids))
+        self.assertTrue(np.allclose(locations.coords[:, 0], locations.ids / 1e4))
+        coords = locations.locate([6, 7, 6000, 6003, 1])
+        self.assertTrue(np.allclose(coords[[0, 2]], [[6 / 1e4, -6 / 1e4], [0.6, -0.6]]))
+        self.assertTrue(np.isnan(coords[[1, 3, 4]]).all())
+        self.assertFalse([name for name in os.listdir(self.folder) if name.endswith((".tmp", ".tmp2"))])
+
+    def test_empty(self):
+        with NodeLocationWriter(self.path):
+            pass
+        locations = NodeLocations(self.path)
+        self.assertEqual(len(locations), 0)
+        self.assertTrue(np.isnan(locations.locate([1, 2])).all())
+
+    def test_length_and_centroid(self):
+        square = np.array([[0.0, 0.0], [0.0, 1.0], [1.0, 1.0], [1.0, 0.0], [0.0, 0.0]])
+        self.assertAlmostEqual(length(square[:2]), 111195, delta=1)
+        self.assertAlmostEqual(length(np.array([[0.0, 0.0], [np.nan, np.nan], [1.0, 0.0]])), 111195, delta=1)
+        self.assertEqual(length(square[:1]), 0.0)
+        # the closing node of the square is counted once
+        self.assertEqual(list(centroid(square)), [0.5, 0.5])
+        self.assertIsNone(centroid(np.full((2, 2), np.nan)))
+
+class LocationStageTest(unittest.TestCase):
+    """The pipeline fills the same store as locations.py in its single pass
+    and writes the same ways"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        Synthetic().write_osm(cls.osm_file, 3000)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def ways(self):
+        with io.open("{0}.ways.csv".format(self.osm_file), "rb") as f:
+            return f.read()
+
+    def test_pipeline(self):
+        expected = NodeLocations.build(self.osm_file, os.path.join(self.folder, "built"), chunk_size=100)
+        expected_counters = write_ways(expected, self.osm_file)
+        expected_ways = self.ways()
+        os.remove("{0}.ways.csv".format(self.osm_file))
+
+        path = os.path.join(self.folder, "pipeline")
+        report = Pipeline([TagStage(), LocationStage(path, self.osm_file, chunk_size=100)]).run(self.osm_file)
+        locations = NodeLocations(path)
+        self.assertEqual(len(locations), len(expected))
+        self.assertGreater(len(locations), 0)
+        self.assertTrue((locations.ids == expected.ids).all())
+        self.assertTrue((locations.coords == expected.coords).all())
+        self.assertEqual(self.ways(), expected_ways)
+        self.assertEqual(report["locations"], dict(expected_counters, nodes=len(expected),
+                                                   file="{0}.ways.csv".format(self.osm_file)))
+        self.assertGreater(report["locations"]["ways"], 0)
+        self.assertIn("tags", report)
+        self.assertFalse([name for name in os.listdir(self.folder) if name.endswith((".tmp", ".tmp2"))])
+
+    def test_way_batches(self):
+        locations = NodeLocations.build(self.osm_file, os.path.join(self.folder, "batches"))
+        ways = list(locations.ways(self.osm_file))
+        batches = list(locations.ways(self.osm_file, batch_size=7))
+        self.assertEqual([way_id for way_id, _ in batches], [way_id for way_id, _ in ways])
+        self.assertTrue(all(np.allclose(a, b, equal_nan=True) for (_, a), (_, b) in zip(batches, ways)))
+        self.assertTrue(all(len(coords) >= 2 for _, coords in ways))
+
+if __name__ == "__main__":
+    unittest.main()
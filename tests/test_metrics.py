@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from audit import Audit
+from metrics import Metrics, MeteredReader
+from reader import OSMReader
+from synthetic import Synthetic
+from tests import synthetic_bundle
+
+class ParallelMetricsTest(unittest.TestCase):
+    """The counters of the pool workers (-j) are merged in the metrics of the
+    parent: the same elements, tags, validator calls and cache lookups as
+    in one single process"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        synthetic = Synthetic(bad_share=0.3)
+        synthetic.write_osm(cls.osm_file, 5000)
+        cls.bundle = synthetic_bundle(cls.folder, synthetic)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def run_metered(self, jobs, distinct=False):
+        metrics = Metrics()
+        auditor = Audit(self.bundle["street_alternatives"], reader=MeteredReader(OSMReader(), metrics), metrics=metrics)
+        references = auditor.references(bundle=self.bundle)
+        if distinct:
+            results = auditor.count_values(self.osm_file, references, jobs)
+        else:
+            results = auditor.audit_way_node(self.osm_file, references, jobs)
+        return results, metrics.report()
+
+    def lookups(self, report):
+        return dict((name, cache["hits"] + cache["misses"]) for name, cache in report["caches"].items())
+
+    def assertSameCounters(self, report, expected):
+        self.assertEqual(report["elements"]["by_type"], expected["elements"]["by_type"])
+        self.assertEqual(report["elements"]["tags_by_key"], expected["elements"]["tags_by_key"])
+        self.assertEqual(dict((name, timer["calls"]) for name, timer in report["timers"].items()),
+                         dict((name, timer["calls"]) for name, timer in expected["timers"].items()))
+        self.assertGreater(report["elements"]["per_second"], 0)
+        self.assertIsNotNone(report["first_element"])
+
+    def test_audit_way_node(self):
+        results, expected = self.run_metered(1)
+        other, report = self.run_metered(2)
+        self.assertEqual(other, results)
+        self.assertSameCounters(report, expected)
+        self.assertGreater(report["elements"]["total"], 0)
+        self.assertEqual(self.lookups(report)["housenumber_parser"], self.lookups(expected)["housenumber_parser"])
+        self.assertEqual(self.lookups(report)["street_parser"], self.lookups(expected)["street_parser"])
+
+    def test_count_values(self):
+        results, expected = self.run_metered(1, distinct=True)
+        other, report = self.run_metered(2, distinct=True)
+        self.assertEqual(other, results)
+        self.assertSameCounters(report, expected)
+
+    def test_counters_reset(self):
+        metrics = Metrics()
+        list(metrics.elements(OSMReader().elements(self.osm_file)))
+        counters = metrics.counters()
+        self.assertEqual(metrics.counters()["counts"], {})
+        merged = Metrics()
+        merged.merge(counters)
+        merged.merge(counters)
+        self.assertEqual(dict(merged.counts), dict((tag, 2 * count) for tag, count in counters["counts"].items()))
+
+if __name__ == "__main__":
+    unittest.main()
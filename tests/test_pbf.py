@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pbf import PBFReader, PBFWriter, encode_varint, encode_zigzag, varint, int64, zigzag
+from reader import OSMReader, Element
+from synthetic import Synthetic
+
+def records(elements):
+    return [(e.tag, dict(e.attrib), e.tags, e.refs, e.members) for e in elements]
+
+class PBFReaderTest(unittest.TestCase):
+    """The PBF file of the synthetic elements (two blocks of dense nodes) is
+    read as the same Element records as the OSM file"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        cls.pbf_file = os.path.join(cls.folder, "synthetic.osm.pbf")
+        synthetic = Synthetic(bad_share=0.3)
+        synthetic.write_osm(cls.osm_file, 10000)
+        synthetic.write_pbf(cls.pbf_file, 10000)
+        cls.expected = records(OSMReader().elements(cls.osm_file))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def test_elements(self):
+        self.assertEqual(records(PBFReader().elements(self.pbf_file)), self.expected)
+
+    def test_osm_reader(self):
+        self.assertEqual(records(OSMReader().elements(self.pbf_file)), self.expected)
+
+    def test_process_inflate(self):
+        self.assertEqual(records(PBFReader("process").elements(self.pbf_file)), self.expected)
+
+    def test_tags_and_keys(self):
+        keys = ["addr:street", "addr:city"]
+        self.assertEqual(records(PBFReader().elements(self.pbf_file, tags=["way"], keys=keys)),
+                         records(OSMReader().elements(self.osm_file, tags=["way"], keys=keys)))
+
+    def test_nodes(self):
+        """Nodes without dense nodes metadata, negative coordinates and ids"""
+        nodes = [Element("node", { "id": "-5", "lat": "-21.3779123", "lon": "55.6192000" }, [(u"name", u"Île")]),
+                 Element("node", { "id": "7", "lat": "0.0000001", "lon": "-179.9999999" })]
+        pbf_file = os.path.join(self.folder, "nodes.osm.pbf")
+        with PBFWriter(pbf_file) as writer:
+            for node in nodes:
+                writer.write(node)
+        self.assertEqual(records(PBFReader().elements(pbf_file)), records(nodes))
+
+class VarintTest(unittest.TestCase):
+
+    def test_varint(self):
+        for n in [0, 1, 127, 128, 300, 1 << 35, (1 << 63) - 1]:
+            self.assertEqual(varint(bytearray(encode_varint(n)), 0), (n, len(encode_varint(n))))
+        self.assertEqual(int64(varint(bytearray(encode_varint(-2)), 0)[0]), -2)
+
+    def test_zigzag(self):
+        for n in [0, -1, 1, -64, 64, -(1 << 40), 1 << 40]:
+            self.assertEqual(zigzag(encode_zigzag(n)), n)
+
+if __name__ == "__main__":
+    unittest.main()
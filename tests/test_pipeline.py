@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from audit import Audit
+from pipeline import Pipeline, Stage, TagStage, AuditStage, ShapeStage
+from shape import Shape
+from synthetic import Synthetic
+from tags import TagChecker
+from tests import synthetic_bundle
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "openstreetmap")
+
+def run_tool(folder, tool, args):
+    """Return the exit status, standard output and error of the command line tool run in folder"""
+    process = subprocess.Popen([sys.executable, os.path.join(SCRIPTS, "%s.py" % tool)] + args,
+                               cwd=folder, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return process.returncode, out, err
+
+def read(path):
+    with io.open(path, "rb") as f:
+        return f.read()
+
+class RecordStage(Stage):
+    name = "record"
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self):
+        self.calls.append("start")
+
+    def process(self, element):
+        self.calls.append(element.tag)
+
+    def result(self):
+        self.calls.append("result")
+        return len(self.calls)
+
+class PipelineTest(unittest.TestCase):
+    """One pass of the pipeline gives the same results and files as the
+    separate tags, audit and shape runs"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        synthetic = Synthetic(bad_share=0.3)
+        cls.counts = synthetic.write_osm(cls.osm_file, 3000)["elements"]
+        cls.bundle = synthetic_bundle(cls.folder, synthetic)
+        update_folder = os.path.join(cls.folder, "update")
+        os.mkdir(update_folder)
+        with io.open(os.path.join(update_folder, "cities-update.csv"), "w", encoding="utf-8") as f:
+            f.write(u"NEW,OLD\n%s,Commune de Saint-Joseph\n" % synthetic.localities[0][1].title())
+        cls.mappings = Shape().load_mappings(update_folder)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def mapping_folder(self, name):
+        folder = os.path.join(self.folder, name)
+        os.mkdir(folder)
+        return folder
+
+    def mapping_files(self, folder):
+        return dict((name, read(os.path.join(folder, name))) for name in os.listdir(folder))
+
+    def test_stages(self):
+        stage = RecordStage()
+        report = Pipeline([stage]).run(self.osm_file)
+        self.assertEqual(stage.calls[0], "start")
+        self.assertEqual(stage.calls[-1], "result")
+        self.assertEqual(report, { "record": sum(self.counts.values()) + 2 })
+        self.assertEqual(stage.calls[1:-1], ["node"] * self.counts["node"] + ["way"] * self.counts["way"] +
+                                            ["relation"] * self.counts["relation"])
+
+    def test_run(self):
+        auditor = Audit(self.bundle["street_alternatives"])
+        suggesters = auditor.suggesters(self.bundle)
+        audit_folder = self.mapping_folder("audit")
+        results = auditor.audit_way_node(self.osm_file, auditor.references(bundle=self.bundle))
+        expected_audit = auditor.summary(results, update_folder=audit_folder, init_mapping=True, suggesters=suggesters)
+        expected_counters, _ = Shape().export(self.osm_file, self.mappings)
+        expected_json = read("{0}.json".format(self.osm_file))
+
+        pipeline_folder = self.mapping_folder("pipeline")
+        file_out = os.path.join(self.folder, "pipeline.json")
+        auditor = Audit(self.bundle["street_alternatives"])
+        report = Pipeline([TagStage(),
+                           AuditStage(auditor.references(bundle=self.bundle), auditor=auditor,
+                                      update_folder=pipeline_folder, init_mapping=True, suggesters=suggesters),
+                           ShapeStage(file_out, self.mappings)]).run(self.osm_file)
+
+        self.assertEqual(report["tags"], TagChecker().summary(self.osm_file))
+        self.assertEqual(report["audit"], expected_audit)
+        self.assertGreater(sum(report["audit"].values()), 0)
+        self.assertEqual(self.mapping_files(pipeline_folder), self.mapping_files(audit_folder))
+        self.assertEqual(report["shape"], { "documents": sum(expected_counters.values()), "file": file_out })
+        self.assertEqual(read(file_out), expected_json)
+        self.assertIn(b"Commune de Saint-Joseph", expected_json)
+
+class PipelineToolTest(unittest.TestCase):
+    """pipeline.py auditing and shaping in one pass, the reference bundle and
+    the mappings being loaded in two background threads"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        os.mkdir(os.path.join(cls.folder, "data"))
+        os.mkdir(os.path.join(cls.folder, "audit"))
+        shutil.copy("data/FANTOIR1016-WAY-TYPE.csv", os.path.join(cls.folder, "data"))
+        shutil.copy("data/rules.csv", os.path.join(cls.folder, "data"))
+        synthetic = Synthetic(bad_share=0.3)
+        synthetic.write_osm(os.path.join(cls.folder, "data", "s.osm"), 2000)
+        synthetic.write_fantoir(os.path.join(cls.folder, "data", "FANTOIR"))
+        synthetic.write_postcodes(os.path.join(cls.folder, "data", "laposte_hexasmal.csv"))
+        cls.audit_args = ["-o", "data/s.osm", "-f", "data/FANTOIR", "-a", synthetic.area_code, "-u", "audit"]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def test_audit_and_mappings(self):
+        status, out, err = run_tool(self.folder, "audit", ["-i"] + self.audit_args)
+        self.assertEqual(status, 0, err)
+        # the bundle is read back from its pickle while pandas is imported
+        for _ in range(3):
+            status, out, err = run_tool(self.folder, "pipeline", self.audit_args + ["-m", "audit"])
+            self.assertEqual(status, 0, err)
+            self.assertNotIn(b"Traceback", err)
+            self.assertIn(b"'audit'", out)
+            self.assertIn(b"'shape'", out)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "data", "s.osm.json")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import io
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from data_gouv_fr.postalcode import PostalCode
+
+HEADER = u"Code_commune_INSEE,Nom_commune,Code_postal,Libelle_acheminement,Ligne_5,coordonnees_gps\n"
+
+class CompactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, rows):
+        postcode_file = os.path.join(self.folder, "laposte_hexasmal.csv")
+        with io.open(postcode_file, "w", encoding="utf-8") as f:
+            f.write(HEADER + u"".join(row + u"\n" for row in rows))
+        return postcode_file
+
+    def assertNoPosition(self, postcodes):
+        self.assertTrue(all(math.isnan(x) for x in postcodes.data.lat))
+        self.assertTrue(all(math.isnan(x) for x in postcodes.data.lon))
+        self.assertEqual(len(postcodes.positions()), 0)
+
+    def test_no_position_in_area(self):
+        postcode_file = self.write([u'97411,ST JOSEPH,97480,ST JOSEPH,,',
+                                    u'97416,ST PIERRE,97410,ST PIERRE,,',
+                                    u'01001,COMMUNE 1,01400,COMMUNE 1,,"46.15,4.92"'])
+        postcodes = PostalCode(postcode_file, area="974")
+        self.assertEqual(postcodes.cityByPostcode(), { 97480: "ST JOSEPH", 97410: "ST PIERRE" })
+        self.assertNoPosition(postcodes)
+
+    def test_no_position_in_file(self):
+        self.assertNoPosition(PostalCode(self.write([u'97411,ST JOSEPH,97480,ST JOSEPH,,'])))
+
+    def test_position_without_comma(self):
+        self.assertNoPosition(PostalCode(self.write([u'97411,ST JOSEPH,97480,ST JOSEPH,,-21.37'])))
+
+    def test_missing_positions(self):
+        postcode_file = self.write([u'97411,ST JOSEPH,97480,ST JOSEPH,,"-21.3779, 55.6192"',
+                                    u'97416,ST PIERRE,97410,ST PIERRE,,',
+                                    u'97422,LE TAMPON,97430,LE TAMPON,,"-21.2779,55.5177"'])
+        positions = PostalCode(postcode_file).positions()
+        self.assertEqual(list(positions.Code_postal), [97480, 97430])
+        self.assertEqual(list(positions.lat), [-21.3779, -21.2779])
+        self.assertEqual(list(positions.lon), [55.6192, 55.5177])
+
+if __name__ == "__main__":
+    unittest.main()
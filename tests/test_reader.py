@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from reader import OSMReader, RangeFile
+from synthetic import Synthetic
+
+def records(elements):
+    return [(e.tag, dict(e.attrib), e.tags, e.refs, e.members) for e in elements]
+
+class RangesTest(unittest.TestCase):
+    """The byte ranges of an OSM file (audit.py -j) hold all its top level
+    elements, each one once"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        Synthetic().write_osm(cls.osm_file, 5000)
+        with io.open(cls.osm_file, "rb") as f:
+            cls.data = f.read()
+        cls.expected = records(OSMReader().elements(cls.osm_file))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def write(self, data):
+        osm_file = os.path.join(self.folder, "test.osm")
+        with io.open(osm_file, "wb") as f:
+            f.write(data)
+        return osm_file
+
+    def elements(self, osm_file, count):
+        ranges = OSMReader().ranges(osm_file, count)
+        return ranges, [record for start, end in ranges
+                        for record in records(OSMReader().elements(RangeFile(osm_file, start, end)))]
+
+    def test_ranges(self):
+        for count in [1, 2, 7]:
+            ranges, elements = self.elements(self.osm_file, count)
+            self.assertEqual(len(ranges), count)
+            self.assertEqual(elements, self.expected)
+            self.assertEqual(ranges[-1][1], self.data.rindex(b"</osm>"))
+
+    def test_trailing_data(self):
+        # the closing tag further than one block from the end of the file
+        osm_file = self.write(self.data + b"\n" * (OSMReader.BLOCK_SIZE * 2 + 3))
+        ranges, elements = self.elements(osm_file, 3)
+        self.assertEqual(elements, self.expected)
+        self.assertEqual(ranges[-1][1], self.data.rindex(b"</osm>"))
+
+    def test_truncated_file(self):
+        osm_file = self.write(self.data[:self.data.rindex(b"</osm>") - 100])
+        self.assertRaises(ValueError, OSMReader().ranges, osm_file, 3)
+
+    def test_no_element(self):
+        osm_file = self.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n</osm>\n')
+        self.assertEqual(OSMReader().ranges(osm_file, 3), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from rules import Rule, RuleRegistry
+
+HEADER = u"KEY;CATEGORY;VALIDATOR;PATTERN;FIXER\n"
+
+class RuleRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def registry(self, rows):
+        rules_file = os.path.join(self.folder, "rules.csv")
+        with io.open(rules_file, "w", encoding="utf-8") as f:
+            f.write(HEADER + u"".join(row + u"\n" for row in rows))
+        return RuleRegistry(rules_file)
+
+    def test_default_rules(self):
+        registry = RuleRegistry()
+        postcode = registry.get("addr:postcode")
+        self.assertEqual((postcode.category, postcode.validator, postcode.fixer), ("house_postcodes", "postcode", "nospace"))
+        self.assertEqual(postcode.fix(u"97 480"), u"97480")
+        self.assertTrue(postcode.pattern.match(u"97480"))
+        self.assertFalse(postcode.pattern.match(u"75001"))
+        self.assertIsNone(registry.get("highway"))
+        self.assertEqual(set(rule.validator for rule in registry.validated()) - set(Rule.VALIDATORS), set())
+        self.assertIn("cities", registry.categories())
+
+    def test_mapped_only(self):
+        registry = self.registry([u"phone;phones;;;", u"ref:INSEE;ref_insees;regex;^974[0-9]{2}$;"])
+        phone = registry.get("phone")
+        self.assertIsNone(phone.validator)
+        self.assertIsNone(phone.pattern)
+        self.assertEqual(phone.fix(u"02 62"), u"02 62")
+        self.assertEqual([rule.key for rule in registry.validated()], ["ref:INSEE"])
+        self.assertEqual(registry.categories(), set(["phones", "ref_insees"]))
+
+    def test_unknown_validator_or_fixer(self):
+        self.assertRaises(ValueError, self.registry, [u"phone;phones;phone;;"])
+        self.assertRaises(ValueError, self.registry, [u"phone;phones;;;strip"])
+
+    def test_signature(self):
+        rows = [u"addr:postcode;house_postcodes;postcode;^(974[0-9]{2})$;nospace", u"phone;phones;;;"]
+        signature = self.registry(rows).signature()
+        self.assertEqual(self.registry(list(reversed(rows))).signature(), signature)
+        self.assertNotEqual(self.registry([rows[0].replace(u"974", u"97"), rows[1]]).signature(), signature)
+        self.assertNotEqual(self.registry([rows[0].replace(u"nospace", u""), rows[1]]).signature(), signature)
+        self.assertNotEqual(self.registry(rows[:1]).signature(), signature)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmark import MemoryCollection
+from compact import CompactDocument, StringTable
+from shape import Shape, JSONWriter, MongoWriter
+from synthetic import Synthetic
+
+DOCUMENTS = [{ "type": "node", "id": "1", "name": u"Église", "pos": [-21.3, 55.6] },
+             { "type": "way", "id": "2", "node_refs": ["1", "3"] },
+             { "type": "node", "id": "3", "address": { "street": u"Rue des Lilas" } }]
+
+class JSONWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_out = os.path.join(self.folder, "out.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read(self):
+        with io.open(self.file_out, "rb") as f:
+            return f.read()
+
+    def test_lines(self):
+        with JSONWriter(self.file_out, batch_size=2) as writer:
+            offsets = [writer.write(el) for el in DOCUMENTS]
+            self.assertEqual(len(writer.batch), 1)
+        data = self.read()
+        self.assertEqual([json.loads(line) for line in data.splitlines()], DOCUMENTS)
+        # each offset is the start of the line of the document
+        self.assertEqual(offsets, [0] + [data.index(b"\n", offset) + 1 for offset in offsets[:-1]])
+        self.assertEqual(writer.offset, len(data))
+        self.assertIn(u"Église".encode("utf-8"), data)
+
+    def test_compact_documents(self):
+        strings = StringTable()
+        with JSONWriter(self.file_out) as writer:
+            for el in DOCUMENTS:
+                writer.write(CompactDocument.pack(el, strings))
+        self.assertEqual([json.loads(line) for line in self.read().splitlines()], DOCUMENTS)
+
+    def test_write_bytes(self):
+        with JSONWriter(self.file_out) as writer:
+            writer.write(DOCUMENTS[0])
+            writer.write_bytes(b'{"id": "9"}\n')
+            self.assertEqual(writer.write(DOCUMENTS[1]), len(writer.line(DOCUMENTS[0])) + 1 + len(b'{"id": "9"}\n'))
+        self.assertEqual([json.loads(line)["id"] for line in self.read().splitlines()], ["1", "9", "2"])
+
+    def test_pretty(self):
+        with JSONWriter(self.file_out, pretty=True) as writer:
+            writer.write(DOCUMENTS[2])
+        self.assertEqual(json.loads(self.read()), DOCUMENTS[2])
+        self.assertIn(b'\n  "address"', self.read())
+
+    def test_unknown_serializer(self):
+        self.assertRaises(ValueError, JSONWriter, self.file_out, serializer="yaml")
+
+class MongoWriterTest(unittest.TestCase):
+
+    def collection(self):
+        collection = MemoryCollection()
+        with MongoWriter(collection) as writer:
+            writer.write({ "type": "node", "id": "1", "address": { "postcode": "97 480", "city": u"St Joseph" } })
+            writer.write({ "type": "node", "id": "2", "address": { "postcode": "97480", "city": u"Saint-Joseph" } })
+            writer.write({ "type": "node", "id": "3", "address": { "postcode": "97 410" } })
+            writer.write({ "type": "way", "id": "4", "address": { "postcode": "97 480" } })
+        return collection, writer
+
+    def addresses(self, collection):
+        return dict((doc["id"], doc["address"]) for doc in collection.documents)
+
+    def test_correct_postcodes(self):
+        collection, writer = self.collection()
+        self.assertEqual(writer.correct(), { "postcodes": 2, "cities": 0 })
+        self.assertEqual(self.addresses(collection),
+                         { "1": { "postcode": "97480", "city": u"St Joseph" },
+                           "2": { "postcode": "97480", "city": u"Saint-Joseph" },
+                           "3": { "postcode": "97410" },
+                           "4": { "postcode": "97 480" } })
+
+    def test_correct_cities(self):
+        collection, writer = self.collection()
+        self.assertEqual(writer.correct({ 97480: u"Saint-Joseph", 97410: u"Saint-Pierre" }),
+                         { "postcodes": 2, "cities": 2 })
+        self.assertEqual(self.addresses(collection)["1"], { "postcode": "97480", "city": u"Saint-Joseph" })
+        self.assertEqual(self.addresses(collection)["3"], { "postcode": "97410", "city": u"Saint-Pierre" })
+        self.assertEqual(self.addresses(collection)["4"], { "postcode": "97 480" })
+
+class ExportTest(unittest.TestCase):
+    """shape (documents in memory) and export (counters) write the documents
+    of iter_shape"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.osm_file = os.path.join(cls.folder, "synthetic.osm")
+        Synthetic(bad_share=0.3).write_osm(cls.osm_file, 2000)
+        cls.mappings = dict((f, {}) for f in Shape.MAPPING_FILES)
+        cls.documents = list(Shape().iter_shape(cls.osm_file, cls.mappings))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def lines(self):
+        with io.open("{0}.json".format(self.osm_file), "rb") as f:
+            return [json.loads(line) for line in f.read().splitlines()]
+
+    def test_export(self):
+        counters, sample = Shape().export(self.osm_file, self.mappings, sample_id="7")
+        self.assertEqual(self.lines(), json.loads(json.dumps(self.documents)))
+        self.assertEqual(counters, { "node": len([d for d in self.documents if d["type"] == "node"]),
+                                     "way": len([d for d in self.documents if d["type"] == "way"]) })
+        self.assertEqual(sample, [d for d in self.documents if d["id"] == "7"])
+        self.assertEqual(len(sample), 2)
+
+    def test_shape(self):
+        data = Shape().shape(self.osm_file, self.mappings)
+        self.assertEqual(len(data), len(self.documents))
+        self.assertEqual(self.lines(), json.loads(json.dumps(self.documents)))
+
+if __name__ == "__main__":
+    unittest.main()
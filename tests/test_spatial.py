@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from spatial import GridIndex, distance
+
+class DistanceTest(unittest.TestCase):
+
+    def test_distance(self):
+        # one degree of latitude, a quarter of the equator
+        self.assertAlmostEqual(float(distance(0.0, 0.0, 1.0, 0.0)), 111195, delta=1)
+        self.assertAlmostEqual(float(distance(0.0, 0.0, 0.0, 90.0)), 10007557, delta=1)
+        self.assertEqual(list(distance(-21.3, 55.6, np.array([-21.3]), np.array([55.6]))), [0.0])
+
+class GridIndexTest(unittest.TestCase):
+    """Queries of the grid give the same points as a scan of all points"""
+
+    @classmethod
+    def setUpClass(cls):
+        rand = np.random.RandomState(974)
+        cls.lat = rand.uniform(-21.39, -20.87, 5000)
+        cls.lon = rand.uniform(55.21, 55.84, 5000)
+        cls.index = GridIndex(cls.lat, cls.lon)
+        cls.queries = [(-21.3, 55.5), (-21.0, 55.3), (-20.87, 55.84), (-21.5, 55.0)]
+
+    def test_bbox(self):
+        for south, west, north, east in [(-21.3, 55.4, -21.2, 55.5), (-22.0, 55.0, -20.0, 56.0),
+                                         (-21.39, 55.21, -21.39, 55.21), (-20.0, 55.0, -19.0, 56.0)]:
+            expected = np.flatnonzero((self.lat >= south) & (self.lat <= north) &
+                                      (self.lon >= west) & (self.lon <= east))
+            self.assertEqual(list(self.index.bbox(south, west, north, east)), list(expected))
+
+    def test_radius(self):
+        for lat, lon in self.queries:
+            distances = distance(lat, lon, self.lat, self.lon)
+            indices, found = self.index.radius(lat, lon, 2000)
+            self.assertEqual(sorted(indices), list(np.flatnonzero(distances <= 2000)))
+            self.assertTrue((np.diff(found) >= 0).all())
+            self.assertTrue(np.allclose(found, distances[indices]))
+
+    def test_nearest(self):
+        for lat, lon in self.queries:
+            distances = distance(lat, lon, self.lat, self.lon)
+            indices, found = self.index.nearest(lat, lon, 5)
+            self.assertEqual(len(indices), 5)
+            self.assertTrue(np.allclose(found, np.sort(distances)[:5]))
+
+    def test_cell_size(self):
+        index = GridIndex(self.lat, self.lon, cell_size=0.001)
+        self.assertEqual(list(index.bbox(-21.3, 55.4, -21.2, 55.5)), list(self.index.bbox(-21.3, 55.4, -21.2, 55.5)))
+
+    def test_empty(self):
+        index = GridIndex([], [])
+        self.assertEqual(len(index.bbox(-90, -180, 90, 180)), 0)
+        self.assertEqual(len(index.radius(0, 0, 1000)[0]), 0)
+        self.assertEqual(len(index.nearest(0, 0, 3)[0]), 0)
+
+    def test_from_documents(self):
+        documents = [{ "id": "1", "pos": [-21.3, 55.5] }, { "id": "2" }, { "id": "3", "pos": [-21.0, 55.3] }]
+        index, indexed = GridIndex.from_documents(documents)
+        self.assertEqual([d["id"] for d in indexed], ["1", "3"])
+        self.assertEqual([indexed[i]["id"] for i in index.nearest(-21.01, 55.31)[0]], ["3"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from audit import Audit
+from suggest import Suggester
+
+class SuggesterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.suggester = Suggester([u"RUE DES LILAS", u"ALLEE DE VIVOI", u"IMPASSE DU PITON DUGAIN", u"ST JOSEPH", u"A"])
+
+    def test_suggestions(self):
+        self.assertEqual(self.suggester.suggest(u"Rue des Lilas"), (u"RUE DES LILAS", 1.0))
+        self.assertEqual(self.suggester.suggest(u"Saint-Joseph"), (u"ST JOSEPH", 1.0))
+        self.assertEqual(self.suggester.suggest(u"IMPASSE PITON DUGAIN")[0], u"IMPASSE DU PITON DUGAIN")
+        self.assertEqual(self.suggester.suggest(u"Chemin du Stade"), (None, 0.0))
+
+    def test_empty_values(self):
+        for value in [u"", u"-", u"?", u" ", u"--/..", b"-", u"°"]:
+            self.assertEqual(self.suggester.suggest(value), (None, 0.0))
+
+    def test_short_values(self):
+        self.assertEqual(self.suggester.suggest(u"a."), (u"A", 1.0))
+        self.assertEqual(self.suggester.suggest(u"B"), (None, 0.0))
+
+    def test_mapping(self):
+        df = Audit(street_alternatives=["RUE"]).mapping([u"-", u"Rue des lilas"], self.suggester)
+        self.assertEqual(list(df.OLD), [u"-", u"RUE DES LILAS"])
+        self.assertEqual(list(df.CHECK), [True, False])
+
+if __name__ == "__main__":
+    unittest.main()